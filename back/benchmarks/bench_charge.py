@@ -0,0 +1,333 @@
+# MonProjetDonDuSang_Backend/benchmarks/bench_charge.py
+
+# Suite de charge des endpoints, contre une base SQLite locale (fichier ou mémoire).
+# L'application est servie en processus via httpx.ASGITransport : aucune base MySQL
+# ni serveur n'est nécessaire. Les résultats (débit, p50/p95/p99, statuts HTTP par
+# endpoint) sont écrits en JSON, avec le commit courant, pour comparer deux versions.
+#
+# Scénarios :
+#   endpoints            chaque endpoint de lecture/écriture, sous concurrence
+#   pagination_profonde  offset vs curseur (after) à 0 %, 10 %, 50 % et 90 % de la table
+#   stats                /stats/ sous concurrence
+#   tempete_connexions   rafale de POST /token sur des comptes distincts
+#   contention_affectation
+#                        affectations concurrentes visant les mêmes propositions
+#
+# Usage (depuis back/) :
+#   python benchmarks/bench_charge.py
+#   python benchmarks/bench_charge.py --utilisateurs 100000 --demandes 500000 --sortie avant.json
+#   python benchmarks/bench_charge.py --scenarios stats,pagination_profonde --base memoire
+#   DATABASE_ASYNC=true python benchmarks/bench_charge.py
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench_login import percentile
+
+RACINE_BACK = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("endpoints", "pagination_profonde", "stats", "tempete_connexions", "contention_affectation")
+GROUPES = ("A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-")
+VILLES = ("Casablanca", "Rabat", "Marrakech", "Fès", "Tanger", "Agadir", "Meknès", "Oujda")
+URGENCES = ("critique", "élevée", "moyenne", "faible")
+MOT_DE_PASSE = "secret"
+TAILLE_LOT_INSERTION = 10000
+
+
+class Mesures:
+    """Latences et statuts HTTP regroupés par libellé d'endpoint."""
+
+    def __init__(self):
+        self.latences = {}
+        self.statuts = {}
+        self.durees = {}
+
+    async def requete(self, client, libelle, methode, url, **kwargs):
+        debut = time.perf_counter()
+        reponse = await client.request(methode, url, **kwargs)
+        self.latences.setdefault(libelle, []).append(time.perf_counter() - debut)
+        statuts = self.statuts.setdefault(libelle, {})
+        statuts[reponse.status_code] = statuts.get(reponse.status_code, 0) + 1
+        return reponse
+
+    def resultats(self):
+        return {
+            libelle: {
+                "n": len(latences),
+                "debit_req_s": round(len(latences) / self.durees[libelle], 1) if self.durees.get(libelle) else None,
+                "p50_ms": percentile(latences, 50),
+                "p95_ms": percentile(latences, 95),
+                "p99_ms": percentile(latences, 99),
+                "statuts": self.statuts[libelle],
+            }
+            for libelle, latences in self.latences.items()
+        }
+
+
+async def en_concurrence(mesures, libelle, fabriques, concurrence: int):
+    """Exécute les coroutines produites par `fabriques` avec au plus `concurrence` en vol."""
+    semaphore = asyncio.Semaphore(concurrence)
+
+    async def une(fabrique):
+        async with semaphore:
+            await fabrique()
+
+    debut = time.perf_counter()
+    await asyncio.gather(*(une(f) for f in fabriques))
+    mesures.durees[libelle] = mesures.durees.get(libelle, 0) + time.perf_counter() - debut
+
+
+# --- Jeu de données ---
+
+def inserer_par_lots(db, main, modele, lignes):
+    lot = []
+    for ligne in lignes:
+        lot.append(ligne)
+        if len(lot) >= TAILLE_LOT_INSERTION:
+            db.execute(main.insert(modele), lot)
+            lot = []
+    if lot:
+        db.execute(main.insert(modele), lot)
+    db.commit()
+
+
+def peupler(main, volumes: dict):
+    """Insère les volumes demandés directement en base (hors API) et réconcilie les compteurs."""
+    alea = random.Random(42)
+    hache = main.get_password_hash(MOT_DE_PASSE) # Un seul hachage bcrypt pour tous les comptes
+    debut = datetime.now() - timedelta(days=365)
+    db = main.SessionLocal()
+    try:
+        inserer_par_lots(db, main, main.GroupeSanguin, ({"nom_groupe": g} for g in GROUPES))
+        inserer_par_lots(db, main, main.Utilisateur, ({
+            "nom": f"Nom{i}", "prenom": f"Prenom{i}", "email": f"utilisateur{i}@bench.example.com",
+            "mot_de_passe_hache": hache, "role": "admin" if i == 1 else "normal",
+            "ville": alea.choice(VILLES), "id_groupe_sanguin": alea.randint(1, len(GROUPES)),
+            "date_naissance": datetime(1960, 1, 1).date() + timedelta(days=alea.randint(0, 16000)),
+            "genre": alea.choice(("M", "F")),
+        } for i in range(1, volumes["utilisateurs"] + 1)))
+        inserer_par_lots(db, main, main.DemandeDon, ({
+            "id_utilisateur": alea.randint(1, volumes["utilisateurs"]),
+            "id_groupe_sanguin_requis": alea.randint(1, len(GROUPES)), "quantite_demandee_ml": 450,
+            "date_demande": debut + timedelta(seconds=i * 30), "localisation_demande": alea.choice(VILLES),
+            "urgence": alea.choice(URGENCES), "statut": "en attente", "description": "Demande de benchmark",
+        } for i in range(volumes["demandes"])))
+        inserer_par_lots(db, main, main.PropositionDon, ({
+            "id_utilisateur": alea.randint(1, volumes["utilisateurs"]),
+            "date_proposition": debut + timedelta(seconds=i * 30), "localisation_proposition": alea.choice(VILLES),
+            "statut": "en attente",
+        } for i in range(volumes["propositions"])))
+        main.reconcilier_compteurs(db)
+    finally:
+        db.close()
+
+
+# --- Scénarios ---
+
+async def scenario_endpoints(client, main, volumes, args, admin):
+    mesures = Mesures()
+    alea = random.Random(1)
+    n = args.requetes
+
+    def au_hasard(maximum):
+        return alea.randint(1, maximum)
+
+    lectures = {
+        "GET /": lambda: "/",
+        "GET /groupesanguin/": lambda: "/groupesanguin/",
+        "GET /utilisateurs/": lambda: "/utilisateurs/?limit=100",
+        "GET /utilisateurs/{id}": lambda: f"/utilisateurs/{au_hasard(volumes['utilisateurs'])}",
+        "GET /propositionsdon/": lambda: "/propositionsdon/?limit=100",
+        "GET /propositionsdon/{id}": lambda: f"/propositionsdon/{au_hasard(volumes['propositions'])}",
+        "GET /demandesdon/": lambda: "/demandesdon/?limit=100",
+        "GET /demandesdon/{id}": lambda: f"/demandesdon/{au_hasard(volumes['demandes'])}",
+        "GET /affectationsdon/": lambda: "/affectationsdon/?limit=100",
+        "GET /admin/dashboard": lambda: "/admin/dashboard",
+        "GET /affectationsdon/suggestions": lambda: "/affectationsdon/suggestions?limite=20",
+    }
+    for libelle, url in lectures.items():
+        await en_concurrence(mesures, libelle, [
+            (lambda u=url(): mesures.requete(client, libelle, "GET", u, headers=admin)) for _ in range(n)
+        ], args.concurrence)
+
+    ecritures = {
+        "POST /demandesdon/": lambda: {
+            "id_utilisateur": au_hasard(volumes["utilisateurs"]), "id_groupe_sanguin_requis": au_hasard(len(GROUPES)),
+            "quantite_demandee_ml": 450, "urgence": alea.choice(URGENCES), "description": "Charge",
+        },
+        "POST /propositionsdon/": lambda: {"id_utilisateur": au_hasard(volumes["utilisateurs"])},
+    }
+    for libelle, corps in ecritures.items():
+        url = libelle.split(" ", 1)[1]
+        await en_concurrence(mesures, libelle, [
+            (lambda c=corps(): mesures.requete(client, libelle, "POST", url, json=c)) for _ in range(n)
+        ], args.concurrence)
+    return mesures.resultats()
+
+
+async def scenario_pagination_profonde(client, main, volumes, args, admin):
+    mesures = Mesures()
+    total = volumes["demandes"]
+    db = main.SessionLocal()
+    try:
+        for fraction in (0, 0.1, 0.5, 0.9):
+            profondeur = int(total * fraction)
+            curseur = ""
+            if profondeur:
+                # Curseur équivalent à l'offset : clé (date, id) de la ligne précédente
+                ligne = db.execute(
+                    main.select(main.DemandeDon.date_demande, main.DemandeDon.id)
+                    .order_by(main.DemandeDon.date_demande, main.DemandeDon.id).offset(profondeur - 1).limit(1)
+                ).first()
+                curseur = main.encoder_curseur(list(ligne))
+            for mode, params in (("offset", {"skip": profondeur}), ("curseur", {"after": curseur})):
+                libelle = f"GET /demandesdon/ {mode} {int(fraction * 100)}%"
+                await en_concurrence(mesures, libelle, [
+                    (lambda p=params: mesures.requete(client, libelle, "GET", "/demandesdon/", params=dict(p, limit=100)))
+                    for _ in range(args.requetes)
+                ], args.concurrence)
+    finally:
+        db.close()
+    return mesures.resultats()
+
+
+async def scenario_stats(client, main, volumes, args, admin):
+    mesures = Mesures()
+    await en_concurrence(mesures, "GET /stats/", [
+        (lambda: mesures.requete(client, "GET /stats/", "GET", "/stats/", headers=admin)) for _ in range(args.requetes)
+    ], args.concurrence)
+    return mesures.resultats()
+
+
+async def scenario_tempete_connexions(client, main, volumes, args, admin):
+    mesures = Mesures()
+    comptes = [f"utilisateur{i}@bench.example.com" for i in range(1, min(args.requetes, volumes["utilisateurs"]) + 1)]
+    await en_concurrence(mesures, "POST /token", [
+        (lambda e=email: mesures.requete(client, "POST /token", "POST", "/token", data={"username": e, "password": MOT_DE_PASSE}))
+        for email in comptes
+    ], args.concurrence)
+    return mesures.resultats()
+
+
+async def scenario_contention_affectation(client, main, volumes, args, admin):
+    """Chaque proposition visée est demandée par plusieurs couples concurrents : une seule affectation doit réussir."""
+    mesures = Mesures()
+    alea = random.Random(7)
+    propositions = list(range(1, min(volumes["propositions"], max(1, args.requetes // 4)) + 1))
+    couples = [
+        {"id_proposition_don": p, "id_demande_don": alea.randint(1, volumes["demandes"]), "id_administrateur": 1}
+        for p in propositions for _ in range(4)
+    ]
+    alea.shuffle(couples)
+    await en_concurrence(mesures, "POST /affectationsdon/", [
+        (lambda c=c: mesures.requete(client, "POST /affectationsdon/", "POST", "/affectationsdon/", json=c, headers=admin))
+        for c in couples
+    ], args.concurrence)
+    await en_concurrence(mesures, "POST /affectationsdon/auto", [
+        (lambda: mesures.requete(client, "POST /affectationsdon/auto", "POST", "/affectationsdon/auto?limite=10", headers=admin))
+        for _ in range(max(1, args.requetes // 10))
+    ], args.concurrence)
+
+    db = main.SessionLocal()
+    try:
+        creees = db.scalar(main.select(main.func.count(main.AffectationDon.id)).where(
+            main.AffectationDon.id_proposition_don.in_(propositions)
+        ))
+    finally:
+        db.close()
+    resultats = mesures.resultats()
+    # Invariant : au plus une affectation par proposition, quel que soit l'entrelacement
+    resultats["coherence"] = {"propositions_visees": len(propositions), "affectations_creees": creees, "ok": creees <= len(propositions)}
+    return resultats
+
+
+async def executer_scenarios(main, volumes, args):
+    import httpx
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await main.charger_cache_reference()
+        jeton = (await client.post("/token", data={"username": "utilisateur1@bench.example.com", "password": MOT_DE_PASSE})).json()
+        admin = {"Authorization": f"Bearer {jeton['access_token']}"}
+        resultats = {}
+        for nom in args.scenarios:
+            debut = time.perf_counter()
+            resultats[nom] = await globals()[f"scenario_{nom}"](client, main, volumes, args, admin)
+            print(f"{nom}: {time.perf_counter() - debut:.1f} s", file=sys.stderr)
+    return resultats
+
+
+def commit_courant():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RACINE_BACK, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Suite de charge des endpoints contre SQLite.")
+    parser.add_argument("--utilisateurs", type=int, default=10000)
+    parser.add_argument("--demandes", type=int, default=50000)
+    parser.add_argument("--propositions", type=int, default=20000)
+    parser.add_argument("--requetes", type=int, default=200, help="requêtes par endpoint et par scénario")
+    parser.add_argument("--concurrence", type=int, default=16)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="liste séparée par des virgules")
+    parser.add_argument("--base", choices=("fichier", "memoire"), default="fichier")
+    parser.add_argument("--sortie", help="fichier JSON de résultats (défaut : sortie standard)")
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    inconnus = set(args.scenarios) - set(SCENARIOS)
+    if inconnus:
+        parser.error(f"scénarios inconnus : {', '.join(sorted(inconnus))}")
+    volumes = {"utilisateurs": max(1, args.utilisateurs), "demandes": max(1, args.demandes), "propositions": max(1, args.propositions)}
+
+    # "memoire" : fichier SQLite sur tmpfs (/dev/shm). Une base ":memory:" n'est pas
+    # partageable entre les threads du pool utilisés par les endpoints.
+    parent = "/dev/shm" if args.base == "memoire" and os.path.isdir("/dev/shm") else None
+    with tempfile.TemporaryDirectory(dir=parent) as dossier:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(dossier, 'bench.db')}"
+        os.environ.setdefault("STATS_RECONCILIATION_SECONDES", "0")
+        os.environ.setdefault("SECRET_KEY", "bench-charge")
+        sys.path.insert(0, RACINE_BACK)
+        import main
+
+        main.migrer_schema()
+        debut = time.perf_counter()
+        peupler(main, volumes)
+        duree_peuplement = time.perf_counter() - debut
+        print(f"peuplement : {duree_peuplement:.1f} s", file=sys.stderr)
+
+        resultats = {
+            "meta": {
+                "commit": commit_courant(),
+                "date": datetime.now().isoformat(timespec="seconds"),
+                "base": args.base,
+                "async": main.DATABASE_ASYNC,
+                "volumes": volumes,
+                "requetes": args.requetes,
+                "concurrence": args.concurrence,
+                "peuplement_s": round(duree_peuplement, 1),
+            },
+            "scenarios": asyncio.run(executer_scenarios(main, volumes, args)),
+        }
+        main.obtenir_moteur().dispose()
+
+    sortie = json.dumps(resultats, indent=2, ensure_ascii=False)
+    if args.sortie:
+        with open(args.sortie, "w", encoding="utf-8") as fichier:
+            fichier.write(sortie + "\n")
+    else:
+        print(sortie)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,137 @@
+# MonProjetDonDuSang_Backend/benchmarks/bench_login.py
+
+# Micro-benchmark des connexions concurrentes (/token).
+# Mesure la latence des connexions et celle d'une requête légère (GET /)
+# envoyée pendant la rafale : si bcrypt bloque la boucle, la seconde explose.
+#
+# Usage (depuis back/) :
+#   python benchmarks/bench_login.py                      # compare avant / après
+#   python benchmarks/bench_login.py --workers 0          # hachage dans la boucle (avant)
+#   python benchmarks/bench_login.py --workers 4          # pool de hachage (après)
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+RACINE_BACK = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(valeurs, p):
+    valeurs = sorted(valeurs)
+    if not valeurs:
+        return None
+    index = min(len(valeurs) - 1, int(round(p / 100 * (len(valeurs) - 1))))
+    return round(valeurs[index] * 1000, 2)
+
+
+def resume(latences):
+    return {
+        "n": len(latences),
+        "p50_ms": percentile(latences, 50),
+        "p95_ms": percentile(latences, 95),
+        "p99_ms": percentile(latences, 99),
+    }
+
+
+async def mesurer(client, methode, url, latences, statuts, **kwargs):
+    debut = time.perf_counter()
+    reponse = await client.request(methode, url, **kwargs)
+    latences.append(time.perf_counter() - debut)
+    statuts[reponse.status_code] = statuts.get(reponse.status_code, 0) + 1
+
+
+async def scenario(connexions: int, concurrence: int):
+    import httpx
+    import main
+
+    main.migrer_schema()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/utilisateurs/", json={
+            "nom": "Bench", "prenom": "Login", "email": "bench@example.com", "mot_de_passe": "secret",
+        })
+        identifiants = {"username": "bench@example.com", "password": "secret"}
+
+        latences_login, latences_ping, statuts = [], [], {}
+        semaphore = asyncio.Semaphore(concurrence)
+
+        async def login():
+            async with semaphore:
+                await mesurer(client, "POST", "/token", latences_login, statuts, data=identifiants)
+
+        async def rafale():
+            await asyncio.gather(*(login() for _ in range(connexions)))
+
+        async def ping(tache_rafale):
+            # Latence mesurée depuis l'instant prévu : inclut le temps où la boucle est bloquée
+            intervalle = 0.01
+            prevu = time.perf_counter()
+            while not tache_rafale.done():
+                prevu = max(prevu + intervalle, time.perf_counter())
+                await asyncio.sleep(max(0, prevu - time.perf_counter()))
+                await client.get("/")
+                latences_ping.append(time.perf_counter() - prevu)
+
+        debut = time.perf_counter()
+        tache_rafale = asyncio.ensure_future(rafale())
+        await asyncio.gather(tache_rafale, ping(tache_rafale))
+        duree = time.perf_counter() - debut
+
+    return {
+        "hachage_workers": main.HACHAGE_MAX_WORKERS,
+        "bcrypt_rounds": main.BCRYPT_ROUNDS,
+        "concurrence": concurrence,
+        "duree_s": round(duree, 3),
+        "connexions_par_s": round(connexions / duree, 1),
+        "statuts": statuts,
+        "login": resume(latences_login),
+        "ping_pendant_rafale": resume(latences_ping),
+    }
+
+
+def executer(workers: int, connexions: int, concurrence: int) -> dict:
+    # Chaque configuration tourne dans un processus neuf (configuration lue à l'import)
+    with tempfile.TemporaryDirectory() as dossier:
+        env = dict(os.environ)
+        env.update({
+            "DATABASE_URL": f"sqlite:///{os.path.join(dossier, 'bench.db')}",
+            "HACHAGE_MAX_WORKERS": str(workers),
+            "STATS_RECONCILIATION_SECONDES": "0",
+            "SECRET_KEY": env.get("SECRET_KEY") or "bench-login",
+        })
+        sortie = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--workers", str(workers),
+             "--connexions", str(connexions), "--concurrence", str(concurrence), "--interne"],
+            env=env, cwd=RACINE_BACK, capture_output=True, text=True, check=True,
+        )
+    return json.loads(sortie.stdout.strip().splitlines()[-1])
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Micro-benchmark des connexions concurrentes (/token).")
+    parser.add_argument("--workers", type=int, default=None, help="HACHAGE_MAX_WORKERS (0 = dans la boucle)")
+    parser.add_argument("--connexions", type=int, default=200)
+    parser.add_argument("--concurrence", type=int, default=32)
+    parser.add_argument("--interne", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.interne:
+        sys.path.insert(0, RACINE_BACK)
+        print(json.dumps(asyncio.run(scenario(args.connexions, args.concurrence))))
+        return
+
+    configurations = [args.workers] if args.workers is not None else [0, min(4, os.cpu_count() or 1)]
+    resultats = {
+        ("avant" if w == 0 else "apres"): executer(w, args.connexions, args.concurrence)
+        for w in configurations
+    }
+    print(json.dumps(resultats, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,149 @@
+# MonProjetDonDuSang_Backend/benchmarks/bench_serialisation.py
+
+# Micro-benchmark de la sérialisation des pages de liste (/demandesdon/).
+# Compare, sur les mêmes pages :
+#   - avant : objets ORM complets -> validation du response_model -> JSON standard
+#             (le chemin par défaut de FastAPI)
+#   - après : colonnes du schéma en tuples -> dictionnaires -> orjson (reponse_liste)
+# puis mesure le débit de bout en bout de l'endpoint actuel.
+#
+# Usage (depuis back/) :
+#   python benchmarks/bench_serialisation.py
+#   python benchmarks/bench_serialisation.py --lignes 20000 --limit 100 --repetitions 5
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+RACINE_BACK = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peupler(main, lignes: int):
+    from datetime import datetime, timedelta
+
+    db = main.SessionLocal()
+    try:
+        db.add(main.GroupeSanguin(nom_groupe="A+"))
+        db.add(main.Utilisateur(nom="Bench", prenom="Serialisation", email="bench@example.com", mot_de_passe_hache="x"))
+        db.commit()
+        debut = datetime.now()
+        db.execute(main.insert(main.DemandeDon), [{
+            "id_utilisateur": 1, "id_groupe_sanguin_requis": 1, "quantite_demandee_ml": 450,
+            "date_demande": debut + timedelta(seconds=i), "localisation_demande": f"Hôpital {i % 50}",
+            "urgence": "moyenne", "statut": "en attente", "description": "Demande générée pour le benchmark",
+        } for i in range(lignes)])
+        db.commit()
+    finally:
+        db.close()
+
+
+def chronometrer(fonction, pages, repetitions: int):
+    """Meilleur temps sur `repetitions` passes complètes (moins sensible au bruit)."""
+    meilleur = None
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        total = sum(fonction(offset) for offset in pages)
+        duree = time.perf_counter() - debut
+        meilleur = duree if meilleur is None else min(meilleur, duree)
+    return total, meilleur
+
+
+def debit(lignes: int, duree: float) -> dict:
+    return {"lignes": lignes, "duree_s": round(duree, 4), "lignes_par_s": round(lignes / duree)}
+
+
+def mesurer_serialisation(main, limit: int, repetitions: int):
+    from typing import List
+    from pydantic import TypeAdapter
+
+    adaptateur = TypeAdapter(List[main.DemandeDonResponse])
+    colonnes = main.colonnes_reponse(main.DemandeDon, main.DemandeDonResponse)
+    tri = [main.DemandeDon.date_demande, main.DemandeDon.id]
+    db = main.SessionLocal()
+    try:
+        nombre = db.scalar(main.select(main.func.count(main.DemandeDon.id)))
+        pages = range(0, nombre, limit)
+
+        # Les pages sont lues une fois pour isoler le coût de la sérialisation
+        objets = {o: db.scalars(main.select(main.DemandeDon).order_by(*tri).offset(o).limit(limit)).all() for o in pages}
+        lignes = {o: db.execute(main.select(*colonnes).order_by(*tri).offset(o).limit(limit)).mappings().all() for o in pages}
+
+        def avant_serialisation(offset):
+            valeurs = adaptateur.validate_python(objets[offset])
+            json.dumps(adaptateur.dump_python(valeurs, mode="json"), ensure_ascii=False).encode()
+            return len(valeurs)
+
+        def apres_serialisation(offset):
+            main.reponse_liste(lignes[offset], main.Response())
+            return len(lignes[offset])
+
+        def avant_complet(offset):
+            db.expunge_all()
+            objets[offset] = db.scalars(main.select(main.DemandeDon).order_by(*tri).offset(offset).limit(limit)).all()
+            return avant_serialisation(offset)
+
+        def apres_complet(offset):
+            lignes[offset] = db.execute(main.select(*colonnes).order_by(*tri).offset(offset).limit(limit)).mappings().all()
+            return apres_serialisation(offset)
+
+        return {
+            "serialisation": {
+                "avant": debit(*chronometrer(avant_serialisation, pages, repetitions)),
+                "apres": debit(*chronometrer(apres_serialisation, pages, repetitions)),
+            },
+            "requete_et_serialisation": {
+                "avant": debit(*chronometrer(avant_complet, pages, repetitions)),
+                "apres": debit(*chronometrer(apres_complet, pages, repetitions)),
+            },
+        }
+    finally:
+        db.close()
+
+
+async def mesurer_endpoint(main, limit: int, repetitions: int):
+    import httpx
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        meilleur, total = None, 0
+        for _ in range(repetitions):
+            total, curseur = 0, ""
+            debut = time.perf_counter()
+            while curseur is not None:
+                reponse = await client.get("/demandesdon/", params={"limit": limit, "after": curseur})
+                total += len(reponse.json())
+                curseur = reponse.headers.get("x-next-cursor")
+            duree = time.perf_counter() - debut
+            meilleur = duree if meilleur is None else min(meilleur, duree)
+    return debit(total, meilleur)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Micro-benchmark de la sérialisation des listes.")
+    parser.add_argument("--lignes", type=int, default=10000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repetitions", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dossier:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(dossier, 'bench.db')}"
+        os.environ.setdefault("STATS_RECONCILIATION_SECONDES", "0")
+        os.environ.setdefault("SECRET_KEY", "bench-serialisation")
+        sys.path.insert(0, RACINE_BACK)
+        import main
+
+        main.migrer_schema()
+        peupler(main, args.lignes)
+        resultats = mesurer_serialisation(main, args.limit, args.repetitions)
+        resultats["endpoint_pagine"] = asyncio.run(mesurer_endpoint(main, args.limit, args.repetitions))
+        resultats["limit"] = args.limit
+        main.obtenir_moteur().dispose()
+    print(json.dumps(resultats, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main_cli()
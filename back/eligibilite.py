@@ -0,0 +1,60 @@
+# MonProjetDonDuSang_Backend/eligibilite.py
+
+"""Règles d'éligibilité au don de sang total : âge du donneur et délai depuis son dernier don."""
+
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+# Date d'éligibilité des donneurs sans contrainte (ni âge minimal connu, ni don récent)
+DATE_ORIGINE = date(1900, 1, 1)
+
+
+def normaliser_genre(genre: Optional[str]) -> Optional[str]:
+    """"F", "Femme", "féminin" -> "femme" ; "H", "M", "Homme", "masculin" -> "homme"."""
+    initiale = (genre or "").strip()[:1].lower()
+    if initiale == "f":
+        return "femme"
+    if initiale in ("h", "m"):
+        return "homme"
+    return None
+
+
+def anniversaire(naissance: date, age: int) -> date:
+    try:
+        return naissance.replace(year=naissance.year + age)
+    except ValueError:
+        # Né un 29 février
+        return date(naissance.year + age, 3, 1)
+
+
+class ReglesEligibilite:
+    def __init__(self, age_min: int = 18, age_max: int = 65,
+                 intervalle_homme_jours: int = 56, intervalle_femme_jours: int = 84):
+        self.age_min = age_min
+        self.age_max = age_max
+        self.intervalles = {"homme": intervalle_homme_jours, "femme": intervalle_femme_jours}
+
+    def intervalle(self, genre: Optional[str]) -> timedelta:
+        # Genre inconnu : on applique le délai le plus long
+        jours = self.intervalles.get(normaliser_genre(genre), max(self.intervalles.values()))
+        return timedelta(days=jours)
+
+    def periode(self, date_naissance: Optional[date], genre: Optional[str],
+                date_dernier_don: Optional[datetime], don_en_cours: bool) -> Tuple[Optional[date], Optional[date]]:
+        """
+        Retourne (eligible_du, eligible_jusqu_au) : le donneur est éligible le jour J si
+        eligible_du <= J < eligible_jusqu_au. eligible_du vaut None tant qu'un don est en
+        cours ; eligible_jusqu_au vaut None si la date de naissance est inconnue (l'âge
+        est alors vérifié lors de l'entretien pré-don).
+        """
+        if don_en_cours:
+            return None, None
+        debut = DATE_ORIGINE
+        fin = None
+        if date_naissance is not None:
+            debut = anniversaire(date_naissance, self.age_min)
+            fin = anniversaire(date_naissance, self.age_max + 1)
+        if date_dernier_don is not None:
+            jour_don = date_dernier_don.date() if isinstance(date_dernier_don, datetime) else date_dernier_don
+            debut = max(debut, jour_don + self.intervalle(genre))
+        return debut, fin
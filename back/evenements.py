@@ -0,0 +1,143 @@
+# MonProjetDonDuSang_Backend/evenements.py
+
+"""Bus d'événements vers les abonnés WebSocket / SSE (une file bornée par abonné) et relais entre workers."""
+
+import asyncio
+import secrets
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Champs sur lesquels un abonné peut filtrer (paramètre de requête -> clé d'événement)
+CHAMPS_FILTRABLES = ("id_groupe_sanguin", "ville", "urgence")
+
+
+def _normaliser(valeur):
+    return str(valeur).strip().lower() if valeur is not None else None
+
+
+class Abonnement:
+    def __init__(self, filtres: Dict[str, str], types: Optional[set], taille_file: int):
+        self.filtres = {cle: _normaliser(v) for cle, v in filtres.items() if v is not None}
+        self.types = types
+        self.file: asyncio.Queue = asyncio.Queue(maxsize=taille_file)
+        self.perdus = 0
+
+    def accepte(self, evenement: dict) -> bool:
+        """Un filtre n'écarte que les événements portant une autre valeur pour ce champ."""
+        if self.types and evenement.get("type") not in self.types:
+            return False
+        for cle, attendu in self.filtres.items():
+            valeur = _normaliser(evenement.get(cle))
+            if valeur is not None and valeur != attendu:
+                return False
+        return True
+
+    def deposer(self, evenement: dict):
+        if self.file.full():
+            # Client lent : on sacrifie l'événement le plus ancien
+            self.file.get_nowait()
+            self.perdus += 1
+        self.file.put_nowait(evenement)
+
+    async def suivant(self) -> dict:
+        if self.perdus:
+            perdus, self.perdus = self.perdus, 0
+            return {"type": "evenements_perdus", "nombre": perdus}
+        return await self.file.get()
+
+
+class BusEvenements:
+    def __init__(self, taille_file: int = 100):
+        self.taille_file = taille_file
+        self.abonnements = set()
+        self._boucle: Optional[asyncio.AbstractEventLoop] = None
+        self._verrou = threading.Lock()
+
+    def abonner(self, filtres: Dict[str, str], types: Optional[set] = None) -> Abonnement:
+        """À appeler depuis la boucle asyncio qui servira l'abonné."""
+        self._boucle = asyncio.get_running_loop()
+        abonnement = Abonnement(filtres, types, self.taille_file)
+        with self._verrou:
+            self.abonnements.add(abonnement)
+        return abonnement
+
+    def desabonner(self, abonnement: Abonnement):
+        with self._verrou:
+            self.abonnements.discard(abonnement)
+
+    def publier(self, evenement: dict):
+        """Publie un événement ; utilisable depuis la boucle ou depuis un thread du pool."""
+        if not self.abonnements or self._boucle is None:
+            return
+        try:
+            dans_la_boucle = asyncio.get_running_loop() is self._boucle
+        except RuntimeError:
+            dans_la_boucle = False
+        if dans_la_boucle:
+            self._distribuer(evenement)
+        elif not self._boucle.is_closed():
+            self._boucle.call_soon_threadsafe(self._distribuer, evenement)
+
+    def _distribuer(self, evenement: dict):
+        with self._verrou:
+            abonnements = list(self.abonnements)
+        for abonnement in abonnements:
+            if abonnement.accepte(evenement):
+                abonnement.deposer(evenement)
+
+
+class RelaisEvenements:
+    """
+    Relais entre processus au travers d'un journal partagé (la base) : les événements
+    publiés localement attendent d'y être écrits, ceux des autres origines relus du
+    journal sont distribués au bus local. La relecture reprend quelques lectures en
+    arrière (`fenetre`) : une ligne validée après une ligne plus récente n'est pas
+    perdue, et les identifiants déjà vus ne sont pas redistribués.
+    """
+
+    def __init__(self, bus: BusEvenements, fenetre: int = 3, sortants_max: int = 10000):
+        self.bus = bus
+        self.origine = secrets.token_hex(8)
+        self._sortants = deque(maxlen=sortants_max) # Base injoignable : les plus anciens sont sacrifiés
+        self._bornes = deque(maxlen=fenetre)
+        self._vus = set()
+        self.dernier_id: Optional[int] = None
+
+    def envoyer(self, evenement: dict):
+        self._sortants.append(evenement)
+
+    def a_envoyer(self) -> List[dict]:
+        evenements = []
+        while self._sortants:
+            evenements.append(self._sortants.popleft())
+        return evenements
+
+    def reprendre(self, evenements: List[dict]):
+        """Remet en tête des envois les événements d'une écriture qui a échoué."""
+        self._sortants.extendleft(reversed(evenements))
+
+    def demarrer(self, dernier_id: int):
+        """Point de départ de la lecture : les lignes déjà journalisées ne sont pas rejouées."""
+        self.dernier_id = dernier_id
+        self._bornes.clear()
+        self._vus.clear()
+
+    def borne(self) -> int:
+        """Identifiant à partir duquel relire (exclu)."""
+        return self._bornes[0] if self._bornes else self.dernier_id
+
+    def recevoir(self, lignes: Iterable[Tuple[int, str, dict]]):
+        """Lignes (id, origine, événement) lues au-delà de borne(), par id croissant."""
+        borne = self.borne()
+        for id_ligne, origine, evenement in lignes:
+            if id_ligne in self._vus:
+                continue
+            self._vus.add(id_ligne)
+            self.dernier_id = max(self.dernier_id, id_ligne)
+            if origine != self.origine:
+                self.bus.publier(evenement)
+        self._bornes.append(self.dernier_id)
+        nouvelle_borne = self.borne()
+        if nouvelle_borne != borne:
+            self._vus = {i for i in self._vus if i > nouvelle_borne}
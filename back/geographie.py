@@ -0,0 +1,207 @@
+# MonProjetDonDuSang_Backend/geographie.py
+
+"""Géocodage hors ligne des localisations (répertoire des villes du Maroc) et grille spatiale."""
+
+import math
+import re
+import unicodedata
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+Position = Tuple[float, float] # (latitude, longitude) en degrés
+
+RAYON_TERRE_KM = 6371.0
+
+# --- Répertoire des villes (centre-ville approximatif) ---
+VILLES = {
+    "Casablanca": (33.5731, -7.5898),
+    "Rabat": (34.0209, -6.8416),
+    "Salé": (34.0531, -6.7985),
+    "Témara": (33.9287, -6.9063),
+    "Skhirat": (33.8527, -7.0300),
+    "Mohammedia": (33.6866, -7.3830),
+    "Bouskoura": (33.4489, -7.6486),
+    "Berrechid": (33.2655, -7.5875),
+    "Settat": (33.0010, -7.6166),
+    "El Jadida": (33.2316, -8.5007),
+    "Khouribga": (32.8811, -6.9063),
+    "Béni Mellal": (32.3373, -6.3498),
+    "Khénifra": (32.9394, -5.6675),
+    "Kénitra": (34.2610, -6.5802),
+    "Sidi Kacem": (34.2260, -5.7079),
+    "Sidi Slimane": (34.2648, -5.9255),
+    "Khémisset": (33.8241, -6.0663),
+    "Meknès": (33.8935, -5.5473),
+    "Ifrane": (33.5228, -5.1106),
+    "Azrou": (33.4342, -5.2213),
+    "Fès": (34.0181, -5.0078),
+    "Taza": (34.2133, -4.0103),
+    "Guercif": (34.2257, -3.3536),
+    "Taourirt": (34.4073, -2.8973),
+    "Oujda": (34.6814, -1.9086),
+    "Berkane": (34.9200, -2.3200),
+    "Nador": (35.1681, -2.9335),
+    "Al Hoceïma": (35.2517, -3.9372),
+    "Chefchaouen": (35.1688, -5.2636),
+    "Tétouan": (35.5889, -5.3626),
+    "Tanger": (35.7595, -5.8340),
+    "Larache": (35.1932, -6.1557),
+    "Ksar El Kébir": (35.0017, -5.9093),
+    "Marrakech": (31.6295, -7.9811),
+    "Benguerir": (32.2359, -7.9541),
+    "Youssoufia": (32.2463, -8.5289),
+    "Safi": (32.2994, -9.2372),
+    "Essaouira": (31.5085, -9.7595),
+    "Agadir": (30.4278, -9.5981),
+    "Inezgane": (30.3555, -9.5372),
+    "Taroudant": (30.4703, -8.8770),
+    "Tiznit": (29.6974, -9.7316),
+    "Ouarzazate": (30.9335, -6.9370),
+    "Errachidia": (31.9314, -4.4244),
+    "Guelmim": (28.9870, -10.0574),
+    "Tan-Tan": (28.4380, -11.1032),
+    "Laâyoune": (27.1253, -13.1625),
+    "Dakhla": (23.6848, -15.9580),
+}
+
+# Graphies courantes (français, anglais, abréviations)
+ALIAS = {
+    "Casa": "Casablanca", "Dar El Beida": "Casablanca",
+    "Fez": "Fès", "Tangier": "Tanger", "Tangiers": "Tanger",
+    "Marrakesh": "Marrakech", "Tetuan": "Tétouan", "Al Hoceima": "Al Hoceïma",
+    "Laayoune": "Laâyoune", "El Aaiun": "Laâyoune", "Temara": "Témara",
+}
+
+
+def normaliser(texte: str) -> str:
+    """Minuscules, sans accents ni ponctuation : "Fès-Médina" -> "fes medina"."""
+    texte = unicodedata.normalize("NFKD", texte).encode("ascii", "ignore").decode()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", texte.lower()).split())
+
+
+_REPERTOIRE: Dict[str, Position] = {normaliser(nom): pos for nom, pos in VILLES.items()}
+_REPERTOIRE.update({normaliser(alias): VILLES[nom] for alias, nom in ALIAS.items()})
+# Les noms les plus longs d'abord : "ksar el kebir" avant un éventuel "el kebir"
+_NOMS_PAR_LONGUEUR = sorted(_REPERTOIRE, key=len, reverse=True)
+_COORDONNEES = re.compile(r"^\s*(-?\d{1,2}(?:\.\d+)?)\s*[,;]\s*(-?\d{1,3}(?:\.\d+)?)\s*$")
+
+
+def geocoder(texte: Optional[str]) -> Optional[Position]:
+    """
+    Résout une localisation libre : coordonnées "lat, lon", nom de ville exact,
+    ou nom de ville contenu dans le texte. None si rien n'est reconnu.
+    """
+    if not texte:
+        return None
+    correspondance = _COORDONNEES.match(texte)
+    if correspondance:
+        latitude, longitude = float(correspondance.group(1)), float(correspondance.group(2))
+        if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+            return latitude, longitude
+        return None
+    cle = normaliser(texte)
+    if cle in _REPERTOIRE:
+        return _REPERTOIRE[cle]
+    encadre = f" {cle} "
+    for nom in _NOMS_PAR_LONGUEUR:
+        if f" {nom} " in encadre:
+            return _REPERTOIRE[nom]
+    return None
+
+
+def premiere_position(*candidats) -> Optional[Position]:
+    """Première position résolue parmi des positions ou des textes, dans l'ordre donné."""
+    for candidat in candidats:
+        position = candidat if isinstance(candidat, tuple) else geocoder(candidat)
+        if position is not None and None not in position:
+            return position
+    return None
+
+
+def distance_km(a: Position, b: Position) -> float:
+    """Distance orthodromique (haversine)."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RAYON_TERRE_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+class IndexSpatial:
+    """
+    Grille de cellules de `taille_cellule` degrés. Les éléments partageant les mêmes
+    coordonnées (même ville) sont regroupés en un point, puis rangés par clé (groupe
+    sanguin) dans l'ordre d'insertion : une recherche ne calcule qu'une distance par
+    point distinct et ne parcourt que les éléments qu'elle renvoie.
+    """
+
+    def __init__(self, taille_cellule: float = 0.25):
+        self.taille_cellule = taille_cellule
+        # cellule -> point -> clé -> {id: None} (dict ordonné utilisé comme ensemble)
+        self._cellules: Dict[Tuple[int, int], Dict[Position, Dict[int, Dict[int, None]]]] = {}
+        self._emplacements: Dict[int, Tuple[Tuple[int, int], Position, int]] = {}
+
+    def __len__(self):
+        return len(self._emplacements)
+
+    def _cellule(self, position: Position) -> Tuple[int, int]:
+        return math.floor(position[0] / self.taille_cellule), math.floor(position[1] / self.taille_cellule)
+
+    def ajouter(self, identifiant: int, position: Position, cle: int):
+        if identifiant in self._emplacements:
+            return
+        position = (float(position[0]), float(position[1]))
+        cellule = self._cellule(position)
+        self._cellules.setdefault(cellule, {}).setdefault(position, {}).setdefault(cle, {})[identifiant] = None
+        self._emplacements[identifiant] = (cellule, position, cle)
+
+    def retirer(self, identifiant: int):
+        emplacement = self._emplacements.pop(identifiant, None)
+        if emplacement is None:
+            return
+        cellule, position, cle = emplacement
+        points = self._cellules[cellule]
+        elements = points[position][cle]
+        del elements[identifiant]
+        if not elements:
+            del points[position][cle]
+            if not points[position]:
+                del points[position]
+                if not points:
+                    del self._cellules[cellule]
+
+    def proches(self, centre: Position, rayon_km: float, cles: Iterable[int], limite: int,
+                vivant: Callable[[int], bool] = lambda _: True) -> List[Tuple[int, float]]:
+        """
+        Jusqu'à `limite` couples (id, distance_km) dans le rayon, par distance croissante ;
+        à distance égale, dans l'ordre des `cles` puis d'insertion.
+        """
+        cles = list(cles)
+        delta_lat = rayon_km / 111.32
+        delta_lon = rayon_km / (111.32 * max(0.01, math.cos(math.radians(centre[0]))))
+        i_min, j_min = self._cellule((centre[0] - delta_lat, centre[1] - delta_lon))
+        i_max, j_max = self._cellule((centre[0] + delta_lat, centre[1] + delta_lon))
+
+        points = []
+        if (i_max - i_min + 1) * (j_max - j_min + 1) > len(self._cellules):
+            # Rayon très large : moins coûteux de parcourir les cellules occupées
+            cellules = (c for (i, j), c in self._cellules.items() if i_min <= i <= i_max and j_min <= j <= j_max)
+        else:
+            cellules = (self._cellules.get((i, j)) for i in range(i_min, i_max + 1) for j in range(j_min, j_max + 1))
+        for contenu in cellules:
+            for position, par_cle in (contenu or {}).items():
+                if not any(c in par_cle for c in cles):
+                    continue
+                distance = distance_km(centre, position)
+                if distance <= rayon_km:
+                    points.append((distance, position))
+        points.sort()
+
+        resultats = []
+        for distance, position in points:
+            cellule = self._cellule(position)
+            par_cle = self._cellules[cellule][position]
+            for cle in cles:
+                for identifiant in par_cle.get(cle, ()):
+                    if vivant(identifiant):
+                        resultats.append((identifiant, round(distance, 3)))
+                        if len(resultats) >= limite:
+                            return resultats
+        return resultats
@@ -1,27 +1,60 @@
 # MonProjetDonDuSang_Backend/main.py
 
 # Importations nécessaires pour FastAPI, la base de données et la sécurité
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, status, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy import create_engine, Column, Integer, String, Date, DateTime, Text, text, func
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event, inspect, Column, Integer, Float, Boolean, String, Date, DateTime, Text, Index, text, func, and_, or_, select, insert, update, delete, literal, null, cast, union_all
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError, TimeoutError as DelaiPoolDepasse
+from sqlalchemy.engine import make_url
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+from sqlalchemy.dialects.mysql import insert as insert_mysql
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from dotenv import load_dotenv
 import os
 from datetime import datetime, date, timedelta
 from typing import List, Optional
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr, ValidationError
 from passlib.context import CryptContext
 import json
+import csv
+import hmac
+import hashlib
+import secrets
+import time
+import io
+import base64
+import orjson
+import asyncio
+from contextlib import asynccontextmanager
+import threading
+import contextvars
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from matching import MoteurAffectation
+from evenements import BusEvenements, RelaisEvenements
+from metriques import Metriques, MesureRequete
+from geographie import premiere_position
+from eligibilite import ReglesEligibilite
 
 # NOUVELLE IMPORTATION POUR CORS
 from fastapi.middleware.cors import CORSMiddleware 
+from fastapi.responses import StreamingResponse, ORJSONResponse, PlainTextResponse
 
 # Charger les variables d'environnement
 load_dotenv()
 
-# Initialisation de FastAPI
-app = FastAPI()
+journal = logging.getLogger("dondusang")
+
+# Les routes et les événements sont déclarés sur un routeur ; l'application est
+# construite par create_app() (en fin de module), sans connexion à la base : les
+# moteurs sont créés dans chaque worker au premier usage.
+router = APIRouter()
 
 # --- Configuration CORS ---
 # Liste des origines (domaines et ports) autorisées à faire des requêtes vers votre API.
@@ -32,22 +65,52 @@ origins = [
     # Ajoutez d'autres origines si votre frontend est hébergé ailleurs ou sur un autre port
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins, # Liste des origines autorisées
-    allow_credentials=True, # Autoriser les cookies, les en-têtes d'autorisation, etc.
-    allow_methods=["*"],    # Autoriser toutes les méthodes HTTP (GET, POST, PUT, DELETE, etc.)
-    allow_headers=["*"],    # Autoriser tous les en-têtes HTTP dans la requête
-)
+def configurer_cors(application: FastAPI):
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins, # Liste des origines autorisées
+        allow_credentials=True, # Autoriser les cookies, les en-têtes d'autorisation, etc.
+        allow_methods=["*"],    # Autoriser toutes les méthodes HTTP (GET, POST, PUT, DELETE, etc.)
+        allow_headers=["*"],    # Autoriser tous les en-têtes HTTP dans la requête
+        expose_headers=["X-Next-Cursor"], # En-têtes de réponse lisibles par le frontend
+    )
 # --- FIN Configuration CORS ---
 
 
 # Configuration du hachage de mot de passe (bcrypt est recommandé)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-# OAuth2PasswordBearer pour l'authentification (utilisé comme un placeholder pour JWT)
+# BCRYPT_ROUNDS : facteur de coût ; les anciens hachages sont mis à jour à la connexion.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt coûte des dizaines de ms de CPU : il est exécuté dans un pool de threads
+# borné (bcrypt libère le GIL). Au-delà de HACHAGE_FILE_MAX tâches en attente,
+# l'API répond immédiatement 503. HACHAGE_MAX_WORKERS=0 hache dans la boucle.
+HACHAGE_MAX_WORKERS = int(os.getenv("HACHAGE_MAX_WORKERS", str(min(4, os.cpu_count() or 1))))
+HACHAGE_FILE_MAX = int(os.getenv("HACHAGE_FILE_MAX", "64"))
+pool_hachage = ThreadPoolExecutor(max_workers=HACHAGE_MAX_WORKERS, thread_name_prefix="hachage") if HACHAGE_MAX_WORKERS > 0 else None
+taches_hachage_en_cours = 0
+
+# OAuth2PasswordBearer pour l'authentification : jetons signés HMAC-SHA256 (voir creer_jeton_acces)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# SECRET_KEY doit être identique sur tous les workers : une clé propre à chaque
+# processus ferait rejeter par les autres les jetons qu'il émet. Sans elle, l'import
+# échoue ; seul le lancement direct (python main.py, un processus) génère une clé
+# temporaire, invalidée au redémarrage. Le .env versionné fournit une clé de
+# développement, signalée au démarrage si elle atteint un autre environnement.
+SECRET_KEY_DEVELOPPEMENT = "developpement-a-remplacer"
+SECRET_KEY = os.getenv("SECRET_KEY")
+if not SECRET_KEY:
+    if __name__ != "__main__":
+        raise RuntimeError("SECRET_KEY non définie : renseignez-la (identique sur tous les workers) dans l'environnement ou .env")
+    journal.warning("SECRET_KEY non définie, utilisation d'une clé temporaire.")
+    SECRET_KEY = secrets.token_urlsafe(32)
+elif SECRET_KEY == SECRET_KEY_DEVELOPPEMENT:
+    journal.warning("SECRET_KEY de développement (back/.env) : à remplacer en production.")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+AUTH_CACHE_TTL_SECONDES = float(os.getenv("AUTH_CACHE_TTL_SECONDES", "30"))
+AUTH_CACHE_TAILLE_MAX = int(os.getenv("AUTH_CACHE_TAILLE_MAX", "10000"))
+
 # --- Fonctions d'authentification et de hachage ---
 def verify_password(plain_password, hashed_password):
     """Vérifie si un mot de passe en clair correspond à un mot de passe haché."""
@@ -57,21 +120,324 @@ def get_password_hash(password):
     """Hache un mot de passe en clair."""
     return pwd_context.hash(password)
 
+def _b64(donnees: bytes) -> str:
+    return base64.urlsafe_b64encode(donnees).decode().rstrip("=")
+
+def _signature(charge_utile: str) -> str:
+    return _b64(hmac.new(SECRET_KEY.encode(), charge_utile.encode(), hashlib.sha256).digest())
+
+def creer_jeton_acces(donnees: dict) -> str:
+    """Crée un jeton "charge_utile.signature" signé HMAC-SHA256, avec expiration."""
+    donnees = dict(donnees, exp=int(time.time()) + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    charge_utile = _b64(orjson.dumps(donnees))
+    return f"{charge_utile}.{_signature(charge_utile)}"
+
+def verifier_jeton_acces(jeton: str) -> Optional[dict]:
+    """Retourne le contenu d'un jeton valide et non expiré, sinon None (vérification en mémoire)."""
+    charge_utile, _, signature = jeton.partition(".")
+    if not signature or not hmac.compare_digest(signature, _signature(charge_utile)):
+        return None
+    try:
+        donnees = orjson.loads(base64.urlsafe_b64decode(charge_utile + "=" * (-len(charge_utile) % 4)))
+    except (ValueError, orjson.JSONDecodeError):
+        return None
+    if not isinstance(donnees, dict) or donnees.get("exp", 0) < time.time():
+        return None
+    return donnees
+
+async def executer_hachage(fonction, *args):
+    """Exécute une opération bcrypt dans le pool dédié, avec contre-pression."""
+    global taches_hachage_en_cours
+    if pool_hachage is None:
+        return fonction(*args)
+    if taches_hachage_en_cours >= HACHAGE_MAX_WORKERS + HACHAGE_FILE_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Serveur saturé, veuillez réessayer dans un instant.",
+            headers={"Retry-After": "1"},
+        )
+    taches_hachage_en_cours += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool_hachage, fonction, *args)
+    finally:
+        taches_hachage_en_cours -= 1
+
 # --- Configuration de la Base de Données ---
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL n'est pas définie dans le fichier .env")
 
-engine = create_engine(DATABASE_URL)
-Base = declarative_base()
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Mode asynchrone (DATABASE_ASYNC=true) : les endpoints utilisent un AsyncSession
+# et un pilote asynchrone (aiomysql, aiosqlite). Sinon la session synchrone est
+# utilisée via SessionDeportee, qui exécute chaque appel dans le pool de threads.
+DATABASE_ASYNC = os.getenv("DATABASE_ASYNC", "false").lower() in ("1", "true", "yes")
+PILOTES_ASYNCHRONES = {
+    "mysql+pymysql://": "mysql+aiomysql://",
+    "mysql://": "mysql+aiomysql://",
+    "sqlite://": "sqlite+aiosqlite://",
+}
+
+def url_asynchrone(url: str) -> str:
+    for prefixe, remplacement in PILOTES_ASYNCHRONES.items():
+        if url.startswith(prefixe):
+            return remplacement + url[len(prefixe):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or url_asynchrone(DATABASE_URL)
+
+# --- Pool de connexions ---
+# Taille, débordement, délai d'attente, recyclage et pre-ping sont réglables.
+# DB_POOL_RECYCLE doit rester inférieur au wait_timeout de MySQL (28800 s par
+# défaut) ; le pre-ping écarte les connexions coupées côté serveur.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+class MesureAttentePool:
+    """Chronomètre l'obtention des connexions (attente dans la file et ouverture éventuelle)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._verrou_statistiques = threading.Lock()
+        self.attentes = 0
+        self.attente_totale = 0.0
+        self.attente_max = 0.0
+        self.delais_depasses = 0
+
+    def connect(self):
+        debut = time.perf_counter()
+        depasse = False
+        try:
+            return super().connect()
+        except DelaiPoolDepasse:
+            depasse = True
+            raise
+        finally:
+            attente = time.perf_counter() - debut
+            with self._verrou_statistiques:
+                self.attentes += 1
+                self.attente_totale += attente
+                self.attente_max = max(self.attente_max, attente)
+                self.delais_depasses += depasse
+
+class QueuePoolMesure(MesureAttentePool, QueuePool):
+    pass
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+class AsyncAdaptedQueuePoolMesure(MesureAttentePool, AsyncAdaptedQueuePool):
+    pass
+
+def options_pool(url: str, classe_pool) -> dict:
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and (url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"):
+        return {} # Base en mémoire : pool propre à SQLite, non dimensionnable
+    return {
+        "poolclass": classe_pool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+def statistiques_pool(moteur) -> dict:
+    pool = moteur.pool
+    if not isinstance(pool, QueuePool):
+        return {"type": type(pool).__name__}
+    return {
+        "type": type(pool).__name__,
+        "taille": pool.size(),
+        "utilisees": pool.checkedout(),
+        "disponibles": pool.checkedin(),
+        "debordement": max(0, pool.overflow()),
+        "debordement_max": DB_MAX_OVERFLOW,
+        "attentes": getattr(pool, "attentes", None),
+        "attente_totale_s": round(getattr(pool, "attente_totale", 0.0), 6),
+        "attente_max_s": round(getattr(pool, "attente_max", 0.0), 6),
+        "delais_depasses": getattr(pool, "delais_depasses", None),
+    }
+
+# --- Moteurs par processus ---
+# Les moteurs (et leurs pools) sont créés au premier usage dans le processus courant :
+# rien n'est ouvert à l'import, et un worker forké après l'import (gunicorn --preload)
+# ne réutilise jamais les connexions de son parent. SessionLocal et AsyncSessionLocal
+# sont liés au moteur du processus par initialiser_moteurs().
+engine = None
+async_engine = None
+_pid_moteurs = None
+_verrou_moteurs = threading.Lock()
+Base = declarative_base()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False)
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+def initialiser_moteurs():
+    global engine, async_engine, _pid_moteurs
+    if _pid_moteurs == os.getpid():
+        return
+    with _verrou_moteurs:
+        if _pid_moteurs == os.getpid():
+            return
+        # Moteurs hérités du parent : on abandonne leurs connexions sans les fermer
+        if engine is not None:
+            engine.dispose(close=False)
+        if async_engine is not None:
+            async_engine.sync_engine.dispose(close=False)
+        engine = create_engine(DATABASE_URL, **options_pool(DATABASE_URL, QueuePoolMesure))
+        instrumenter_moteur(engine)
+        SessionLocal.configure(bind=engine)
+        if DATABASE_ASYNC:
+            async_engine = create_async_engine(ASYNC_DATABASE_URL, **options_pool(ASYNC_DATABASE_URL, AsyncAdaptedQueuePoolMesure))
+            instrumenter_moteur(async_engine.sync_engine)
+            AsyncSessionLocal.configure(bind=async_engine)
+        _pid_moteurs = os.getpid()
+
+def obtenir_moteur():
+    initialiser_moteurs()
+    return engine
+
+def obtenir_moteur_async():
+    initialiser_moteurs()
+    return async_engine
+
+def ouvrir_session() -> Session:
+    """Session synchrone hors requête (tâches de fond, scripts)."""
+    initialiser_moteurs()
+    return SessionLocal()
+
+class SessionDeportee:
+    """Expose l'interface d'AsyncSession au-dessus d'une Session synchrone."""
+
+    def __init__(self, session: Session):
+        self.sync_session = session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def run_sync(self, fonction, *args, **kwargs):
+        return await run_in_threadpool(fonction, self.sync_session, *args, **kwargs)
+
+    async def execute(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.execute, *args, **kwargs)
+
+    async def scalar(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, *args, **kwargs)
+
+    async def scalars(self, *args, **kwargs):
+        resultat = await run_in_threadpool(self.sync_session.execute, *args, **kwargs)
+        return resultat.scalars()
+
+    async def get(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, *args, **kwargs)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def refresh(self, instance):
+        await run_in_threadpool(self.sync_session.refresh, instance)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+async def get_db():
+    initialiser_moteurs()
+    if DATABASE_ASYNC:
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = SessionDeportee(SessionLocal())
+        try:
+            yield db
+        finally:
+            await db.close()
+
+
+# --- Instrumentation (métriques par route, SQL, requêtes lentes) ---
+# Chaque requête HTTP porte une MesureRequete (contextvar, propagée aux threads du
+# pool et aux greenlets du mode asynchrone) que les événements du moteur alimentent.
+# Agrégats exposés au format Prometheus sur /metrics.
+# REQUETE_LENTE_SECONDES > 0 : journalise les requêtes lentes avec leurs instructions SQL.
+# SQL_BUDGET_REQUETES : avertit quand une route dépasse ce nombre de requêtes SQL.
+REQUETE_LENTE_SECONDES = float(os.getenv("REQUETE_LENTE_SECONDES", "0"))
+SQL_BUDGET_REQUETES = int(os.getenv("SQL_BUDGET_REQUETES", "8"))
+# Budgets propres à certaines routes ("METHODE /chemin" -> nombre, None = pas de budget)
+SQL_BUDGETS_ROUTES = {
+    "POST /propositionsdon/bulk": None, # Quelques requêtes par lot d'import
+    "POST /demandesdon/bulk": None,
+}
+
+metriques = Metriques()
+mesure_courante: contextvars.ContextVar[Optional[MesureRequete]] = contextvars.ContextVar("mesure_courante", default=None)
+
+def _debut_instruction(conn, cursor, statement, parameters, context, executemany):
+    if mesure_courante.get() is not None:
+        conn.info["debut_instruction"] = time.perf_counter()
+
+def _fin_instruction(conn, cursor, statement, parameters, context, executemany):
+    mesure = mesure_courante.get()
+    debut = conn.info.pop("debut_instruction", None)
+    if mesure is not None and debut is not None:
+        mesure.ajouter(statement, time.perf_counter() - debut, cursor.rowcount)
+
+def instrumenter_moteur(moteur):
+    event.listen(moteur, "before_cursor_execute", _debut_instruction)
+    event.listen(moteur, "after_cursor_execute", _fin_instruction)
+
+class MiddlewareMetriques:
+    """Middleware ASGI : mesure la requête jusqu'au dernier octet envoyé (flux compris)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        mesure = MesureRequete(capturer_instructions=REQUETE_LENTE_SECONDES > 0)
+        jeton = mesure_courante.set(mesure)
+        statut = 500
+        debut = time.perf_counter()
+
+        async def envoyer(message):
+            nonlocal statut
+            if message["type"] == "http.response.start":
+                statut = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, envoyer)
+        finally:
+            mesure_courante.reset(jeton)
+            terminer_mesure(scope, statut, time.perf_counter() - debut, mesure)
+
+def terminer_mesure(scope, statut: int, duree: float, mesure: MesureRequete):
+    route = scope.get("route")
+    methode, chemin = scope["method"], getattr(route, "path", "non_routee")
+    cle = f"{methode} {chemin}"
+    budget = SQL_BUDGETS_ROUTES.get(cle, SQL_BUDGET_REQUETES)
+    budget_depasse = bool(budget) and mesure.requetes_sql > budget
+    metriques.enregistrer(methode, chemin, statut, duree, mesure, budget_depasse)
+
+    if budget_depasse:
+        journal.warning("Budget SQL dépassé : %s a exécuté %d requêtes (budget %d)", cle, mesure.requetes_sql, budget)
+    if REQUETE_LENTE_SECONDES > 0 and duree >= REQUETE_LENTE_SECONDES:
+        instructions = "\n".join(
+            f"  {duree_sql * 1000:.1f} ms  {' '.join(instruction.split())[:500]}"
+            for duree_sql, instruction in sorted(mesure.instructions, reverse=True)
+        )
+        journal.warning(
+            "Requête lente : %s %s -> %d en %.3f s (%d requêtes SQL, %.3f s SQL)\n%s",
+            methode, scope["path"], statut, duree, mesure.requetes_sql, mesure.duree_sql, instructions,
+        )
 
 
 # --- Modèles de Données SQLAlchemy (ORM) ---
@@ -94,7 +460,23 @@ class Utilisateur(Base):
     telephone = Column(String(20))
     date_naissance = Column(Date)
     genre = Column(String(10))
-    id_groupe_sanguin = Column(Integer, index=True)
+    id_groupe_sanguin = Column(Integer)
+    # Incrémentée pour révoquer tous les jetons émis
+    # (base existante : colonne ajoutée par migrer_schema)
+    version_jeton = Column(Integer, default=0, nullable=False, server_default="0")
+    # Coordonnées (degrés) résolues à la création depuis la ville, ou fournies par le client
+    # (aussi sur PropositionDon et DemandeDon ; base existante : voir migrer_schema)
+    latitude = Column(Float)
+    longitude = Column(Float)
+
+    # Filtres de /utilisateurs/ (et semi-jointures de filtrer_utilisateurs) : chaque
+    # combinaison de (ville, groupe, rôle) est un préfixe de l'un des trois index ;
+    # sans le rôle, ou sans le dernier filtre, le tri par id repasse sur les lignes retenues.
+    __table_args__ = (
+        Index("ix_Utilisateur_ville_groupe_role", "ville", "id_groupe_sanguin", "role"), # ville [, groupe [, rôle]]
+        Index("ix_Utilisateur_groupe_role", "id_groupe_sanguin", "role"), # groupe [, rôle]
+        Index("ix_Utilisateur_role_ville", "role", "ville"), # rôle [, ville]
+    )
 
 class PropositionDon(Base):
     __tablename__ = "PropositionDon"
@@ -105,18 +487,55 @@ class PropositionDon(Base):
     localisation_proposition = Column(String(255))
     statut = Column(String(50), default='en attente', nullable=False)
     notes = Column(Text)
+    latitude = Column(Float)
+    longitude = Column(Float)
+
+    __table_args__ = (
+        Index("ix_PropositionDon_date_proposition_id", "date_proposition", "id"),
+        Index("ix_PropositionDon_statut_date_proposition_id", "statut", "date_proposition", "id"),
+        Index("ix_PropositionDon_localisation_date_proposition_id", "localisation_proposition", "date_proposition", "id"),
+    )
 
 class DemandeDon(Base):
     __tablename__ = "DemandeDon"
     id = Column(Integer, primary_key=True, index=True)
     id_utilisateur = Column(Integer, nullable=False, index=True)
-    id_groupe_sanguin_requis = Column(Integer, nullable=False, index=True)
+    id_groupe_sanguin_requis = Column(Integer, nullable=False)
     quantite_demandee_ml = Column(Integer, nullable=False)
     date_demande = Column(DateTime, nullable=False, default=datetime.now)
     localisation_demande = Column(String(255))
     urgence = Column(String(50), default='moyenne', nullable=False)
     statut = Column(String(50), default='en attente', nullable=False)
     description = Column(Text, nullable=False)
+    latitude = Column(Float)
+    longitude = Column(Float)
+
+    # Filtres de /demandesdon/ : chaque combinaison de (statut, groupe, urgence) est
+    # servie par un index ; quand ses colonnes d'égalité sont suivies de (date_demande, id),
+    # il sert aussi le tri et le curseur. Les autres combinaisons filtrent sur un préfixe
+    # et trient les lignes retenues.
+    __table_args__ = (
+        Index("ix_DemandeDon_date_demande_id", "date_demande", "id"), # sans filtre ; dates
+        Index("ix_DemandeDon_statut_groupe_urgence_date_demande_id", "statut", "id_groupe_sanguin_requis", "urgence", "date_demande", "id"), # statut + groupe [+ urgence]
+        Index("ix_DemandeDon_statut_date_demande_id", "statut", "date_demande", "id"), # statut
+        Index("ix_DemandeDon_urgence_statut_date_demande_id", "urgence", "statut", "date_demande", "id"), # urgence [+ statut]
+        Index("ix_DemandeDon_groupe_urgence_date_demande_id", "id_groupe_sanguin_requis", "urgence", "date_demande", "id"), # groupe [+ urgence]
+        Index("ix_DemandeDon_localisation_date_demande_id", "localisation_demande", "date_demande", "id"), # localisation
+    )
+
+class Compteur(Base):
+    # Compteurs agrégés maintenus par les endpoints d'écriture (voir /stats/)
+    __tablename__ = "Compteur"
+    nom = Column(String(100), primary_key=True)
+    valeur = Column(Integer, nullable=False, default=0)
+
+class JournalEvenement(Base):
+    # Événements relayés entre workers (voir EVENEMENTS_PARTAGES), purgés après quelques minutes
+    __tablename__ = "JournalEvenement"
+    id = Column(Integer, primary_key=True)
+    origine = Column(String(16), nullable=False)
+    cree_le = Column(DateTime, nullable=False, default=datetime.now, index=True)
+    contenu = Column(Text, nullable=False)
 
 class AffectationDon(Base):
     __tablename__ = "AffectationDon"
@@ -127,6 +546,52 @@ class AffectationDon(Base):
     date_affectation = Column(DateTime, nullable=False, default=datetime.now)
     statut_affectation = Column(String(50), default='en cours', nullable=False)
     notes_administrateur = Column(Text)
+    date_realisation = Column(DateTime, nullable=True) # Date du don effectif (statut "terminée")
+
+    __table_args__ = (
+        Index("ix_AffectationDon_date_affectation_id", "date_affectation", "id"),
+    )
+
+class AgregatPeriode(Base):
+    # Offre et demande par tranche horaire et journalière (voir /stats/timeseries).
+    # Une ligne créée à l'instant T compte dans la tranche de T ; son changement de
+    # statut la déplace d'un statut à l'autre dans cette même tranche. Groupe ou
+    # ville inconnus : 0 et "" (la clé primaire n'admet pas NULL).
+    __tablename__ = "AgregatPeriode"
+    granularite = Column(String(5), primary_key=True) # "heure" ou "jour"
+    debut = Column(DateTime, primary_key=True)
+    type_don = Column(String(12), primary_key=True) # "demande" ou "proposition"
+    id_groupe_sanguin = Column(Integer, primary_key=True)
+    ville = Column(String(100), primary_key=True)
+    statut = Column(String(50), primary_key=True)
+    nombre = Column(Integer, nullable=False, default=0)
+    quantite_ml = Column(Integer, nullable=False, default=0) # Demandes uniquement
+
+    __table_args__ = (
+        Index("ix_AgregatPeriode_groupe_ville_debut", "granularite", "id_groupe_sanguin", "ville", "debut"),
+        Index("ix_AgregatPeriode_ville_debut", "granularite", "ville", "debut"),
+    )
+
+class EligibiliteDonneur(Base):
+    # Index d'éligibilité maintenu par les écritures et recalculé chaque jour (voir
+    # /donneurs/eligibles) : éligible le jour J si eligible_du <= J < eligible_jusqu_au.
+    __tablename__ = "EligibiliteDonneur"
+    id_utilisateur = Column(Integer, primary_key=True)
+    id_groupe_sanguin = Column(Integer, nullable=False)
+    ville = Column(String(100))
+    date_dernier_don = Column(DateTime)
+    don_en_cours = Column(Boolean, default=False, nullable=False)
+    eligible_du = Column(Date) # NULL tant qu'un don est en cours
+    eligible_jusqu_au = Column(Date) # NULL si la date de naissance est inconnue
+    calcule_le = Column(DateTime, nullable=False, default=datetime.now)
+
+    # Égalités (groupe, ville) puis plage sur eligible_du, qui est aussi la clé de tri
+    __table_args__ = (
+        Index("ix_EligibiliteDonneur_groupe_ville_eligible_du", "id_groupe_sanguin", "ville", "eligible_du", "id_utilisateur"),
+        Index("ix_EligibiliteDonneur_groupe_eligible_du", "id_groupe_sanguin", "eligible_du", "id_utilisateur"),
+        Index("ix_EligibiliteDonneur_ville_eligible_du", "ville", "eligible_du", "id_utilisateur"),
+        Index("ix_EligibiliteDonneur_eligible_du", "eligible_du", "id_utilisateur"),
+    )
 
 
 # --- Schémas Pydantic (pour la validation des données de l'API) ---
@@ -139,8 +604,7 @@ class GroupeSanguinCreate(GroupeSanguinBase):
 
 class GroupeSanguinResponse(GroupeSanguinBase):
     id: int
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UtilisateurBase(BaseModel):
     nom: str
@@ -153,6 +617,8 @@ class UtilisateurBase(BaseModel):
     genre: Optional[str] = None
     id_groupe_sanguin: Optional[int] = None
     role: str = "normal"
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class UtilisateurCreate(UtilisateurBase):
     mot_de_passe: str
@@ -160,8 +626,7 @@ class UtilisateurCreate(UtilisateurBase):
 class UtilisateurResponse(UtilisateurBase):
     id: int
     # mot_de_passe_hache: str # À commenter/retirer en production pour la sécurité
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class PropositionDonBase(BaseModel):
     id_utilisateur: int
@@ -169,6 +634,8 @@ class PropositionDonBase(BaseModel):
     localisation_proposition: Optional[str] = None
     statut: str = "en attente"
     notes: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class PropositionDonCreate(PropositionDonBase):
     pass
@@ -176,8 +643,7 @@ class PropositionDonCreate(PropositionDonBase):
 class PropositionDonResponse(PropositionDonBase):
     id: int
     date_proposition: datetime
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class DemandeDonBase(BaseModel):
     id_utilisateur: int
@@ -187,6 +653,8 @@ class DemandeDonBase(BaseModel):
     urgence: str = "moyenne"
     statut: str = "en attente"
     description: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class DemandeDonCreate(DemandeDonBase):
     pass
@@ -194,8 +662,7 @@ class DemandeDonCreate(DemandeDonBase):
 class DemandeDonResponse(DemandeDonBase):
     id: int
     date_demande: datetime
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class AffectationDonBase(BaseModel):
     id_proposition_don: int
@@ -203,10 +670,16 @@ class AffectationDonBase(BaseModel):
     id_administrateur: int
     statut_affectation: str = "en cours"
     notes_administrateur: Optional[str] = None
+    date_realisation: Optional[datetime] = None # Affectation saisie directement "terminée"
 
 class AffectationDonCreate(AffectationDonBase):
     pass
 
+class AffectationDonUpdate(BaseModel):
+    statut_affectation: Optional[str] = None
+    notes_administrateur: Optional[str] = None
+    date_realisation: Optional[datetime] = None # Par défaut, l'instant du passage à "terminée"
+
 class AffectationDonResponse(BaseModel):
         id: int
         # AJOUTEZ CES LIGNES pour inclure les IDs dans la réponse API
@@ -218,42 +691,1329 @@ class AffectationDonResponse(BaseModel):
         date_affectation: datetime
         statut_affectation: str
         notes_administrateur: Optional[str] = None # Ce champ est optionnel
+        date_realisation: Optional[datetime] = None
 
-        class Config:
-            orm_mode = True # ou from_attributes = True pour Pydantic V2
+        model_config = ConfigDict(from_attributes=True)
     
 
-# Schéma pour la réponse de connexion (pourrait inclure un token JWT plus tard)
+# Tableau de bord administrateur : lignes en attente jointes au demandeur/donneur et au groupe
+class PropositionEnAttente(PropositionDonResponse):
+    nom: str
+    prenom: str
+    ville: Optional[str] = None
+    telephone: Optional[str] = None
+    id_groupe_sanguin: Optional[int] = None
+    nom_groupe: Optional[str] = None
+
+class DemandeEnAttente(DemandeDonResponse):
+    nom: str
+    prenom: str
+    ville: Optional[str] = None
+    telephone: Optional[str] = None
+    nom_groupe: Optional[str] = None
+
+class TableauDeBordAdmin(BaseModel):
+    propositions: List[PropositionEnAttente]
+    demandes: List[DemandeEnAttente]
+
+class ResultatAffectation(BaseModel):
+    index: int
+    statut: str # "créée", "introuvable" ou "conflit"
+    erreur: Optional[str] = None
+    affectation: Optional[AffectationDonResponse] = None
+
+class SuggestionAffectation(BaseModel):
+    id_proposition_don: int
+    id_demande_don: int
+
+class DonneurEligible(BaseModel):
+    id_utilisateur: int
+    nom: str
+    prenom: str
+    telephone: Optional[str] = None
+    ville: Optional[str] = None
+    id_groupe_sanguin: int
+    date_dernier_don: Optional[datetime] = None
+    eligible_du: date
+
+class PointSerie(BaseModel):
+    debut: datetime
+    type_don: str # "demande" ou "proposition"
+    id_groupe_sanguin: Optional[int] = None # Renseignés selon `dimensions`
+    ville: Optional[str] = None
+    statut: Optional[str] = None
+    nombre: int
+    quantite_ml: int
+
+class DonneurProche(BaseModel):
+    id_proposition_don: int
+    id_utilisateur: int
+    id_groupe_sanguin: int
+    nom_groupe: Optional[str] = None
+    distance_km: float
+    localisation_proposition: Optional[str] = None
+    date_proposition: datetime
+
+class ResultatLigneImport(BaseModel):
+    index: int
+    id: Optional[int] = None # Lignes créées uniquement
+    statut: str # "créée" ou "rejetée"
+    erreur: Optional[str] = None
+
+class ResultatImport(BaseModel):
+    total: int
+    creees: int
+    rejetees: int
+    resultats: List[ResultatLigneImport]
+
+# Schéma pour la réponse de connexion (le jeton est opaque pour le frontend)
 class Token(BaseModel):
     access_token: str
     token_type: str
+    id: int
+    email: EmailStr
+    role: str
+
+class Principal(BaseModel):
+    # Utilisateur authentifié, tel que conservé dans le cache d'autorisation
+    id: int
+    email: str
+    role: str
+    version_jeton: int
 
 class UserLogin(BaseModel):
     username: EmailStr
     password: str
 
-# --- Dépendance pour les utilisateurs administrateurs (simplifié) ---
-def get_current_admin_user(db: Session = Depends(get_db)):
-    admin_user = db.query(Utilisateur).filter(Utilisateur.id == 1, Utilisateur.role == "admin").first()
-    if not admin_user:
+# --- Cache des principaux authentifiés ---
+# id utilisateur -> (échéance, Principal). Le jeton suffit à authentifier ; la
+# ligne Utilisateur n'est relue qu'à l'expiration du cache, pour vérifier la
+# révocation (version_jeton) et le rôle courant. Le cache est un LRU borné à
+# AUTH_CACHE_TAILLE_MAX entrées ; les entrées expirées sont évincées au passage.
+cache_principaux: "OrderedDict[int, tuple]" = OrderedDict()
+
+def invalider_principal(user_id: int):
+    cache_principaux.pop(user_id, None)
+
+def memoriser_principal(principal: Principal):
+    maintenant = time.monotonic()
+    cache_principaux[principal.id] = (maintenant + AUTH_CACHE_TTL_SECONDES, principal)
+    cache_principaux.move_to_end(principal.id)
+    # Les plus anciennes entrées sont en tête : expirées, ou de trop
+    while cache_principaux:
+        echeance, _ = next(iter(cache_principaux.values()))
+        if echeance > maintenant and len(cache_principaux) <= AUTH_CACHE_TAILLE_MAX:
+            break
+        cache_principaux.popitem(last=False)
+
+async def charger_principal(db: AsyncSession, user_id: int) -> Optional[Principal]:
+    entree = cache_principaux.get(user_id)
+    if entree and entree[0] > time.monotonic():
+        cache_principaux.move_to_end(user_id)
+        return entree[1]
+    user = await db.get(Utilisateur, user_id)
+    if user is None:
+        invalider_principal(user_id)
+        return None
+    principal = Principal(id=user.id, email=user.email, role=user.role, version_jeton=user.version_jeton or 0)
+    memoriser_principal(principal)
+    return principal
+
+# --- Dépendances d'authentification ---
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> Principal:
+    erreur = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Jeton d'authentification invalide ou expiré",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    donnees = verifier_jeton_acces(token)
+    if donnees is None or not isinstance(donnees.get("id"), int):
+        raise erreur
+    principal = await charger_principal(db, donnees["id"])
+    if principal is None or principal.version_jeton != donnees.get("ver"):
+        raise erreur
+    return principal
+
+async def get_current_admin_user(current_user: Principal = Depends(get_current_user)) -> Principal:
+    if current_user.role != "admin":
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Non autorisé: Seuls les administrateurs peuvent effectuer cette action.",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return admin_user
+    return current_user
+
+
+# --- Compteurs de statistiques ---
+# Les endpoints d'écriture mettent à jour la table Compteur dans leur propre
+# transaction ; /stats/ ne lit donc qu'une dizaine de lignes. Une réconciliation
+# périodique recalcule les valeurs exactes pour corriger toute dérive ; le tampon
+# "version:reconciliation" (numéro de la période) la réserve à un seul worker.
+STATS_RECONCILIATION_SECONDES = int(os.getenv("STATS_RECONCILIATION_SECONDES", "3600"))
+taches_de_fond = {} # Tâches périodiques du worker, annulées à l'arrêt
+COMPTEUR_RECONCILIE = "meta:reconcilie"
+PREFIXE_VERSION = "version:"
+VERSION_RECONCILIATION = PREFIXE_VERSION + "reconciliation"
+
+def insertion_cumulee(db: Session, table, cles, cumuls):
+    """
+    INSERT qui, sur conflit de `cles`, ajoute les valeurs des colonnes `cumuls` à
+    celles de la ligne existante (ON CONFLICT / ON DUPLICATE KEY) ; None pour les
+    dialectes sans upsert.
+    """
+    dialecte = db.bind.dialect.name
+    if dialecte == "sqlite":
+        requete = insert_sqlite(table)
+        return requete.on_conflict_do_update(
+            index_elements=list(cles), set_={colonne: table.c[colonne] + requete.excluded[colonne] for colonne in cumuls},
+        )
+    if dialecte in ("mysql", "mariadb"):
+        requete = insert_mysql(table)
+        return requete.on_duplicate_key_update(
+            **{colonne: table.c[colonne] + requete.inserted[colonne] for colonne in cumuls}
+        )
+    return None
+
+def incrementer_compteur(db: Session, nom: str, delta: int = 1):
+    incrementer_compteurs(db, {nom: delta})
+
+def incrementer_compteurs(db: Session, deltas: dict):
+    """
+    Applique tous les incréments en une seule instruction ; l'upsert crée sans
+    course les compteurs absents (premier incrément, ou statut retombé à zéro et
+    supprimé par la réconciliation).
+    """
+    lignes = [{"nom": nom, "valeur": delta} for nom, delta in deltas.items() if delta]
+    if not lignes:
+        return
+    table = Compteur.__table__
+    requete = insertion_cumulee(db, table, ["nom"], ["valeur"])
+    if requete is not None:
+        db.connection().execute(requete, lignes)
+        return
+    for ligne in lignes:
+        resultat = db.execute(update(table).where(table.c.nom == ligne["nom"]).values(valeur=table.c.valeur + ligne["valeur"]))
+        if resultat.rowcount == 0:
+            db.execute(insert(table), ligne)
+
+def deplacer_compteur(deltas: dict, prefixe: str, ancien: str, nouveau: str, nombre: int = 1):
+    """Reporte dans `deltas` `nombre` lignes d'un statut (ou rôle) vers un autre."""
+    if ancien != nouveau:
+        deltas[f"{prefixe}:{ancien}"] = deltas.get(f"{prefixe}:{ancien}", 0) - nombre
+        deltas[f"{prefixe}:{nouveau}"] = deltas.get(f"{prefixe}:{nouveau}", 0) + nombre
+
+def reserver_tampon(db: Session, nom: str, valeur: int, remplacer: bool = True) -> bool:
+    """
+    Pose le tampon `nom` à `valeur` dans la transaction courante s'il est absent ou
+    (`remplacer`) d'une autre valeur ; vrai pour le worker qui l'a posé. La ligne
+    reste verrouillée jusqu'à la fin de la transaction : parmi des workers
+    concurrents, un seul obtient vrai, et un autre peut reprendre si elle est annulée.
+    """
+    if remplacer and db.execute(
+        update(Compteur).where(Compteur.nom == nom, Compteur.valeur != valeur).values(valeur=valeur)
+    ).rowcount:
+        return True
+    if db.scalar(select(Compteur.nom).where(Compteur.nom == nom)) is not None:
+        return False
+    db.add(Compteur(nom=nom, valeur=valeur))
+    try:
+        db.flush()
+    except IntegrityError:
+        # Posé entre-temps par un autre worker
+        db.rollback()
+        return False
+    return True
+
+def reconcilier_compteurs(db: Session):
+    """Recalcule tous les compteurs avec une requête groupée par table."""
+    valeurs = {}
+    for role, nombre in db.query(Utilisateur.role, func.count()).group_by(Utilisateur.role):
+        valeurs[f"utilisateurs:{role}"] = nombre
+    for statut, nombre in db.query(PropositionDon.statut, func.count()).group_by(PropositionDon.statut):
+        valeurs[f"propositions:{statut}"] = nombre
+    for statut, nombre in db.query(DemandeDon.statut, func.count()).group_by(DemandeDon.statut):
+        valeurs[f"demandes:{statut}"] = nombre
+    valeurs["affectations:total"] = db.query(func.count(AffectationDon.id)).scalar()
+    valeurs[COMPTEUR_RECONCILIE] = 1
+
+    # Les tampons de version (préfixe "version:") ne sont pas des statistiques
+    db.execute(delete(Compteur).where(Compteur.nom.notlike(f"{PREFIXE_VERSION}%")))
+    db.add_all([Compteur(nom=nom, valeur=valeur) for nom, valeur in valeurs.items()])
+    db.commit()
+    return valeurs
+
+def lire_compteurs(db: Session) -> dict:
+    valeurs = {c.nom: c.valeur for c in db.query(Compteur).all()}
+    if COMPTEUR_RECONCILIE not in valeurs:
+        # Base existante jamais réconciliée : initialisation à la première lecture
+        valeurs = reconcilier_compteurs(db)
+    return valeurs
+
+def _reconcilier_compteurs_tache():
+    db = ouvrir_session()
+    try:
+        periode = int(time.time() // STATS_RECONCILIATION_SECONDES)
+        if reserver_tampon(db, VERSION_RECONCILIATION, periode):
+            reconcilier_compteurs(db) # Valide le tampon avec les compteurs
+        else:
+            db.rollback() # Déjà faite par un autre worker pour cette période
+    finally:
+        db.close()
+
+async def boucle_reconciliation_compteurs():
+    while True:
+        await asyncio.sleep(STATS_RECONCILIATION_SECONDES)
+        try:
+            await run_in_threadpool(_reconcilier_compteurs_tache)
+        except (SQLAlchemyError, OSError):
+            # La boucle survit à l'échec d'un passage ; le suivant corrigera la dérive
+            journal.exception("Erreur lors de la réconciliation des compteurs")
+
+
+# --- Agrégats temporels (offre et demande) ---
+# Les écritures cumulent leurs variations par tranche (heure et jour) puis les
+# appliquent en un seul INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE exécuté
+# en lot, dans la transaction de l'écriture. L'historique antérieur est reconstruit par
+# reconstruire_agregats.py ; /stats/timeseries ne lit que ces tranches.
+GRANULARITES = ("heure", "jour")
+CLES_AGREGAT = ("granularite", "debut", "type_don", "id_groupe_sanguin", "ville", "statut")
+
+def debut_tranche(moment: datetime, granularite: str) -> datetime:
+    if granularite == "heure":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def cumuler_agregat(variations: dict, type_don: str, moment: datetime, id_groupe_sanguin, ville, statut: str,
+                    nombre: int = 1, quantite_ml: int = 0):
+    for granularite in GRANULARITES:
+        cle = (granularite, debut_tranche(moment, granularite), type_don, id_groupe_sanguin or 0, ville or "", statut)
+        cumul = variations.get(cle, (0, 0))
+        variations[cle] = (cumul[0] + nombre, cumul[1] + quantite_ml)
+
+def deplacer_agregat(variations: dict, type_don: str, moment: datetime, id_groupe_sanguin, ville,
+                     ancien: str, nouveau: str, quantite_ml: int = 0):
+    if ancien != nouveau:
+        cumuler_agregat(variations, type_don, moment, id_groupe_sanguin, ville, ancien, -1, -quantite_ml)
+        cumuler_agregat(variations, type_don, moment, id_groupe_sanguin, ville, nouveau, 1, quantite_ml)
+
+def appliquer_agregats(db: Session, variations: dict):
+    lignes = [
+        dict(zip(CLES_AGREGAT, cle), nombre=nombre, quantite_ml=quantite)
+        for cle, (nombre, quantite) in variations.items() if nombre or quantite
+    ]
+    if not lignes:
+        return
+    table = AgregatPeriode.__table__
+    requete = insertion_cumulee(db, table, CLES_AGREGAT, ["nombre", "quantite_ml"])
+    if requete is None:
+        for ligne in lignes:
+            resultat = db.execute(
+                update(table).where(*[table.c[cle] == ligne[cle] for cle in CLES_AGREGAT])
+                .values(nombre=table.c.nombre + ligne["nombre"], quantite_ml=table.c.quantite_ml + ligne["quantite_ml"])
+            )
+            if resultat.rowcount == 0:
+                db.execute(insert(table), ligne)
+        return
+    db.connection().execute(requete, lignes)
+
+def comptabiliser_creations(db: Session, creations):
+    """`creations` : tuples (type_don, moment, id_groupe_sanguin, ville, statut, quantite_ml)."""
+    variations = {}
+    for type_don, moment, id_groupe_sanguin, ville, statut, quantite_ml in creations:
+        cumuler_agregat(variations, type_don, moment, id_groupe_sanguin, ville, statut, 1, quantite_ml or 0)
+    appliquer_agregats(db, variations)
+
+def reconstruire_agregats(db: Session, depuis: Optional[datetime] = None) -> int:
+    """
+    Recalcule les tranches à partir du jour de `depuis` (tout l'historique si None)
+    en parcourant les tables par lots, puis remplace les lignes concernées en une
+    transaction. Les écritures concurrentes sur ces tranches peuvent être perdues :
+    à lancer avant l'ouverture du trafic ou en heure creuse.
+    """
+    depuis = debut_tranche(depuis, "jour") if depuis else None
+    sources = (
+        ("demande", select(
+            DemandeDon.date_demande, DemandeDon.id_groupe_sanguin_requis, Utilisateur.ville,
+            DemandeDon.statut, DemandeDon.quantite_demandee_ml,
+        ).outerjoin(Utilisateur, Utilisateur.id == DemandeDon.id_utilisateur), DemandeDon.date_demande),
+        ("proposition", select(
+            PropositionDon.date_proposition, Utilisateur.id_groupe_sanguin, Utilisateur.ville,
+            PropositionDon.statut, literal(0),
+        ).outerjoin(Utilisateur, Utilisateur.id == PropositionDon.id_utilisateur), PropositionDon.date_proposition),
+    )
+    variations = {}
+    for type_don, requete, colonne_date in sources:
+        if depuis:
+            requete = requete.where(colonne_date >= depuis)
+        resultat = db.execute(requete, execution_options={"yield_per": EXPORT_TAILLE_LOT})
+        for moment, id_groupe_sanguin, ville, statut, quantite_ml in resultat:
+            cumuler_agregat(variations, type_don, moment, id_groupe_sanguin, ville, statut, 1, quantite_ml or 0)
+
+    suppression = delete(AgregatPeriode)
+    if depuis:
+        suppression = suppression.where(AgregatPeriode.debut >= depuis)
+    db.execute(suppression)
+    lignes = [dict(zip(CLES_AGREGAT, cle), nombre=n, quantite_ml=q) for cle, (n, q) in variations.items()]
+    if lignes:
+        db.connection().execute(insert(AgregatPeriode.__table__), lignes)
+    db.commit()
+    return len(lignes)
+
+
+# --- Cache de référence des groupes sanguins ---
+# La table GroupeSanguin (~8 lignes) est servie depuis la mémoire. Sa version est
+# tamponnée dans Compteur ("version:groupes_sanguins") et incrémentée à chaque
+# création ; chaque worker la relit au plus toutes les REFERENCE_VERIFICATION_SECONDES.
+REFERENCE_VERIFICATION_SECONDES = float(os.getenv("REFERENCE_VERIFICATION_SECONDES", "5"))
+VERSION_GROUPES_SANGUINS = PREFIXE_VERSION + "groupes_sanguins"
+
+class CacheGroupesSanguins:
+    def __init__(self):
+        self.par_id = {}
+        self.par_nom = {}
+        self.liste = []
+        self.etag = None
+        self.version = None
+        self.verifie_le = 0.0
+
+    def charger(self, db: Session, version: Optional[int] = None):
+        if version is None:
+            version = db.scalar(select(Compteur.valeur).where(Compteur.nom == VERSION_GROUPES_SANGUINS)) or 0
+        groupes = db.scalars(select(GroupeSanguin).order_by(GroupeSanguin.id)).all()
+        liste = [GroupeSanguinResponse(id=g.id, nom_groupe=g.nom_groupe) for g in groupes]
+        self.par_id = {g.id: g for g in liste}
+        self.par_nom = {g.nom_groupe: g for g in liste}
+        self.liste = liste
+        empreinte = hashlib.sha1(orjson.dumps([g.model_dump() for g in liste])).hexdigest()[:16]
+        self.etag = f'W/"groupes-{empreinte}"'
+        self.version = version
+        self.verifie_le = time.monotonic()
+
+    def rafraichir(self, db: Session):
+        """Recharge le cache si la version en base a changé (ou s'il est vide)."""
+        version = db.scalar(select(Compteur.valeur).where(Compteur.nom == VERSION_GROUPES_SANGUINS)) or 0
+        if version != self.version:
+            self.charger(db, version)
+        else:
+            self.verifie_le = time.monotonic()
+
+    def a_verifier(self) -> bool:
+        return self.version is None or time.monotonic() - self.verifie_le >= REFERENCE_VERIFICATION_SECONDES
+
+cache_groupes_sanguins = CacheGroupesSanguins()
+
+async def get_cache_groupes_sanguins(db: AsyncSession = Depends(get_db)) -> CacheGroupesSanguins:
+    if cache_groupes_sanguins.a_verifier():
+        await db.run_sync(cache_groupes_sanguins.rafraichir)
+    return cache_groupes_sanguins
+
+def _charger_cache_groupes_sanguins():
+    db = ouvrir_session()
+    try:
+        cache_groupes_sanguins.charger(db)
+    finally:
+        db.close()
+
+async def charger_cache_reference():
+    try:
+        await run_in_threadpool(_charger_cache_groupes_sanguins)
+    except SQLAlchemyError:
+        # Base indisponible au démarrage : le cache sera chargé à la première requête
+        journal.warning("Chargement du cache des groupes sanguins reporté à la première requête", exc_info=True)
+
+
+# --- Pagination par curseur (keyset) ---
+# Mode optionnel des endpoints de liste : passer `after` (vide pour la première page)
+# active le curseur sur la clé de tri (date, id) ou (id) et renvoie le curseur suivant
+# dans l'en-tête X-Next-Cursor. Le coût d'une page ne dépend plus de sa profondeur.
+# `ordre` (asc/desc) s'applique aux deux modes.
+
+def encoder_curseur(valeurs) -> str:
+    brut = json.dumps([v.isoformat() if isinstance(v, date) else v for v in valeurs])
+    return base64.urlsafe_b64encode(brut.encode()).decode().rstrip("=")
+
+def decoder_curseur(curseur: str, colonnes) -> list:
+    try:
+        brut = base64.urlsafe_b64decode(curseur + "=" * (-len(curseur) % 4))
+        valeurs = json.loads(brut)
+        if not isinstance(valeurs, list) or len(valeurs) != len(colonnes):
+            raise ValueError
+        return [
+            datetime.fromisoformat(v) if isinstance(c.type, DateTime)
+            else date.fromisoformat(v) if isinstance(c.type, Date)
+            else int(v)
+            for c, v in zip(colonnes, valeurs)
+        ]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+
+async def paginer(
+    db: AsyncSession, requete, colonnes, skip: int, limit: int, after: Optional[str], response: Response,
+    ordre: str = "asc"
+):
+    """
+    Applique la pagination offset (par défaut) ou keyset si `after` est fourni.
+    `requete` sélectionne des colonnes (voir colonnes_reponse) : les lignes sont
+    renvoyées sous forme de dictionnaires, prêts pour reponse_liste.
+    """
+    if ordre not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Ordre de tri invalide (asc ou desc)")
+    descendant = ordre == "desc"
+    tri = [c.desc() for c in colonnes] if descendant else list(colonnes)
+    if after is None:
+        return (await db.execute(requete.order_by(*tri).offset(skip).limit(limit))).mappings().all()
+
+    if after:
+        valeurs = decoder_curseur(after, colonnes)
+        apres = (lambda c, v: c < v) if descendant else (lambda c, v: c > v)
+        # Forme développée de (c1, c2) > (v1, v2), précédée de c1 >= v1 : ce terme
+        # seul délimite la plage de l'index (sinon SQLite parcourt tout l'index)
+        condition = apres(colonnes[-1], valeurs[-1])
+        for colonne, valeur in zip(reversed(colonnes[:-1]), reversed(valeurs[:-1])):
+            condition = or_(apres(colonne, valeur), and_(colonne == valeur, condition))
+        if len(colonnes) > 1:
+            borne = colonnes[0] <= valeurs[0] if descendant else colonnes[0] >= valeurs[0]
+            condition = and_(borne, condition)
+        requete = requete.where(condition)
+
+    lignes = (await db.execute(requete.order_by(*tri).limit(limit))).mappings().all()
+    if lignes and len(lignes) == limit:
+        derniere = lignes[-1]
+        response.headers["X-Next-Cursor"] = encoder_curseur([derniere[c.key] for c in colonnes])
+    return lignes
+
+# --- Sérialisation rapide des listes ---
+# Les endpoints de liste ne chargent que les colonnes du schéma de réponse et
+# encodent les lignes directement avec orjson : ni objets ORM, ni re-validation
+# Pydantic (le response_model reste déclaré pour la documentation OpenAPI).
+
+# --- Filtres des endpoints de liste ---
+# Égalités et bornes de dates poussées dans le WHERE ; les combinaisons d'égalités
+# correspondent aux préfixes des index composites déclarés sur les modèles.
+
+def filtrer(requete, egalites: dict):
+    for colonne, valeur in egalites.items():
+        if valeur is not None:
+            requete = requete.where(colonne == valeur)
+    return requete
+
+def filtrer_periode(requete, colonne, date_debut: Optional[datetime], date_fin: Optional[datetime]):
+    if date_debut:
+        requete = requete.where(colonne >= date_debut)
+    if date_fin:
+        requete = requete.where(colonne < date_fin)
+    return requete
+
+def filtrer_utilisateurs(requete, colonne_id_utilisateur, ville: Optional[str] = None, id_groupe_sanguin: Optional[int] = None):
+    """Filtre sur la ville ou le groupe de l'utilisateur lié (semi-jointure servie par les index d'Utilisateur)."""
+    if ville is None and id_groupe_sanguin is None:
+        return requete
+    utilisateurs = filtrer(select(Utilisateur.id), {Utilisateur.ville: ville, Utilisateur.id_groupe_sanguin: id_groupe_sanguin})
+    return requete.where(colonne_id_utilisateur.in_(utilisateurs))
+
+def colonnes_reponse(modele, schema) -> list:
+    """Colonnes de la table correspondant aux champs du schéma de réponse, dans son ordre."""
+    return [modele.__table__.c[nom] for nom in schema.model_fields]
+
+def reponse_liste(lignes, response: Response) -> ORJSONResponse:
+    # Les en-têtes posés sur `response` (X-Next-Cursor...) ne sont pas repris automatiquement
+    return ORJSONResponse([dict(ligne) for ligne in lignes], headers=dict(response.headers))
+
+
+# --- Géolocalisation ---
+# Les localisations restent du texte libre ; les coordonnées stockées à côté sont
+# celles fournies par le client, sinon celles de la ville reconnue dans le texte
+# (répertoire hors ligne de geographie.py), sinon celles de l'utilisateur.
+
+def resoudre_position(valeurs: dict, localisation: Optional[str], utilisateur=None):
+    """Complète latitude/longitude de `valeurs` (dictionnaire de colonnes) si elles manquent."""
+    candidats = [(valeurs.get("latitude"), valeurs.get("longitude")), localisation]
+    if utilisateur is not None:
+        candidats += [(utilisateur.latitude, utilisateur.longitude), utilisateur.ville]
+    position = premiere_position(*candidats)
+    valeurs["latitude"], valeurs["longitude"] = position if position else (None, None)
+    return valeurs
+
+
+# --- Moteur d'appariement (index en mémoire des dons en attente) ---
+# Chaque worker tient ses propres index. Les écritures qui modifient les dons en
+# attente incrémentent "version:moteur_affectation" avec leurs compteurs ; comme le
+# cache des groupes sanguins, un worker relit ce tampon au plus toutes les
+# REFERENCE_VERIFICATION_SECONDES. S'il ne correspond plus à la version chargée
+# augmentée des écritures du worker, seules les lignes d'id supérieur aux bornes des
+# dernières synchronisations sont lues : propositions et demandes créées, affectations
+# (qui retirent leurs deux côtés). La lecture complète est réservée au démarrage.
+VERSION_MOTEUR_AFFECTATION = PREFIXE_VERSION + "moteur_affectation"
+moteur_affectation = MoteurAffectation()
+
+class VersionMoteurAffectation:
+    def __init__(self, fenetre: int = 3):
+        self.chargee = None
+        self.locales = 0 # Écritures de ce worker validées depuis la dernière synchronisation
+        self.verifie_le = 0.0
+        self.verrou_chargement = threading.Lock()
+        self._verrou = threading.Lock()
+        # (id proposition, id demande, id affectation) lus à chacune des dernières
+        # synchronisations : la relecture repart de la plus ancienne, si bien qu'une
+        # ligne validée après une ligne d'id supérieur n'est pas manquée
+        self._bornes = deque(maxlen=fenetre)
+
+    def noter_ecriture(self):
+        """À appeler après la validation d'une écriture qui a incrémenté le tampon."""
+        with self._verrou:
+            self.locales += 1
+
+    def debut_chargement(self) -> int:
+        with self._verrou:
+            return self.locales
+
+    def fin_chargement(self, version: int, locales_avant: int, bornes: tuple):
+        # Les écritures notées pendant la lecture restent comptées : au pire, une synchronisation de trop
+        with self._verrou:
+            self.chargee = version
+            self.locales -= locales_avant
+        self._bornes.append(bornes)
+        self.verifie_le = time.monotonic()
+
+    def oublier_bornes(self):
+        self._bornes.clear()
+
+    def bornes(self) -> tuple:
+        return self._bornes[0]
+
+    def dernieres_bornes(self) -> tuple:
+        return self._bornes[-1]
+
+    def a_jour(self, version: int) -> bool:
+        with self._verrou:
+            return self.chargee is not None and version == self.chargee + self.locales
+
+    def a_verifier(self) -> bool:
+        return not moteur_affectation.charge or time.monotonic() - self.verifie_le >= REFERENCE_VERIFICATION_SECONDES
+
+version_moteur_affectation = VersionMoteurAffectation()
+
+def lire_version_moteur(db: Session) -> int:
+    return db.scalar(select(Compteur.valeur).where(Compteur.nom == VERSION_MOTEUR_AFFECTATION)) or 0
+
+def indexer_propositions(db: Session, condition) -> int:
+    """Indexe les propositions en attente parmi celles qui vérifient `condition` ; retourne le plus grand id lu."""
+    dernier = 0
+    for id_proposition, statut, id_groupe, date_proposition, lat, lon, localisation, lat_u, lon_u, ville in db.execute(
+        select(
+            PropositionDon.id, PropositionDon.statut, Utilisateur.id_groupe_sanguin, PropositionDon.date_proposition,
+            PropositionDon.latitude, PropositionDon.longitude, PropositionDon.localisation_proposition,
+            Utilisateur.latitude, Utilisateur.longitude, Utilisateur.ville,
+        )
+        .join(Utilisateur, Utilisateur.id == PropositionDon.id_utilisateur)
+        .where(condition)
+    ):
+        dernier = max(dernier, id_proposition)
+        if statut != "en attente":
+            continue
+        # Lignes antérieures aux coordonnées : géocodées à la volée
+        position = premiere_position((lat, lon), localisation, (lat_u, lon_u), ville)
+        moteur_affectation.ajouter_proposition(id_proposition, id_groupe, date_proposition, position)
+    return dernier
+
+def indexer_demandes(db: Session, condition) -> int:
+    dernier = 0
+    for id_demande, statut, id_groupe, urgence, date_demande in db.execute(
+        select(DemandeDon.id, DemandeDon.statut, DemandeDon.id_groupe_sanguin_requis, DemandeDon.urgence, DemandeDon.date_demande)
+        .where(condition)
+    ):
+        dernier = max(dernier, id_demande)
+        if statut == "en attente":
+            moteur_affectation.ajouter_demande(id_demande, id_groupe, urgence, date_demande)
+    return dernier
+
+def charger_moteur_affectation(db: Session):
+    """
+    Construit les index à partir de toutes les lignes en attente (premier usage, ou
+    index abandonnés). À appeler sur une transaction neuve : les index sont vidés
+    avant la première lecture, si bien qu'une écriture locale validée entre-temps
+    est soit lue, soit ajoutée ensuite.
+    """
+    moteur_affectation.reinitialiser({})
+    version_moteur_affectation.oublier_bornes()
+    locales_avant = version_moteur_affectation.debut_chargement()
+    version = lire_version_moteur(db)
+    # Bornes lues avant les lignes : une ligne validée pendant la lecture sera relue
+    bornes = tuple(v or 0 for v in db.execute(select(
+        select(func.max(PropositionDon.id)).scalar_subquery(),
+        select(func.max(DemandeDon.id)).scalar_subquery(),
+        select(func.max(AffectationDon.id)).scalar_subquery(),
+    )).one())
+    for groupe in db.query(GroupeSanguin).all():
+        moteur_affectation.definir_groupe(groupe.id, groupe.nom_groupe)
+    indexer_propositions(db, PropositionDon.statut == "en attente")
+    indexer_demandes(db, DemandeDon.statut == "en attente")
+    version_moteur_affectation.fin_chargement(version, locales_avant, bornes)
+
+def completer_moteur_affectation(db: Session, version: int):
+    """Applique aux index les lignes validées depuis les dernières synchronisations."""
+    locales_avant = version_moteur_affectation.debut_chargement()
+    id_proposition, id_demande, id_affectation = version_moteur_affectation.bornes()
+    derniers = version_moteur_affectation.dernieres_bornes()
+    dernier_proposition = indexer_propositions(db, PropositionDon.id > id_proposition)
+    dernier_demande = indexer_demandes(db, DemandeDon.id > id_demande)
+    dernier_affectation = 0
+    for id_ligne, id_proposition_don, id_demande_don in db.execute(
+        select(AffectationDon.id, AffectationDon.id_proposition_don, AffectationDon.id_demande_don)
+        .where(AffectationDon.id > id_affectation)
+    ):
+        dernier_affectation = max(dernier_affectation, id_ligne)
+        moteur_affectation.retirer_affectation(id_proposition_don, id_demande_don)
+    if moteur_affectation.groupes_inconnus():
+        # Groupe créé sur un autre worker
+        for groupe in db.query(GroupeSanguin).all():
+            moteur_affectation.definir_groupe(groupe.id, groupe.nom_groupe)
+    version_moteur_affectation.fin_chargement(version, locales_avant, (
+        max(derniers[0], dernier_proposition), max(derniers[1], dernier_demande), max(derniers[2], dernier_affectation),
+    ))
+
+def synchroniser_moteur_affectation():
+    """Charge les index au premier usage, puis leur applique les écritures des autres workers."""
+    with version_moteur_affectation.verrou_chargement:
+        if not version_moteur_affectation.a_verifier():
+            return # Vérifié par une requête concurrente
+        db = ouvrir_session()
+        try:
+            if not moteur_affectation.charge:
+                charger_moteur_affectation(db)
+                return
+            version = lire_version_moteur(db)
+            if version_moteur_affectation.a_jour(version):
+                version_moteur_affectation.verifie_le = time.monotonic()
+            else:
+                completer_moteur_affectation(db, version)
+        finally:
+            db.close()
+
+async def get_moteur_affectation() -> MoteurAffectation:
+    if version_moteur_affectation.a_verifier():
+        await run_in_threadpool(synchroniser_moteur_affectation)
+    return moteur_affectation
+
+
+# --- Diffusion des événements en temps réel ---
+# Les créations sont publiées sur un bus en mémoire sous forme de deltas compacts,
+# relayés aux abonnés /ws/events et /events/stream (filtres : groupe, ville, urgence).
+# Le bus est propre à chaque processus. Avec plusieurs workers ou réplicas,
+# EVENEMENTS_PARTAGES relaie les événements par la table JournalEvenement : chaque
+# worker y écrit les siens et relit ceux des autres toutes les EVENEMENTS_RELAIS_SECONDES
+# (lecture seulement s'il a des abonnés) ; les lignes plus anciennes que
+# EVENEMENTS_RETENTION_SECONDES sont purgées.
+EVENEMENTS_FILE_MAX = int(os.getenv("EVENEMENTS_FILE_MAX", "100"))
+EVENEMENTS_PING_SECONDES = float(os.getenv("EVENEMENTS_PING_SECONDES", "15"))
+EVENEMENTS_PARTAGES = os.getenv("EVENEMENTS_PARTAGES", "false").lower() in ("1", "true", "yes")
+EVENEMENTS_RELAIS_SECONDES = float(os.getenv("EVENEMENTS_RELAIS_SECONDES", "0.5"))
+EVENEMENTS_RETENTION_SECONDES = int(os.getenv("EVENEMENTS_RETENTION_SECONDES", "300"))
+bus_evenements = BusEvenements(taille_file=EVENEMENTS_FILE_MAX)
+relais_evenements = RelaisEvenements(bus_evenements)
+
+def diffuser(evenement: dict):
+    bus_evenements.publier(evenement)
+    if EVENEMENTS_PARTAGES:
+        relais_evenements.envoyer(evenement)
+
+def relayer_evenements(db: Session, purger: bool = False):
+    """Un passage du relais : écrit les événements locaux, distribue ceux des autres workers."""
+    evenements = relais_evenements.a_envoyer()
+    try:
+        if evenements:
+            origine, maintenant = relais_evenements.origine, datetime.now()
+            db.execute(insert(JournalEvenement), [
+                {"origine": origine, "cree_le": maintenant, "contenu": orjson.dumps(e).decode()} for e in evenements
+            ])
+        lignes = []
+        if not bus_evenements.abonnements:
+            # Aucun abonné : rien à relire ; la lecture reprendra à la fin du journal
+            relais_evenements.dernier_id = None
+        elif relais_evenements.dernier_id is None:
+            relais_evenements.demarrer(db.scalar(select(func.max(JournalEvenement.id))) or 0)
+        else:
+            lignes = db.execute(
+                select(JournalEvenement.id, JournalEvenement.origine, JournalEvenement.contenu)
+                .where(JournalEvenement.id > relais_evenements.borne()).order_by(JournalEvenement.id)
+            ).all()
+        if purger:
+            limite = datetime.now() - timedelta(seconds=EVENEMENTS_RETENTION_SECONDES)
+            db.execute(delete(JournalEvenement).where(JournalEvenement.cree_le < limite))
+        db.commit()
+    except (SQLAlchemyError, OSError):
+        relais_evenements.reprendre(evenements)
+        raise
+    if relais_evenements.dernier_id is not None:
+        relais_evenements.recevoir((id_ligne, origine, orjson.loads(contenu)) for id_ligne, origine, contenu in lignes)
+
+def _relayer_evenements_tache(purger: bool = False):
+    db = ouvrir_session()
+    try:
+        relayer_evenements(db, purger)
+    finally:
+        db.close()
+
+async def boucle_relais_evenements():
+    purge = time.monotonic()
+    while True:
+        await asyncio.sleep(EVENEMENTS_RELAIS_SECONDES)
+        purger = time.monotonic() - purge >= 60
+        try:
+            await run_in_threadpool(_relayer_evenements_tache, purger)
+            if purger:
+                purge = time.monotonic()
+        except (SQLAlchemyError, OSError):
+            # Les événements non écrits sont repris au passage suivant
+            journal.exception("Erreur lors du relais des événements entre workers")
+
+async def vider_relais_evenements():
+    # Derniers événements du worker, écrits une fois sa boucle de relais arrêtée
+    try:
+        await run_in_threadpool(_relayer_evenements_tache)
+    except SQLAlchemyError:
+        journal.warning("Événements non relayés à l'arrêt du worker", exc_info=True)
+
+def publier_proposition(id_proposition, valeurs: dict, id_groupe_sanguin, ville):
+    diffuser({
+        "type": "proposition_creee", "id": id_proposition,
+        "id_groupe_sanguin": id_groupe_sanguin, "ville": ville,
+        "localisation": valeurs.get("localisation_proposition"), "statut": valeurs.get("statut"),
+        "date": valeurs.get("date_proposition"),
+    })
+
+def publier_demande(id_demande, valeurs: dict, ville):
+    diffuser({
+        "type": "demande_creee", "id": id_demande,
+        "id_groupe_sanguin": valeurs.get("id_groupe_sanguin_requis"), "ville": ville,
+        "urgence": valeurs.get("urgence"), "quantite_demandee_ml": valeurs.get("quantite_demandee_ml"),
+        "localisation": valeurs.get("localisation_demande"), "statut": valeurs.get("statut"),
+        "date": valeurs.get("date_demande"),
+    })
+
+def publier_affectation(affectation, demande, ville):
+    diffuser({
+        "type": "affectation_creee", "id": affectation.id,
+        "id_proposition_don": affectation.id_proposition_don, "id_demande_don": affectation.id_demande_don,
+        "id_groupe_sanguin": demande.id_groupe_sanguin_requis, "ville": ville, "urgence": demande.urgence,
+        "statut_affectation": affectation.statut_affectation, "date": affectation.date_affectation,
+    })
+
+def filtres_evenements(groupe: Optional[int], ville: Optional[str], urgence: Optional[str], types: Optional[str]):
+    filtres = {"id_groupe_sanguin": groupe, "ville": ville, "urgence": urgence}
+    return filtres, ({t.strip() for t in types.split(",") if t.strip()} if types else None)
+
+
+# --- Import en masse (JSON ou NDJSON) ---
+# Les lignes sont traitées par lots de IMPORT_TAILLE_LOT : une requête ensembliste
+# par lot pour vérifier les références, un INSERT multi-lignes et un commit par lot.
+IMPORT_TAILLE_LOT = int(os.getenv("IMPORT_TAILLE_LOT", "1000"))
+
+async def lire_lignes_import(request: Request):
+    """Produit les couples (index, ligne) d'un tableau JSON ou d'un flux NDJSON."""
+    if "ndjson" in request.headers.get("content-type", ""):
+        index, reste = 0, b""
+        async for morceau in request.stream():
+            *lignes, reste = (reste + morceau).split(b"\n")
+            for ligne in lignes:
+                if ligne.strip():
+                    yield index, ligne
+                    index += 1
+        if reste.strip():
+            yield index, reste
+        return
+
+    try:
+        lignes = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Corps JSON invalide")
+    if not isinstance(lignes, list):
+        raise HTTPException(status_code=400, detail="Un tableau JSON est attendu")
+    for index, ligne in enumerate(lignes):
+        yield index, ligne
+
+def valider_lignes_import(lot, schema, resultats):
+    """Valide chaque ligne avec le schéma Pydantic ; les rejets sont consignés dans `resultats`."""
+    valides = []
+    for index, ligne in lot:
+        try:
+            if isinstance(ligne, bytes):
+                ligne = orjson.loads(ligne)
+            valides.append((index, schema.model_validate(ligne)))
+        except orjson.JSONDecodeError:
+            resultats.append(ResultatLigneImport(index=index, statut="rejetée", erreur="Ligne JSON invalide"))
+        except ValidationError as e:
+            erreur = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            resultats.append(ResultatLigneImport(index=index, statut="rejetée", erreur=erreur))
+    return valides
+
+_pas_auto_increment = None
+
+def pas_auto_increment(db: Session) -> int:
+    """auto_increment_increment du serveur MySQL (1 sauf réplication multi-maîtres), lu une fois."""
+    global _pas_auto_increment
+    if _pas_auto_increment is None:
+        _pas_auto_increment = int(db.scalar(text("SELECT @@auto_increment_increment")) or 1)
+    return _pas_auto_increment
+
+def inserer_lignes(db: Session, modele, lignes) -> List[int]:
+    """
+    INSERT multi-lignes ; retourne les ids dans l'ordre des lignes. Sans RETURNING
+    (MySQL), le lot part en un seul INSERT ... VALUES (...), (...) : InnoDB attribue
+    aux lignes d'une insertion dont le nombre est connu d'avance des valeurs
+    consécutives (au pas auto_increment_increment), la première étant LAST_INSERT_ID().
+    """
+    if not lignes:
+        return []
+    dialecte = db.bind.dialect
+    if dialecte.insert_executemany_returning_sort_by_parameter_order:
+        return list(db.scalars(insert(modele).returning(modele.id, sort_by_parameter_order=True), lignes))
+    table = modele.__table__
+    if dialecte.name in ("mysql", "mariadb"):
+        resultat = db.execute(insert(table).values(lignes))
+        pas = pas_auto_increment(db)
+        return [resultat.lastrowid + i * pas for i in range(len(lignes))]
+    # Autres dialectes : une insertion par ligne
+    return [db.execute(insert(table).values(ligne)).inserted_primary_key[0] for ligne in lignes]
+
+def enregistrer_lot_import(db: Session, modele, prefixe_compteur: str, acceptees, creations, resultats) -> Optional[List[int]]:
+    """
+    Insère les lignes acceptées, met à jour agrégats (`creations`, voir
+    comptabiliser_creations) et compteurs, valide, et consigne le résultat de chaque
+    ligne. Une erreur de la base (valeur hors bornes, contrainte...) annule le lot,
+    dont toutes les lignes sont rejetées ; l'import continue avec le lot suivant.
+    """
+    if not acceptees:
+        return None
+    par_statut = {}
+    for _, valeurs in acceptees:
+        par_statut[valeurs["statut"]] = par_statut.get(valeurs["statut"], 0) + 1
+    deltas = {f"{prefixe_compteur}:{statut_ligne}": nombre for statut_ligne, nombre in par_statut.items()}
+    if par_statut.get("en attente"):
+        deltas[VERSION_MOTEUR_AFFECTATION] = 1
+    try:
+        ids = inserer_lignes(db, modele, [valeurs for _, valeurs in acceptees])
+        comptabiliser_creations(db, creations)
+        incrementer_compteurs(db, deltas)
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        for index, _ in acceptees:
+            resultats.append(ResultatLigneImport(index=index, statut="rejetée", erreur=f"Erreur base de données: {e.__class__.__name__}"))
+        return None
+    if VERSION_MOTEUR_AFFECTATION in deltas:
+        version_moteur_affectation.noter_ecriture()
+    for id_ligne, (index, _) in zip(ids, acceptees):
+        resultats.append(ResultatLigneImport(index=index, id=id_ligne, statut="créée"))
+    return ids
+
+def importer_lot_propositions(db: Session, lot):
+    resultats = []
+    valides = valider_lignes_import(lot, PropositionDonCreate, resultats)
+    ids_utilisateurs = {p.id_utilisateur for _, p in valides}
+    donneurs = {
+        ligne.id: ligne for ligne in db.execute(
+            select(Utilisateur.id, Utilisateur.id_groupe_sanguin, Utilisateur.ville, Utilisateur.latitude, Utilisateur.longitude)
+            .where(Utilisateur.id.in_(ids_utilisateurs))
+        )
+    } if ids_utilisateurs else {}
+
+    acceptees = []
+    maintenant = datetime.now()
+    for index, proposition in valides:
+        if proposition.id_utilisateur not in donneurs:
+            resultats.append(ResultatLigneImport(index=index, statut="rejetée", erreur="Utilisateur associé à la proposition non trouvé"))
+            continue
+        valeurs = dict(proposition.model_dump(), date_proposition=maintenant)
+        acceptees.append((index, resoudre_position(valeurs, proposition.localisation_proposition, donneurs[proposition.id_utilisateur])))
+
+    ids = enregistrer_lot_import(db, PropositionDon, "propositions", acceptees, [
+        ("proposition", maintenant, donneurs[v["id_utilisateur"]].id_groupe_sanguin, donneurs[v["id_utilisateur"]].ville, v["statut"], 0)
+        for _, v in acceptees
+    ], resultats)
+    if ids is None:
+        return resultats
+    for id_proposition, (_, valeurs) in zip(ids, acceptees):
+        donneur = donneurs[valeurs["id_utilisateur"]]
+        if moteur_affectation.charge and valeurs["statut"] == "en attente":
+            moteur_affectation.ajouter_proposition(
+                id_proposition, donneur.id_groupe_sanguin, maintenant,
+                premiere_position((valeurs["latitude"], valeurs["longitude"])),
+            )
+        publier_proposition(id_proposition, valeurs, donneur.id_groupe_sanguin, donneur.ville)
+    return resultats
+
+def importer_lot_demandes(db: Session, lot):
+    resultats = []
+    valides = valider_lignes_import(lot, DemandeDonCreate, resultats)
+    ids_utilisateurs = {d.id_utilisateur for _, d in valides}
+    ids_groupes = {d.id_groupe_sanguin_requis for _, d in valides}
+    demandeurs = {
+        ligne.id: ligne for ligne in db.execute(
+            select(Utilisateur.id, Utilisateur.ville, Utilisateur.latitude, Utilisateur.longitude)
+            .where(Utilisateur.id.in_(ids_utilisateurs))
+        )
+    } if ids_utilisateurs else {}
+    groupes = ids_groupes & cache_groupes_sanguins.par_id.keys()
+    if ids_groupes - groupes:
+        # Groupes absents du cache (créés sur un autre worker ?) : vérification en base
+        groupes |= set(db.scalars(select(GroupeSanguin.id).where(GroupeSanguin.id.in_(ids_groupes - groupes))))
+
+    acceptees = []
+    maintenant = datetime.now()
+    for index, demande in valides:
+        if demande.id_utilisateur not in demandeurs:
+            resultats.append(ResultatLigneImport(index=index, statut="rejetée", erreur="Utilisateur associé à la demande non trouvé"))
+            continue
+        if demande.id_groupe_sanguin_requis not in groupes:
+            resultats.append(ResultatLigneImport(index=index, statut="rejetée", erreur="Groupe sanguin requis non trouvé"))
+            continue
+        valeurs = dict(demande.model_dump(), date_demande=maintenant)
+        acceptees.append((index, resoudre_position(valeurs, demande.localisation_demande, demandeurs[demande.id_utilisateur])))
+
+    ids = enregistrer_lot_import(db, DemandeDon, "demandes", acceptees, [
+        ("demande", maintenant, v["id_groupe_sanguin_requis"], demandeurs[v["id_utilisateur"]].ville, v["statut"], v["quantite_demandee_ml"])
+        for _, v in acceptees
+    ], resultats)
+    if ids is None:
+        return resultats
+    for id_demande, (_, valeurs) in zip(ids, acceptees):
+        if moteur_affectation.charge and valeurs["statut"] == "en attente":
+            moteur_affectation.ajouter_demande(id_demande, valeurs["id_groupe_sanguin_requis"], valeurs["urgence"], maintenant)
+        publier_demande(id_demande, valeurs, demandeurs[valeurs["id_utilisateur"]].ville)
+    return resultats
+
+async def importer_en_masse(request: Request, db: AsyncSession, importer_lot) -> ResultatImport:
+    resultats, lot = [], []
+    async for index, ligne in lire_lignes_import(request):
+        lot.append((index, ligne))
+        if len(lot) >= IMPORT_TAILLE_LOT:
+            resultats.extend(await db.run_sync(importer_lot, lot))
+            lot = []
+    if lot:
+        resultats.extend(await db.run_sync(importer_lot, lot))
+
+    resultats.sort(key=lambda r: r.index)
+    creees = sum(1 for r in resultats if r.statut == "créée")
+    return ResultatImport(total=len(resultats), creees=creees, rejetees=len(resultats) - creees, resultats=resultats)
+
+
+# --- Export en flux (NDJSON / CSV) ---
+# Lecture par curseur côté serveur (stream_results) et envoi par partitions de
+# EXPORT_TAILLE_LOT lignes : la mémoire reste constante quelle que soit la table.
+EXPORT_TAILLE_LOT = int(os.getenv("EXPORT_TAILLE_LOT", "1000"))
+
+def tables_export():
+    # Colonne de date utilisée pour les filtres date_debut / date_fin (None : pas de filtre)
+    return {
+        "utilisateurs": (Utilisateur, [c for c in Utilisateur.__table__.c if c.name != "mot_de_passe_hache"], None),
+        "propositionsdon": (PropositionDon, list(PropositionDon.__table__.c), PropositionDon.date_proposition),
+        "demandesdon": (DemandeDon, list(DemandeDon.__table__.c), DemandeDon.date_demande),
+        "affectationsdon": (AffectationDon, list(AffectationDon.__table__.c), AffectationDon.date_affectation),
+    }
+
+def encoder_partition(lignes, noms, format_export: str, entete: bool) -> bytes:
+    if format_export == "csv":
+        tampon = io.StringIO()
+        writer = csv.writer(tampon)
+        if entete:
+            writer.writerow(noms)
+        writer.writerows(lignes)
+        return tampon.getvalue().encode()
+    return b"".join(orjson.dumps(dict(zip(noms, ligne))) + b"\n" for ligne in lignes)
+
+def generer_export_sync(requete, noms, format_export: str):
+    with obtenir_moteur().connect() as connexion:
+        resultat = connexion.execution_options(stream_results=True, yield_per=EXPORT_TAILLE_LOT).execute(requete)
+        entete = True
+        for partition in resultat.partitions():
+            yield encoder_partition(partition, noms, format_export, entete)
+            entete = False
+        if entete and format_export == "csv":
+            yield encoder_partition([], noms, format_export, True)
+
+async def generer_export_async(requete, noms, format_export: str):
+    async with obtenir_moteur_async().connect() as connexion:
+        resultat = await connexion.stream(requete)
+        entete = True
+        async for partition in resultat.partitions(EXPORT_TAILLE_LOT):
+            yield encoder_partition(partition, noms, format_export, entete)
+            entete = False
+        if entete and format_export == "csv":
+            yield encoder_partition([], noms, format_export, True)
+
+
+# --- Éligibilité des donneurs ---
+# Âge et délai depuis le dernier don terminé (selon le genre) sont précalculés dans
+# EligibiliteDonneur sous forme d'une période [eligible_du, eligible_jusqu_au) : une
+# ligne ne change qu'à la création du donneur ou d'une affectation, ou quand une
+# affectation change de statut. Les périodes restant exactes d'un jour à l'autre, le
+# recalcul complet quotidien (tâche de fond) ne fait que corriger une éventuelle
+# dérive ; la version "version:eligibilite" (jour ordinal du dernier recalcul) évite
+# que chaque worker le refasse, et signale une table jamais construite. Chaque worker
+# la vérifie à son démarrage puis toutes les ELIGIBILITE_RECALCUL_SECONDES.
+STATUT_AFFECTATION_EN_COURS = "en cours"
+STATUT_AFFECTATION_TERMINEE = "terminée"
+ELIGIBILITE_RECALCUL_SECONDES = int(os.getenv("ELIGIBILITE_RECALCUL_SECONDES", "86400"))
+VERSION_ELIGIBILITE = PREFIXE_VERSION + "eligibilite"
+regles_eligibilite = ReglesEligibilite(
+    age_min=int(os.getenv("ELIGIBILITE_AGE_MIN", "18")),
+    age_max=int(os.getenv("ELIGIBILITE_AGE_MAX", "65")),
+    intervalle_homme_jours=int(os.getenv("ELIGIBILITE_INTERVALLE_HOMME_JOURS", "56")),
+    intervalle_femme_jours=int(os.getenv("ELIGIBILITE_INTERVALLE_FEMME_JOURS", "84")),
+)
+eligibilite_construite = False
+
+def ligne_eligibilite(donneur, date_dernier_don: Optional[datetime], don_en_cours: bool,
+                      maintenant: Optional[datetime] = None) -> dict:
+    """`donneur` : objet ou ligne portant id, id_groupe_sanguin, ville, date_naissance, genre."""
+    eligible_du, eligible_jusqu_au = regles_eligibilite.periode(
+        donneur.date_naissance, donneur.genre, date_dernier_don, don_en_cours
+    )
+    return {
+        "id_utilisateur": donneur.id, "id_groupe_sanguin": donneur.id_groupe_sanguin, "ville": donneur.ville,
+        "date_dernier_don": date_dernier_don, "don_en_cours": don_en_cours,
+        "eligible_du": eligible_du, "eligible_jusqu_au": eligible_jusqu_au, "calcule_le": maintenant or datetime.now(),
+    }
+
+def recalculer_eligibilite(db: Session, ids_utilisateurs=None) -> int:
+    """
+    Recalcule les lignes des donneurs donnés (tous si None) dans la transaction
+    courante : deux lectures groupées, puis remplacement des lignes.
+    """
+    db.flush() # Les statuts modifiés dans la transaction doivent être vus (autoflush désactivé)
+    donneurs = select(
+        Utilisateur.id, Utilisateur.id_groupe_sanguin, Utilisateur.ville, Utilisateur.date_naissance, Utilisateur.genre
+    ).where(Utilisateur.id_groupe_sanguin.is_not(None))
+    # Le délai court à partir du don effectif ; les affectations terminées avant
+    # l'ajout de date_realisation retombent sur leur date d'affectation
+    dons = (
+        select(
+            PropositionDon.id_utilisateur, AffectationDon.statut_affectation,
+            func.max(func.coalesce(AffectationDon.date_realisation, AffectationDon.date_affectation)),
+        )
+        .join(PropositionDon, PropositionDon.id == AffectationDon.id_proposition_don)
+        .where(AffectationDon.statut_affectation.in_((STATUT_AFFECTATION_EN_COURS, STATUT_AFFECTATION_TERMINEE)))
+        .group_by(PropositionDon.id_utilisateur, AffectationDon.statut_affectation)
+    )
+    suppression = delete(EligibiliteDonneur)
+    if ids_utilisateurs is not None:
+        ids_utilisateurs = list(ids_utilisateurs)
+        if not ids_utilisateurs:
+            return 0
+        donneurs = donneurs.where(Utilisateur.id.in_(ids_utilisateurs))
+        dons = dons.where(PropositionDon.id_utilisateur.in_(ids_utilisateurs))
+        suppression = suppression.where(EligibiliteDonneur.id_utilisateur.in_(ids_utilisateurs))
+
+    # Suppression d'abord : ses verrous, posés avant la lecture des affectations, font
+    # attendre jusqu'à la validation les écritures concurrentes sur ces lignes (don en
+    # cours marqué par une affectation), qui s'appliquent donc aux lignes réécrites
+    db.execute(suppression)
+    derniers_dons, en_cours = {}, set()
+    for id_utilisateur, statut_affectation, date_don in db.execute(dons):
+        if statut_affectation == STATUT_AFFECTATION_EN_COURS:
+            en_cours.add(id_utilisateur)
+        else:
+            derniers_dons[id_utilisateur] = date_don
+    maintenant = datetime.now()
+    lignes = [ligne_eligibilite(d, derniers_dons.get(d.id), d.id in en_cours, maintenant) for d in db.execute(donneurs)]
+    if lignes:
+        # INSERT Core (executemany) : l'insertion en masse ORM repasse ligne à ligne
+        # dès que les clés à None diffèrent d'une ligne à l'autre
+        db.connection().execute(insert(EligibiliteDonneur.__table__), lignes)
+    return len(lignes)
+
+def indexer_nouveau_donneur(db: Session, utilisateur: "Utilisateur"):
+    """Ligne d'un utilisateur en cours de création : aucun don, seul l'âge compte."""
+    if utilisateur.id_groupe_sanguin is None:
+        return
+    db.flush() # Attribue l'id
+    db.add(EligibiliteDonneur(**ligne_eligibilite(utilisateur, None, False)))
+
+def marquer_eligibilite_affectations(db: Session, nouvelles, propositions: dict):
+    """Donneurs des affectations créées : un don en cours suspend l'éligibilité."""
+    en_cours, autres = set(), set()
+    for nouvelle in nouvelles:
+        id_donneur = propositions[nouvelle.id_proposition_don].id_utilisateur
+        (en_cours if nouvelle.statut_affectation == STATUT_AFFECTATION_EN_COURS else autres).add(id_donneur)
+    if en_cours:
+        db.execute(
+            update(EligibiliteDonneur).where(EligibiliteDonneur.id_utilisateur.in_(en_cours))
+            .values(don_en_cours=True, eligible_du=None, calcule_le=datetime.now())
+        )
+    if autres - en_cours:
+        # Affectation créée directement terminée (saisie a posteriori) : recalcul complet du donneur
+        recalculer_eligibilite(db, autres - en_cours)
+
+def actualiser_eligibilite(db: Session, quotidien: bool = True) -> Optional[int]:
+    """
+    Recalcul complet si la table n'a jamais été construite, ou (`quotidien`) si
+    aucun worker ne l'a recalculée aujourd'hui. Le tampon est posé dans la
+    transaction du recalcul : un seul worker le fait, un autre reprend en cas d'échec.
+    """
+    global eligibilite_construite
+    db.commit() # Transaction neuve : les lectures du recalcul suivent sa suppression
+    nombre = None
+    if reserver_tampon(db, VERSION_ELIGIBILITE, date.today().toordinal(), remplacer=quotidien):
+        nombre = recalculer_eligibilite(db)
+        db.commit()
+    else:
+        db.rollback()
+    eligibilite_construite = True
+    return nombre
+
+def _actualiser_eligibilite_tache():
+    db = ouvrir_session()
+    try:
+        actualiser_eligibilite(db)
+    finally:
+        db.close()
+
+async def boucle_recalcul_eligibilite():
+    while True:
+        # Vérification dès le démarrage : des workers redémarrés plus d'une fois
+        # par jour ne repoussent pas le recalcul indéfiniment
+        try:
+            await run_in_threadpool(_actualiser_eligibilite_tache)
+        except (SQLAlchemyError, OSError):
+            journal.exception("Erreur lors du recalcul de l'éligibilité des donneurs")
+        await asyncio.sleep(ELIGIBILITE_RECALCUL_SECONDES)
+
+
+# --- Affectation transactionnelle ---
+# Toutes les affectations passent par affecter_couples : les propositions et
+# demandes concernées sont verrouillées (SELECT ... FOR UPDATE), les statuts,
+# l'insertion et les compteurs sont validés par un seul commit.
+
+ERREUR_PROPOSITION_INTROUVABLE = "Proposition de don non trouvée"
+ERREUR_PROPOSITION_AFFECTEE = "Cette proposition de don est déjà affectée."
+
+def affecter_couples(db: Session, couples, id_administrateur: int, demande_en_attente_requise: bool = False):
+    """
+    `couples` : liste de AffectationDonCreate. Retourne un ResultatAffectation par couple ;
+    lève IntegrityError si une affectation concurrente a été validée entre-temps.
+    """
+    ids_propositions = {c.id_proposition_don for c in couples}
+    ids_demandes = {c.id_demande_don for c in couples}
+    # Deux lectures verrouillées, qui rapportent aussi groupe et ville des donneurs et
+    # demandeurs (agrégats, événements) et l'existence d'une affectation antérieure
+    deja_affectee = select(AffectationDon.id).where(AffectationDon.id_proposition_don == PropositionDon.id).exists()
+    propositions, donneurs, deja_affectees = {}, {}, set()
+    for proposition, id_groupe_donneur, ville_donneur, affectee in db.execute(
+        select(PropositionDon, Utilisateur.id_groupe_sanguin, Utilisateur.ville, deja_affectee)
+        .outerjoin(Utilisateur, Utilisateur.id == PropositionDon.id_utilisateur)
+        .where(PropositionDon.id.in_(ids_propositions)).with_for_update(of=PropositionDon)
+    ):
+        propositions[proposition.id] = proposition
+        donneurs[proposition.id] = (id_groupe_donneur, ville_donneur)
+        if affectee:
+            deja_affectees.add(proposition.id)
+    demandes, villes_demandeurs = {}, {}
+    for demande, ville_demandeur in db.execute(
+        select(DemandeDon, Utilisateur.ville)
+        .outerjoin(Utilisateur, Utilisateur.id == DemandeDon.id_utilisateur)
+        .where(DemandeDon.id.in_(ids_demandes)).with_for_update(of=DemandeDon)
+    ):
+        demandes[demande.id] = demande
+        villes_demandeurs[demande.id] = ville_demandeur
+
+    resultats, nouvelles = [], []
+    mouvements = {}
+    deplacements = [] # (proposition, ancien statut, demande, ancien statut)
+    maintenant = datetime.now()
+    for index, couple in enumerate(couples):
+        proposition = propositions.get(couple.id_proposition_don)
+        demande = demandes.get(couple.id_demande_don)
+        if proposition is None:
+            resultats.append(ResultatAffectation(index=index, statut="introuvable", erreur=ERREUR_PROPOSITION_INTROUVABLE))
+            continue
+        if demande is None:
+            resultats.append(ResultatAffectation(index=index, statut="introuvable", erreur="Demande de don non trouvée"))
+            continue
+        if proposition.id in deja_affectees or proposition.statut == "affectée":
+            resultats.append(ResultatAffectation(index=index, statut="conflit", erreur=ERREUR_PROPOSITION_AFFECTEE))
+            continue
+        if demande_en_attente_requise and demande.statut != "en attente":
+            resultats.append(ResultatAffectation(index=index, statut="conflit", erreur="Cette demande de don n'est plus en attente."))
+            continue
+
+        deplacements.append((proposition, proposition.statut, demande, demande.statut))
+        for prefixe, ligne in (("propositions", proposition), ("demandes", demande)):
+            cle = (prefixe, ligne.statut)
+            mouvements[cle] = mouvements.get(cle, 0) + 1
+            ligne.statut = "affectée"
+        deja_affectees.add(proposition.id)
+        nouvelle = AffectationDon(
+            id_proposition_don=couple.id_proposition_don,
+            id_demande_don=couple.id_demande_don,
+            id_administrateur=id_administrateur,
+            date_affectation=maintenant,
+            statut_affectation=couple.statut_affectation,
+            notes_administrateur=couple.notes_administrateur,
+            date_realisation=(
+                couple.date_realisation or maintenant
+                if couple.statut_affectation == STATUT_AFFECTATION_TERMINEE else None
+            ),
+        )
+        nouvelles.append((index, nouvelle))
+        resultats.append(None)
+
+    if nouvelles:
+        db.add_all([nouvelle for _, nouvelle in nouvelles])
+        db.flush()
+        compteurs = {"affectations:total": len(nouvelles), VERSION_MOTEUR_AFFECTATION: 1}
+        for (prefixe, ancien), nombre in mouvements.items():
+            deplacer_compteur(compteurs, prefixe, ancien, "affectée", nombre)
+        incrementer_compteurs(db, compteurs)
+        marquer_eligibilite_affectations(db, [nouvelle for _, nouvelle in nouvelles], propositions)
+
+        # Tous les déplacements de la requête en un seul upsert des agrégats
+        variations = {}
+        for proposition, ancien_p, demande, ancien_d in deplacements:
+            id_groupe_donneur, ville_donneur = donneurs[proposition.id]
+            deplacer_agregat(
+                variations, "proposition", proposition.date_proposition, id_groupe_donneur, ville_donneur, ancien_p, "affectée",
+            )
+            deplacer_agregat(
+                variations, "demande", demande.date_demande, demande.id_groupe_sanguin_requis,
+                villes_demandeurs[demande.id], ancien_d, "affectée", demande.quantite_demandee_ml,
+            )
+        appliquer_agregats(db, variations)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise
+
+    for index, nouvelle in nouvelles:
+        resultats[index] = ResultatAffectation(
+            index=index, statut="créée", affectation=AffectationDonResponse.model_validate(nouvelle, from_attributes=True)
+        )
+        moteur_affectation.retirer_affectation(nouvelle.id_proposition_don, nouvelle.id_demande_don)
+    if nouvelles:
+        version_moteur_affectation.noter_ecriture()
+    if nouvelles and (bus_evenements.abonnements or EVENEMENTS_PARTAGES):
+        for _, nouvelle in nouvelles:
+            publier_affectation(nouvelle, demandes[nouvelle.id_demande_don], villes_demandeurs[nouvelle.id_demande_don])
+    return resultats
+
+async def executer_affectations(db: AsyncSession, couples, id_administrateur: int, demande_en_attente_requise: bool = False):
+    try:
+        return await db.run_sync(affecter_couples, couples, id_administrateur, demande_en_attente_requise)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Conflit : une proposition a été affectée simultanément, veuillez réessayer.")
 
 
 # --- Endpoints de l'API ---
 
-@app.get("/")
+@router.get("/")
 async def read_root():
     return {"message": "Bienvenue sur l'API de gestion de dons de sang !"}
 
-@app.get("/db-test")
-async def db_test(db: Session = Depends(get_db)):
+@router.get("/db-test")
+async def db_test(db: AsyncSession = Depends(get_db)):
     try:
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
         return {"message": "Connexion à la base de données réussie !"}
     except SQLAlchemyError as e:
         raise HTTPException(
@@ -261,41 +2021,129 @@ async def db_test(db: Session = Depends(get_db)):
             detail=f"Erreur de connexion à la base de données: {str(e)}"
         )
 
+# --- Sondes de santé ---
+# /health/live ne touche pas la base. /health/ready renvoie le dernier résultat
+# d'un SELECT 1 exécuté en tâche de fond toutes les SANTE_VERIFICATION_SECONDES
+# (ou à la demande s'il est périmé) : une sonde fréquente ne coûte rien.
+SANTE_VERIFICATION_SECONDES = float(os.getenv("SANTE_VERIFICATION_SECONDES", "5"))
+SANTE_DELAI_SECONDES = float(os.getenv("SANTE_DELAI_SECONDES", "2"))
+etat_base = {"ok": False, "verifie_le": None, "duree_ms": None, "erreur": None}
+verification_base_en_cours = False
+
+def _ping_base_sync():
+    with obtenir_moteur().connect() as connexion:
+        connexion.execute(text("SELECT 1"))
+
+async def _ping_base():
+    if DATABASE_ASYNC:
+        async with obtenir_moteur_async().connect() as connexion:
+            await connexion.execute(text("SELECT 1"))
+    else:
+        await run_in_threadpool(_ping_base_sync)
+
+async def verifier_base():
+    global verification_base_en_cours
+    verification_base_en_cours = True
+    debut = time.perf_counter()
+    try:
+        await asyncio.wait_for(_ping_base(), SANTE_DELAI_SECONDES)
+        etat_base.update(ok=True, erreur=None)
+    except (SQLAlchemyError, OSError, asyncio.TimeoutError) as e:
+        etat_base.update(ok=False, erreur=e.__class__.__name__)
+    finally:
+        etat_base.update(verifie_le=time.time(), duree_ms=round((time.perf_counter() - debut) * 1000, 2))
+        verification_base_en_cours = False
+
+async def boucle_verification_base():
+    while True:
+        await verifier_base()
+        await asyncio.sleep(SANTE_VERIFICATION_SECONDES)
+
+@router.get("/health/live")
+async def health_live():
+    return {"statut": "ok"}
+
+@router.get("/health/ready")
+async def health_ready():
+    perime = etat_base["verifie_le"] is None or time.time() - etat_base["verifie_le"] > 2 * SANTE_VERIFICATION_SECONDES
+    if perime and not verification_base_en_cours:
+        # Pas de tâche de fond (tests, ASGI sans lifespan) ou tâche bloquée
+        await verifier_base()
+    contenu = {
+        "statut": "ok" if etat_base["ok"] else "indisponible",
+        "base": etat_base,
+        "pool": statistiques_pool(obtenir_moteur_async() if DATABASE_ASYNC else obtenir_moteur()),
+    }
+    return ORJSONResponse(contenu, status_code=200 if etat_base["ok"] else status.HTTP_503_SERVICE_UNAVAILABLE)
+
 # --- CRUD pour GroupeSanguin ---
 
-@app.post("/groupesanguin/", response_model=GroupeSanguinResponse, status_code=status.HTTP_201_CREATED)
-async def create_groupe_sanguin(groupe: GroupeSanguinCreate, db: Session = Depends(get_db)):
-    db_groupe = db.query(GroupeSanguin).filter(GroupeSanguin.nom_groupe == groupe.nom_groupe).first()
-    if db_groupe:
+@router.post("/groupesanguin/", response_model=GroupeSanguinResponse, status_code=status.HTTP_201_CREATED)
+async def create_groupe_sanguin(
+    groupe: GroupeSanguinCreate,
+    db: AsyncSession = Depends(get_db),
+    cache: CacheGroupesSanguins = Depends(get_cache_groupes_sanguins)
+):
+    if groupe.nom_groupe in cache.par_nom:
         raise HTTPException(status_code=400, detail="Groupe sanguin existe déjà")
     
     new_groupe = GroupeSanguin(nom_groupe=groupe.nom_groupe)
     db.add(new_groupe)
-    db.commit()
-    db.refresh(new_groupe)
+    await db.run_sync(incrementer_compteurs, {VERSION_GROUPES_SANGUINS: 1, VERSION_MOTEUR_AFFECTATION: 1})
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Créé entre-temps par un autre worker (contrainte unique sur nom_groupe)
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Groupe sanguin existe déjà")
+    await db.refresh(new_groupe)
+    await db.run_sync(cache.charger)
+    if moteur_affectation.charge:
+        moteur_affectation.definir_groupe(new_groupe.id, new_groupe.nom_groupe)
+    version_moteur_affectation.noter_ecriture()
     return new_groupe
 
-@app.get("/groupesanguin/", response_model=List[GroupeSanguinResponse])
-async def read_groupes_sanguin(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    groupes = db.query(GroupeSanguin).offset(skip).limit(limit).all()
+@router.get("/groupesanguin/", response_model=List[GroupeSanguinResponse])
+async def read_groupes_sanguin(
+    request: Request, response: Response, skip: int = 0, limit: int = 100, after: Optional[str] = None,
+    cache: CacheGroupesSanguins = Depends(get_cache_groupes_sanguins)
+):
+    # Servi depuis le cache ; l'ETag permet au client de ne pas retélécharger la liste
+    if request.headers.get("if-none-match") == cache.etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": cache.etag})
+    response.headers["ETag"] = cache.etag
+
+    if after is None:
+        return cache.liste[skip:skip + limit]
+    groupes = cache.liste
+    if after:
+        (dernier_id,) = decoder_curseur(after, [GroupeSanguin.id])
+        groupes = [g for g in groupes if g.id > dernier_id]
+    groupes = groupes[:limit]
+    if groupes and len(groupes) == limit:
+        response.headers["X-Next-Cursor"] = encoder_curseur([groupes[-1].id])
     return groupes
 
-@app.get("/groupesanguin/{groupe_id}", response_model=GroupeSanguinResponse)
-async def read_groupe_sanguin(groupe_id: int, db: Session = Depends(get_db)):
-    groupe = db.query(GroupeSanguin).filter(GroupeSanguin.id == groupe_id).first()
+@router.get("/groupesanguin/{groupe_id}", response_model=GroupeSanguinResponse)
+async def read_groupe_sanguin(
+    groupe_id: int,
+    db: AsyncSession = Depends(get_db),
+    cache: CacheGroupesSanguins = Depends(get_cache_groupes_sanguins)
+):
+    groupe = cache.par_id.get(groupe_id) or await db.get(GroupeSanguin, groupe_id)
     if groupe is None:
         raise HTTPException(status_code=404, detail="Groupe sanguin non trouvé")
     return groupe
 
 # --- CRUD pour Utilisateur ---
 
-@app.post("/utilisateurs/", response_model=UtilisateurResponse, status_code=status.HTTP_201_CREATED)
-async def create_utilisateur(user: UtilisateurCreate, db: Session = Depends(get_db)):
-    db_user = db.query(Utilisateur).filter(Utilisateur.email == user.email).first()
+@router.post("/utilisateurs/", response_model=UtilisateurResponse, status_code=status.HTTP_201_CREATED)
+async def create_utilisateur(user: UtilisateurCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await db.scalar(select(Utilisateur).where(Utilisateur.email == user.email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email déjà enregistré")
     
-    hashed_password = get_password_hash(user.mot_de_passe)
+    hashed_password = await executer_hachage(get_password_hash, user.mot_de_passe)
     
     new_user = Utilisateur(
         nom=user.nom,
@@ -308,30 +2156,40 @@ async def create_utilisateur(user: UtilisateurCreate, db: Session = Depends(get_
         telephone=user.telephone,
         date_naissance=user.date_naissance,
         genre=user.genre,
-        id_groupe_sanguin=user.id_groupe_sanguin
+        id_groupe_sanguin=user.id_groupe_sanguin,
+        **resoudre_position(user.model_dump(include={"latitude", "longitude"}), user.ville)
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.run_sync(incrementer_compteur, f"utilisateurs:{new_user.role}")
+    await db.run_sync(indexer_nouveau_donneur, new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
-@app.get("/utilisateurs/", response_model=List[UtilisateurResponse])
-async def read_utilisateurs(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = db.query(Utilisateur).offset(skip).limit(limit).all()
-    return users
-
-@app.get("/utilisateurs/{user_id}", response_model=UtilisateurResponse)
-async def read_utilisateur(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(Utilisateur).filter(Utilisateur.id == user_id).first()
+@router.get("/utilisateurs/", response_model=List[UtilisateurResponse])
+async def read_utilisateurs(
+    response: Response, skip: int = 0, limit: int = 100, after: Optional[str] = None, ordre: str = "asc",
+    role: Optional[str] = None, ville: Optional[str] = None, id_groupe_sanguin: Optional[int] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    requete = filtrer(select(*colonnes_reponse(Utilisateur, UtilisateurResponse)), {
+        Utilisateur.role: role, Utilisateur.ville: ville, Utilisateur.id_groupe_sanguin: id_groupe_sanguin,
+    })
+    users = await paginer(db, requete, [Utilisateur.id], skip, limit, after, response, ordre)
+    return reponse_liste(users, response)
+
+@router.get("/utilisateurs/{user_id}", response_model=UtilisateurResponse)
+async def read_utilisateur(user_id: int, db: AsyncSession = Depends(get_db)):
+    user = await db.get(Utilisateur, user_id)
     if user is None:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
     return user
 
 # --- CRUD pour PropositionDon ---
 
-@app.post("/propositionsdon/", response_model=PropositionDonResponse, status_code=status.HTTP_201_CREATED)
-async def create_proposition_don(proposition: PropositionDonCreate, db: Session = Depends(get_db)):
-    db_user = db.query(Utilisateur).filter(Utilisateur.id == proposition.id_utilisateur).first()
+@router.post("/propositionsdon/", response_model=PropositionDonResponse, status_code=status.HTTP_201_CREATED)
+async def create_proposition_don(proposition: PropositionDonCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await db.get(Utilisateur, proposition.id_utilisateur)
     if not db_user:
         raise HTTPException(status_code=404, detail="Utilisateur associé à la proposition non trouvé")
 
@@ -341,34 +2199,76 @@ async def create_proposition_don(proposition: PropositionDonCreate, db: Session
         disponibilite_date_heure=proposition.disponibilite_date_heure,
         localisation_proposition=proposition.localisation_proposition,
         statut=proposition.statut,
-        notes=proposition.notes
+        notes=proposition.notes,
+        **resoudre_position(proposition.model_dump(include={"latitude", "longitude"}), proposition.localisation_proposition, db_user)
     )
     db.add(new_proposition)
-    db.commit()
-    db.refresh(new_proposition)
+    await db.run_sync(incrementer_compteurs, {
+        f"propositions:{new_proposition.statut}": 1,
+        VERSION_MOTEUR_AFFECTATION: 1 if new_proposition.statut == "en attente" else 0,
+    })
+    await db.run_sync(comptabiliser_creations, [(
+        "proposition", new_proposition.date_proposition, db_user.id_groupe_sanguin, db_user.ville, new_proposition.statut, 0
+    )])
+    await db.commit()
+    await db.refresh(new_proposition)
+    if moteur_affectation.charge and new_proposition.statut == "en attente":
+        moteur_affectation.ajouter_proposition(
+            new_proposition.id, db_user.id_groupe_sanguin, new_proposition.date_proposition,
+            premiere_position((new_proposition.latitude, new_proposition.longitude)),
+        )
+    if new_proposition.statut == "en attente":
+        version_moteur_affectation.noter_ecriture()
+    publier_proposition(new_proposition.id, new_proposition.__dict__, db_user.id_groupe_sanguin, db_user.ville)
     return new_proposition
 
-@app.get("/propositionsdon/", response_model=List[PropositionDonResponse])
-async def read_propositions_don(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    propositions = db.query(PropositionDon).offset(skip).limit(limit).all()
-    return propositions
+@router.post("/propositionsdon/bulk", response_model=ResultatImport)
+async def create_propositions_don_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    """Import en masse : tableau JSON, ou NDJSON (Content-Type: application/x-ndjson) lu en flux."""
+    return await importer_en_masse(request, db, importer_lot_propositions)
+
+@router.get("/propositionsdon/", response_model=List[PropositionDonResponse])
+async def read_propositions_don(
+    response: Response, skip: int = 0, limit: int = 100, after: Optional[str] = None, ordre: str = "asc",
+    statut: Optional[str] = None, localisation: Optional[str] = None,
+    ville: Optional[str] = None, id_groupe_sanguin: Optional[int] = None,
+    date_debut: Optional[datetime] = None, date_fin: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """`ville` et `id_groupe_sanguin` portent sur le donneur ; `localisation` est une égalité exacte."""
+    requete = filtrer(select(*colonnes_reponse(PropositionDon, PropositionDonResponse)), {
+        PropositionDon.statut: statut, PropositionDon.localisation_proposition: localisation,
+    })
+    requete = filtrer_utilisateurs(requete, PropositionDon.id_utilisateur, ville, id_groupe_sanguin)
+    requete = filtrer_periode(requete, PropositionDon.date_proposition, date_debut, date_fin)
+    propositions = await paginer(
+        db, requete, [PropositionDon.date_proposition, PropositionDon.id], skip, limit, after, response, ordre
+    )
+    return reponse_liste(propositions, response)
 
-@app.get("/propositionsdon/{proposition_id}", response_model=PropositionDonResponse)
-async def read_proposition_don(proposition_id: int, db: Session = Depends(get_db)):
-    proposition = db.query(PropositionDon).filter(PropositionDon.id == proposition_id).first()
+@router.get("/propositionsdon/{proposition_id}", response_model=PropositionDonResponse)
+async def read_proposition_don(proposition_id: int, db: AsyncSession = Depends(get_db)):
+    proposition = await db.get(PropositionDon, proposition_id)
     if proposition is None:
         raise HTTPException(status_code=404, detail="Proposition de don non trouvée")
     return proposition
 
 # --- CRUD pour DemandeDon ---
 
-@app.post("/demandesdon/", response_model=DemandeDonResponse, status_code=status.HTTP_201_CREATED)
-async def create_demande_don(demande: DemandeDonCreate, db: Session = Depends(get_db)):
-    db_user = db.query(Utilisateur).filter(Utilisateur.id == demande.id_utilisateur).first()
+@router.post("/demandesdon/", response_model=DemandeDonResponse, status_code=status.HTTP_201_CREATED)
+async def create_demande_don(
+    demande: DemandeDonCreate,
+    db: AsyncSession = Depends(get_db),
+    cache: CacheGroupesSanguins = Depends(get_cache_groupes_sanguins)
+):
+    db_user = await db.get(Utilisateur, demande.id_utilisateur)
     if not db_user:
         raise HTTPException(status_code=404, detail="Utilisateur associé à la demande non trouvé")
     
-    db_groupe_sanguin = db.query(GroupeSanguin).filter(GroupeSanguin.id == demande.id_groupe_sanguin_requis).first()
+    db_groupe_sanguin = (
+        cache.par_id.get(demande.id_groupe_sanguin_requis)
+        or await db.get(GroupeSanguin, demande.id_groupe_sanguin_requis)
+    )
     if not db_groupe_sanguin:
         raise HTTPException(status_code=404, detail="Groupe sanguin requis non trouvé")
 
@@ -380,143 +2280,741 @@ async def create_demande_don(demande: DemandeDonCreate, db: Session = Depends(ge
         localisation_demande=demande.localisation_demande,
         urgence=demande.urgence,
         statut=demande.statut,
-        description=demande.description
+        description=demande.description,
+        **resoudre_position(demande.model_dump(include={"latitude", "longitude"}), demande.localisation_demande, db_user)
     )
     db.add(new_demande)
-    db.commit()
-    db.refresh(new_demande)
+    await db.run_sync(incrementer_compteurs, {
+        f"demandes:{new_demande.statut}": 1,
+        VERSION_MOTEUR_AFFECTATION: 1 if new_demande.statut == "en attente" else 0,
+    })
+    await db.run_sync(comptabiliser_creations, [(
+        "demande", new_demande.date_demande, new_demande.id_groupe_sanguin_requis, db_user.ville,
+        new_demande.statut, new_demande.quantite_demandee_ml
+    )])
+    await db.commit()
+    await db.refresh(new_demande)
+    if moteur_affectation.charge and new_demande.statut == "en attente":
+        moteur_affectation.ajouter_demande(
+            new_demande.id, new_demande.id_groupe_sanguin_requis, new_demande.urgence, new_demande.date_demande
+        )
+    if new_demande.statut == "en attente":
+        version_moteur_affectation.noter_ecriture()
+    publier_demande(new_demande.id, new_demande.__dict__, db_user.ville)
     return new_demande
 
-@app.get("/demandesdon/", response_model=List[DemandeDonResponse])
-async def read_demandes_don(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    demandes = db.query(DemandeDon).offset(skip).limit(limit).all()
-    return demandes
+@router.post("/demandesdon/bulk", response_model=ResultatImport)
+async def create_demandes_don_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    """Import en masse : tableau JSON, ou NDJSON (Content-Type: application/x-ndjson) lu en flux."""
+    return await importer_en_masse(request, db, importer_lot_demandes)
+
+@router.get("/demandesdon/", response_model=List[DemandeDonResponse])
+async def read_demandes_don(
+    response: Response, skip: int = 0, limit: int = 100, after: Optional[str] = None, ordre: str = "asc",
+    statut: Optional[str] = None, urgence: Optional[str] = None, id_groupe_sanguin_requis: Optional[int] = None,
+    localisation: Optional[str] = None, ville: Optional[str] = None,
+    date_debut: Optional[datetime] = None, date_fin: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Ex. demandes O- en attente, urgence haute, à Casablanca, les plus anciennes d'abord :
+    ?statut=en attente&id_groupe_sanguin_requis=8&urgence=haute&ville=Casablanca&ordre=asc
+    `ville` porte sur le demandeur ; `localisation` est une égalité exacte.
+    """
+    requete = filtrer(select(*colonnes_reponse(DemandeDon, DemandeDonResponse)), {
+        DemandeDon.statut: statut, DemandeDon.urgence: urgence,
+        DemandeDon.id_groupe_sanguin_requis: id_groupe_sanguin_requis, DemandeDon.localisation_demande: localisation,
+    })
+    requete = filtrer_utilisateurs(requete, DemandeDon.id_utilisateur, ville)
+    requete = filtrer_periode(requete, DemandeDon.date_demande, date_debut, date_fin)
+    demandes = await paginer(
+        db, requete, [DemandeDon.date_demande, DemandeDon.id], skip, limit, after, response, ordre
+    )
+    return reponse_liste(demandes, response)
 
-@app.get("/demandesdon/{demande_id}", response_model=DemandeDonResponse)
-async def read_demande_don(demande_id: int, db: Session = Depends(get_db)):
-    demande = db.query(DemandeDon).filter(DemandeDon.id == demande_id).first()
+@router.get("/demandesdon/{demande_id}", response_model=DemandeDonResponse)
+async def read_demande_don(demande_id: int, db: AsyncSession = Depends(get_db)):
+    demande = await db.get(DemandeDon, demande_id)
     if demande is None:
         raise HTTPException(status_code=404, detail="Demande de don non trouvée")
     return demande
 
+@router.get("/demandesdon/{demande_id}/nearby-donors", response_model=List[DonneurProche])
+async def read_donneurs_proches(
+    demande_id: int,
+    rayon_km: float = Query(50, gt=0),
+    limite: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+    moteur: MoteurAffectation = Depends(get_moteur_affectation),
+    current_admin: Principal = Depends(get_current_admin_user)
+):
+    """
+    Propositions en attente compatibles (ABO/Rh) dans un rayon autour de la demande,
+    les plus proches d'abord. La recherche se fait dans l'index spatial du moteur ;
+    la base n'est lue que pour les `limite` propositions retenues.
+    """
+    demande = await db.get(DemandeDon, demande_id)
+    if demande is None:
+        raise HTTPException(status_code=404, detail="Demande de don non trouvée")
+    position = premiere_position((demande.latitude, demande.longitude), demande.localisation_demande)
+    if position is None:
+        raise HTTPException(status_code=400, detail="Localisation de la demande inconnue")
+
+    distances = dict(moteur.propositions_proches(demande.id_groupe_sanguin_requis, position, rayon_km, limite))
+    if not distances:
+        return []
+    lignes = (await db.execute(
+        select(
+            PropositionDon.id.label("id_proposition_don"), PropositionDon.id_utilisateur,
+            Utilisateur.id_groupe_sanguin, PropositionDon.localisation_proposition, PropositionDon.date_proposition,
+        )
+        .join(Utilisateur, Utilisateur.id == PropositionDon.id_utilisateur)
+        .where(PropositionDon.id.in_(distances), PropositionDon.statut == "en attente")
+    )).mappings().all()
+    trouvees = {ligne["id_proposition_don"]: ligne for ligne in lignes}
+    for id_proposition in distances.keys() - trouvees.keys():
+        # Index en retard sur la base (autre worker) : la proposition n'est plus disponible
+        moteur.retirer_proposition(id_proposition)
+    return [
+        dict(trouvees[i], nom_groupe=moteur.noms_groupes.get(trouvees[i]["id_groupe_sanguin"]), distance_km=distance)
+        for i, distance in distances.items() if i in trouvees
+    ]
+
 
 # --- CRUD pour AffectationDon (Accessible par les administrateurs) ---
 
-@app.post("/affectationsdon/", response_model=AffectationDonResponse, status_code=status.HTTP_201_CREATED)
+@router.post("/affectationsdon/", response_model=AffectationDonResponse, status_code=status.HTTP_201_CREATED)
 async def create_affectation_don(
     affectation: AffectationDonCreate,
-    db: Session = Depends(get_db),
-    current_admin: Utilisateur = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin_user)
 ):
-    db_proposition = db.query(PropositionDon).filter(PropositionDon.id == affectation.id_proposition_don).first()
-    if not db_proposition:
-        raise HTTPException(status_code=404, detail="Proposition de don non trouvée")
-    
-    if db.query(AffectationDon).filter(AffectationDon.id_proposition_don == affectation.id_proposition_don).first():
-        raise HTTPException(status_code=400, detail="Cette proposition de don est déjà affectée.")
-
-    db_demande = db.query(DemandeDon).filter(DemandeDon.id == affectation.id_demande_don).first()
-    if not db_demande:
-        raise HTTPException(status_code=404, detail="Demande de don non trouvée")
-    
-    new_affectation = AffectationDon(
-        id_proposition_don=affectation.id_proposition_don,
-        id_demande_don=affectation.id_demande_don,
-        id_administrateur=current_admin.id,
-        date_affectation=datetime.now(),
-        statut_affectation=affectation.statut_affectation,
-        notes_administrateur=affectation.notes_administrateur
-    )
-    db.add(new_affectation)
-    db.commit()
-    db.refresh(new_affectation)
-    
-    db_proposition.statut = "affectée"
-    db_demande.statut = "affectée"
-    db.add(db_proposition)
-    db.add(db_demande)
-    db.commit()
-
-    return new_affectation
+    (resultat,) = await executer_affectations(db, [affectation], current_admin.id)
+    if resultat.statut == "introuvable":
+        raise HTTPException(status_code=404, detail=resultat.erreur)
+    if resultat.statut == "conflit":
+        raise HTTPException(status_code=400, detail=resultat.erreur)
+    return resultat.affectation
+
+@router.post("/affectationsdon/batch", response_model=List[ResultatAffectation])
+async def create_affectations_don_batch(
+    affectations: List[AffectationDonCreate],
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin_user)
+):
+    """Affecte plusieurs couples en une transaction ; les conflits sont signalés couple par couple."""
+    if not affectations:
+        return []
+    return await executer_affectations(db, affectations, current_admin.id)
+
+@router.get("/affectationsdon/suggestions", response_model=List[SuggestionAffectation])
+async def suggest_affectations_don(
+    limite: int = Query(100, ge=1, le=1000),
+    moteur: MoteurAffectation = Depends(get_moteur_affectation),
+    current_admin: Principal = Depends(get_current_admin_user)
+):
+    couples = moteur.suggerer(limite=limite)
+    return [{"id_proposition_don": p, "id_demande_don": d} for p, d in couples]
+
+@router.post("/affectationsdon/auto", response_model=List[AffectationDonResponse], status_code=status.HTTP_201_CREATED)
+async def auto_affectations_don(
+    limite: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+    moteur: MoteurAffectation = Depends(get_moteur_affectation),
+    current_admin: Principal = Depends(get_current_admin_user)
+):
+    couples = moteur.suggerer(limite=limite)
+    if not couples:
+        return []
 
-@app.get("/affectationsdon/", response_model=List[AffectationDonResponse])
+    # Les index peuvent être en retard sur la base (autre worker, modification manuelle) :
+    # les couples dont un côté n'est plus en attente sont écartés et retirés des index.
+    try:
+        resultats = await executer_affectations(db, [
+            AffectationDonCreate(
+                id_proposition_don=id_proposition,
+                id_demande_don=id_demande,
+                id_administrateur=current_admin.id,
+                notes_administrateur="Affectation automatique (compatibilité ABO/Rh)."
+            )
+            for id_proposition, id_demande in couples
+        ], current_admin.id, demande_en_attente_requise=True)
+    except HTTPException:
+        # Index incohérents : ils seront reconstruits depuis la base au prochain appel
+        moteur.reinitialiser()
+        raise
+    for (id_proposition, id_demande), resultat in zip(couples, resultats):
+        if resultat.erreur in (ERREUR_PROPOSITION_INTROUVABLE, ERREUR_PROPOSITION_AFFECTEE):
+            moteur.retirer_proposition(id_proposition)
+        elif resultat.erreur:
+            moteur.retirer_demande(id_demande)
+    return [r.affectation for r in resultats if r.affectation is not None]
+
+@router.get("/affectationsdon/", response_model=List[AffectationDonResponse])
 async def read_affectations_don(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db), 
-    current_admin: Utilisateur = Depends(get_current_admin_user)
+    response: Response, skip: int = 0, limit: int = 100, after: Optional[str] = None, ordre: str = "asc",
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin_user)
+):
+    affectations = await paginer(
+        db, select(*colonnes_reponse(AffectationDon, AffectationDonResponse)),
+        [AffectationDon.date_affectation, AffectationDon.id], skip, limit, after, response, ordre
+    )
+    return reponse_liste(affectations, response)
+
+@router.patch("/affectationsdon/{affectation_id}", response_model=AffectationDonResponse)
+async def update_affectation_don(
+    affectation_id: int,
+    modification: AffectationDonUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin_user)
 ):
-    affectations = db.query(AffectationDon).offset(skip).limit(limit).all()
-    return affectations
+    """
+    Ex. {"statut_affectation": "terminée"} une fois le don effectué : date_realisation
+    vaut alors l'instant du passage (ou la date fournie) et fait courir le délai
+    avant le don suivant.
+    """
+    affectation = await db.get(AffectationDon, affectation_id)
+    if affectation is None:
+        raise HTTPException(status_code=404, detail="Affectation de don non trouvée")
+    valeurs = modification.model_dump(exclude_none=True)
+    statut = valeurs.get("statut_affectation", affectation.statut_affectation)
+    if statut != STATUT_AFFECTATION_TERMINEE:
+        valeurs["date_realisation"] = None
+    elif affectation.statut_affectation != STATUT_AFFECTATION_TERMINEE:
+        valeurs.setdefault("date_realisation", datetime.now())
+    eligibilite_modifiee = (
+        statut != affectation.statut_affectation
+        or valeurs.get("date_realisation", affectation.date_realisation) != affectation.date_realisation
+    )
+    for champ, valeur in valeurs.items():
+        setattr(affectation, champ, valeur)
+    if eligibilite_modifiee:
+        id_donneur = await db.scalar(
+            select(PropositionDon.id_utilisateur).where(PropositionDon.id == affectation.id_proposition_don)
+        )
+        await db.run_sync(recalculer_eligibilite, [id_donneur] if id_donneur is not None else [])
+    await db.commit()
+    await db.refresh(affectation)
+    return affectation
 
-@app.get("/affectationsdon/{affectation_id}", response_model=AffectationDonResponse)
+@router.get("/affectationsdon/{affectation_id}", response_model=AffectationDonResponse)
 async def read_affectation_don(
     affectation_id: int, 
-    db: Session = Depends(get_db), 
-    current_admin: Utilisateur = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_db), 
+    current_admin: Principal = Depends(get_current_admin_user)
 ):
-    affectation = db.query(AffectationDon).filter(AffectationDon.id == affectation_id).first()
+    affectation = await db.get(AffectationDon, affectation_id)
     if affectation is None:
         raise HTTPException(status_code=404, detail="Affectation de don non trouvée")
     return affectation
 
 
+# --- Donneurs éligibles (campagnes d'appel au don) ---
+
+@router.get("/donneurs/eligibles", response_model=List[DonneurEligible])
+async def read_donneurs_eligibles(
+    response: Response, skip: int = 0, limit: int = 100, after: Optional[str] = None, ordre: str = "asc",
+    id_groupe_sanguin: Optional[int] = None, ville: Optional[str] = None, date_campagne: Optional[date] = None,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin_user)
+):
+    """
+    Donneurs éligibles le jour `date_campagne` (aujourd'hui par défaut), ceux qui le
+    sont depuis le plus longtemps d'abord (`ordre=asc`). Lecture d'une plage de
+    l'index (groupe, ville, eligible_du) jointe à Utilisateur par clé primaire.
+    """
+    if not eligibilite_construite:
+        # Base existante : construction de la table à la première lecture
+        await db.run_sync(actualiser_eligibilite, False)
+    jour = date_campagne or date.today()
+    requete = filtrer(
+        select(
+            EligibiliteDonneur.id_utilisateur, Utilisateur.nom, Utilisateur.prenom, Utilisateur.telephone,
+            EligibiliteDonneur.ville, EligibiliteDonneur.id_groupe_sanguin,
+            EligibiliteDonneur.date_dernier_don, EligibiliteDonneur.eligible_du,
+        ).join(Utilisateur, Utilisateur.id == EligibiliteDonneur.id_utilisateur),
+        {EligibiliteDonneur.id_groupe_sanguin: id_groupe_sanguin, EligibiliteDonneur.ville: ville},
+    ).where(
+        EligibiliteDonneur.eligible_du <= jour,
+        or_(EligibiliteDonneur.eligible_jusqu_au.is_(None), EligibiliteDonneur.eligible_jusqu_au > jour),
+    )
+    donneurs = await paginer(
+        db, requete, [EligibiliteDonneur.eligible_du, EligibiliteDonneur.id_utilisateur], skip, limit, after, response, ordre
+    )
+    return reponse_liste(donneurs, response)
+
+
+# --- Tableau de bord administrateur ---
+
+def requete_tableau_de_bord(limite: int):
+    """Propositions et demandes en attente, jointes, en une seule requête UNION ALL."""
+    propositions = (
+        select(
+            literal("proposition").label("type"),
+            PropositionDon.id, PropositionDon.id_utilisateur,
+            PropositionDon.date_proposition.label("date"),
+            PropositionDon.localisation_proposition.label("localisation"),
+            PropositionDon.statut, PropositionDon.notes.label("texte"),
+            PropositionDon.disponibilite_date_heure.label("disponibilite"),
+            PropositionDon.latitude, PropositionDon.longitude,
+            Utilisateur.id_groupe_sanguin.label("id_groupe"),
+            cast(null(), Integer).label("quantite"), cast(null(), String).label("urgence"),
+            Utilisateur.nom, Utilisateur.prenom, Utilisateur.ville, Utilisateur.telephone,
+            GroupeSanguin.nom_groupe,
+        )
+        .join(Utilisateur, Utilisateur.id == PropositionDon.id_utilisateur)
+        .outerjoin(GroupeSanguin, GroupeSanguin.id == Utilisateur.id_groupe_sanguin)
+        .where(PropositionDon.statut == "en attente")
+        .order_by(PropositionDon.date_proposition, PropositionDon.id)
+        .limit(limite)
+    )
+    demandes = (
+        select(
+            literal("demande").label("type"),
+            DemandeDon.id, DemandeDon.id_utilisateur,
+            DemandeDon.date_demande.label("date"),
+            DemandeDon.localisation_demande.label("localisation"),
+            DemandeDon.statut, DemandeDon.description.label("texte"),
+            cast(null(), DateTime).label("disponibilite"),
+            DemandeDon.latitude, DemandeDon.longitude,
+            DemandeDon.id_groupe_sanguin_requis.label("id_groupe"),
+            DemandeDon.quantite_demandee_ml.label("quantite"), DemandeDon.urgence,
+            Utilisateur.nom, Utilisateur.prenom, Utilisateur.ville, Utilisateur.telephone,
+            GroupeSanguin.nom_groupe,
+        )
+        .join(Utilisateur, Utilisateur.id == DemandeDon.id_utilisateur)
+        .outerjoin(GroupeSanguin, GroupeSanguin.id == DemandeDon.id_groupe_sanguin_requis)
+        .where(DemandeDon.statut == "en attente")
+        .order_by(DemandeDon.date_demande, DemandeDon.id)
+        .limit(limite)
+    )
+    # Chaque branche est encapsulée (LIMIT/ORDER BY interdits dans une branche nue sous SQLite)
+    return union_all(
+        select(propositions.subquery()),
+        select(demandes.subquery()),
+    )
+
+def etag_tableau_de_bord(compteurs: dict, limite: int) -> str:
+    # Les totaux ne font que croître : toute création ou affectation change l'ETag
+    def total(prefixe):
+        return sum(v for nom, v in compteurs.items() if nom.startswith(prefixe + ":"))
+    return f'W/"dashboard-{total("propositions")}-{total("demandes")}-{total("affectations")}-{limite}"'
+
+@router.get("/admin/dashboard", response_model=TableauDeBordAdmin)
+async def read_admin_dashboard(
+    request: Request,
+    response: Response,
+    limite: int = Query(500, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin_user)
+):
+    etag = etag_tableau_de_bord(await db.run_sync(lire_compteurs), limite)
+    entetes = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=entetes)
+    response.headers.update(entetes)
+
+    propositions, demandes = [], []
+    for ligne in (await db.execute(requete_tableau_de_bord(limite))).mappings():
+        commun = {
+            "id": ligne["id"], "id_utilisateur": ligne["id_utilisateur"], "statut": ligne["statut"],
+            "nom": ligne["nom"], "prenom": ligne["prenom"], "ville": ligne["ville"],
+            "telephone": ligne["telephone"], "nom_groupe": ligne["nom_groupe"],
+            "latitude": ligne["latitude"], "longitude": ligne["longitude"],
+        }
+        if ligne["type"] == "proposition":
+            propositions.append(PropositionEnAttente(
+                **commun,
+                date_proposition=ligne["date"],
+                disponibilite_date_heure=ligne["disponibilite"],
+                localisation_proposition=ligne["localisation"],
+                notes=ligne["texte"],
+                id_groupe_sanguin=ligne["id_groupe"],
+            ))
+        else:
+            demandes.append(DemandeEnAttente(
+                **commun,
+                date_demande=ligne["date"],
+                localisation_demande=ligne["localisation"],
+                description=ligne["texte"],
+                id_groupe_sanguin_requis=ligne["id_groupe"],
+                quantite_demandee_ml=ligne["quantite"],
+                urgence=ligne["urgence"],
+            ))
+    return TableauDeBordAdmin(propositions=propositions, demandes=demandes)
+
+
+# --- Export des données (Accessible par les administrateurs) ---
+
+@router.get("/export/{table}")
+async def export_table(
+    table: str,
+    format: str = "ndjson",
+    date_debut: Optional[datetime] = None,
+    date_fin: Optional[datetime] = None,
+    current_admin: Principal = Depends(get_current_admin_user)
+):
+    tables = tables_export()
+    if table not in tables:
+        raise HTTPException(status_code=404, detail=f"Table d'export inconnue. Tables disponibles: {', '.join(tables)}")
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Format d'export invalide (ndjson ou csv)")
+
+    modele, colonnes, colonne_date = tables[table]
+    requete = select(*colonnes).order_by(modele.id)
+    if date_debut or date_fin:
+        if colonne_date is None:
+            raise HTTPException(status_code=400, detail="Filtre de date non disponible pour cette table")
+        requete = filtrer_periode(requete, colonne_date, date_debut, date_fin)
+
+    noms = [c.name for c in colonnes]
+    generateur = generer_export_async if DATABASE_ASYNC else generer_export_sync
+    return StreamingResponse(
+        generateur(requete, noms, format),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'},
+    )
+
+
+# --- Événements en temps réel (WebSocket / SSE) ---
+# Filtres optionnels : groupe (id du groupe sanguin), ville, urgence, types (liste
+# séparée par des virgules, ex. "demande_creee,affectation_creee").
+
+@router.websocket("/ws/events")
+async def websocket_events(
+    websocket: WebSocket,
+    groupe: Optional[int] = None, ville: Optional[str] = None,
+    urgence: Optional[str] = None, types: Optional[str] = None
+):
+    await websocket.accept()
+    abonnement = bus_evenements.abonner(*filtres_evenements(groupe, ville, urgence, types))
+
+    async def surveiller_deconnexion():
+        # Les messages du client sont ignorés ; seule la fermeture nous intéresse
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    deconnexion = asyncio.ensure_future(surveiller_deconnexion())
+    try:
+        while not deconnexion.done():
+            lecture = asyncio.ensure_future(abonnement.suivant())
+            await asyncio.wait({lecture, deconnexion}, return_when=asyncio.FIRST_COMPLETED)
+            if not lecture.done():
+                lecture.cancel()
+                break
+            await websocket.send_text(orjson.dumps(lecture.result()).decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        deconnexion.cancel()
+        bus_evenements.desabonner(abonnement)
+
+@router.get("/events/stream")
+async def sse_events(
+    request: Request,
+    groupe: Optional[int] = None, ville: Optional[str] = None,
+    urgence: Optional[str] = None, types: Optional[str] = None
+):
+    """Même flux que /ws/events au format Server-Sent Events (EventSource côté navigateur)."""
+    abonnement = bus_evenements.abonner(*filtres_evenements(groupe, ville, urgence, types))
+
+    async def flux():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    evenement = await asyncio.wait_for(abonnement.suivant(), EVENEMENTS_PING_SECONDES)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n" # Maintient la connexion et détecte les clients partis
+                    continue
+                yield b"event: " + evenement["type"].encode() + b"\ndata: " + orjson.dumps(evenement) + b"\n\n"
+        finally:
+            bus_evenements.desabonner(abonnement)
+
+    return StreamingResponse(
+        flux(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- Métriques (format Prometheus) ---
+@router.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    moteurs = {"sync": obtenir_moteur()}
+    if DATABASE_ASYNC:
+        moteurs["async"] = obtenir_moteur_async().sync_engine
+    pools = {nom: statistiques_pool(moteur) for nom, moteur in moteurs.items()}
+    familles = {
+        "pool_connexions_utilisees": ("gauge", "Connexions actuellement empruntées au pool.", "utilisees"),
+        "pool_connexions_disponibles": ("gauge", "Connexions ouvertes et libres dans le pool.", "disponibles"),
+        "pool_debordement": ("gauge", "Connexions ouvertes au-delà de la taille du pool.", "debordement"),
+        "pool_attentes_total": ("counter", "Obtentions de connexion.", "attentes"),
+        "pool_attente_secondes_total": ("counter", "Temps total passé à obtenir une connexion.", "attente_totale_s"),
+        "pool_delais_depasses_total": ("counter", "Obtentions abandonnées après DB_POOL_TIMEOUT.", "delais_depasses"),
+    }
+    supplementaires = {
+        nom: (type_metrique, aide, [
+            (f'moteur="{moteur}"', stats[cle]) for moteur, stats in pools.items() if stats.get(cle) is not None
+        ])
+        for nom, (type_metrique, aide, cle) in familles.items()
+    }
+    supplementaires["base_disponible"] = ("gauge", "Résultat de la dernière vérification de la base (1 = ok).", [("", int(etat_base["ok"]))])
+    return PlainTextResponse(metriques.exposer(supplementaires), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # --- Endpoint de connexion (sans JWT complet, juste vérification des identifiants) ---
-@app.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(Utilisateur).filter(Utilisateur.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.mot_de_passe_hache):
+@router.post("/token", response_model=Token)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(Utilisateur).where(Utilisateur.email == form_data.username))
+    if user:
+        valide, nouveau_hache = await executer_hachage(
+            pwd_context.verify_and_update, form_data.password, user.mot_de_passe_hache
+        )
+    if not user or not valide:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Identifiants incorrects",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    # CORRECTION: Inclure l'ID et le rôle de l'utilisateur dans le token d'accès
-    # En production, ce serait un vrai JWT chiffré qui contiendrait ces informations.
-    # Pour cette démo, on les met directement dans le "token" pour le frontend.
-    access_token_data = {
-        "email": user.email,
+    if nouveau_hache:
+        # Facteur de coût modifié depuis le hachage initial (CryptContext.needs_update)
+        user.mot_de_passe_hache = nouveau_hache
+        await db.commit()
+    # Jeton signé portant l'ID, le rôle et la version de jeton de l'utilisateur ;
+    # l'ID, l'email et le rôle sont aussi renvoyés en clair pour le frontend.
+    access_token = creer_jeton_acces({
+        "id": user.id,
+        "role": user.role,
+        "ver": user.version_jeton or 0,
+    })
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
         "id": user.id,
-        "role": user.role
+        "email": user.email,
+        "role": user.role,
     }
-    # Convertir le dictionnaire en chaîne JSON pour le renvoyer comme access_token
-    return {"access_token": json.dumps(access_token_data), "token_type": "bearer"}
 
+@router.post("/utilisateurs/{user_id}/revoquer-jetons", status_code=status.HTTP_204_NO_CONTENT)
+async def revoquer_jetons_utilisateur(
+    user_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin_user)
+):
+    """Invalide tous les jetons déjà émis pour cet utilisateur (délai max : AUTH_CACHE_TTL_SECONDES sur les autres workers)."""
+    resultat = await db.execute(
+        update(Utilisateur).where(Utilisateur.id == user_id).values(version_jeton=Utilisateur.version_jeton + 1)
+    )
+    if resultat.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+    await db.commit()
+    invalider_principal(user_id)
 
-# --- Endpoint de Statistiques (Accessible par les administrateurs) ---
-@app.get("/stats/", response_model=dict)
-async def get_stats(db: Session = Depends(get_db), current_admin: Utilisateur = Depends(get_current_admin_user)):
-    total_users = db.query(Utilisateur).count()
-    total_normal_users = db.query(Utilisateur).filter(Utilisateur.role == "normal").count()
-    total_admins = db.query(Utilisateur).filter(Utilisateur.role == "admin").count()
-    
-    total_propositions = db.query(PropositionDon).count()
-    propositions_en_attente = db.query(PropositionDon).filter(PropositionDon.statut == "en attente").count()
-    propositions_affectees = db.query(PropositionDon).filter(PropositionDon.statut == "affectée").count()
-
-    total_demandes = db.query(DemandeDon).count()
-    demandes_en_attente = db.query(DemandeDon).filter(DemandeDon.statut == "en attente").count()
-    demandes_affectees = db.query(DemandeDon).filter(DemandeDon.statut == "affectée").count()
 
-    total_affectations = db.query(AffectationDon).count()
+# --- Endpoint de Statistiques (Accessible par les administrateurs) ---
+@router.get("/stats/", response_model=dict)
+async def get_stats(db: AsyncSession = Depends(get_db), current_admin: Principal = Depends(get_current_admin_user)):
+    compteurs = await db.run_sync(lire_compteurs)
+    def total(prefixe):
+        return sum(v for nom, v in compteurs.items() if nom.startswith(prefixe + ":"))
 
     return {
-        "total_utilisateurs": total_users,
-        "utilisateurs_normaux": total_normal_users,
-        "administrateurs": total_admins,
-        "total_propositions_don": total_propositions,
-        "propositions_en_attente": propositions_en_attente,
-        "propositions_affectees": propositions_affectees,
-        "total_demandes_don": total_demandes,
-        "demandes_en_attente": demandes_en_attente,
-        "demandes_affectees": demandes_affectees,
-        "total_affectations": total_affectations
+        "total_utilisateurs": total("utilisateurs"),
+        "utilisateurs_normaux": compteurs.get("utilisateurs:normal", 0),
+        "administrateurs": compteurs.get("utilisateurs:admin", 0),
+        "total_propositions_don": total("propositions"),
+        "propositions_en_attente": compteurs.get("propositions:en attente", 0),
+        "propositions_affectees": compteurs.get("propositions:affectée", 0),
+        "total_demandes_don": total("demandes"),
+        "demandes_en_attente": compteurs.get("demandes:en attente", 0),
+        "demandes_affectees": compteurs.get("demandes:affectée", 0),
+        "total_affectations": compteurs.get("affectations:total", 0)
     }
 
+# Granularité -> (période par défaut, période maximale)
+SERIE_DUREES = {"heure": (timedelta(days=7), timedelta(days=31)), "jour": (timedelta(days=90), timedelta(days=1100))}
+DIMENSIONS_SERIE = {
+    "groupe": AgregatPeriode.id_groupe_sanguin, "ville": AgregatPeriode.ville, "statut": AgregatPeriode.statut,
+}
+
+@router.get("/stats/timeseries", response_model=List[PointSerie])
+async def get_stats_timeseries(
+    granularite: str = "jour", date_debut: Optional[datetime] = None, date_fin: Optional[datetime] = None,
+    type_don: Optional[str] = None, id_groupe_sanguin: Optional[int] = None, ville: Optional[str] = None,
+    statut: Optional[str] = None, dimensions: str = "",
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin_user)
+):
+    """
+    Offre et demande par tranche (`heure` ou `jour`) sur [date_debut, date_fin[
+    (7 ou 90 derniers jours par défaut). Les filtres et `dimensions` ("groupe,ville,statut")
+    ventilent les points ; sans dimension, une série par type_don. Lit uniquement
+    la table AgregatPeriode (voir reconstruire_agregats.py pour l'historique).
+    """
+    if granularite not in GRANULARITES:
+        raise HTTPException(status_code=400, detail="Granularité invalide (heure ou jour)")
+    if type_don not in (None, "demande", "proposition"):
+        raise HTTPException(status_code=400, detail="Type de don invalide (demande ou proposition)")
+    noms_dimensions = [d.strip() for d in dimensions.split(",") if d.strip()]
+    if any(d not in DIMENSIONS_SERIE for d in noms_dimensions):
+        raise HTTPException(status_code=400, detail="Dimensions invalides (groupe, ville, statut)")
+    date_fin = date_fin or datetime.now()
+    date_debut = date_debut or date_fin - SERIE_DUREES[granularite][0]
+    if date_debut >= date_fin:
+        raise HTTPException(status_code=400, detail="date_debut doit précéder date_fin")
+    if date_fin - date_debut > SERIE_DUREES[granularite][1]:
+        raise HTTPException(status_code=400, detail=f"Période trop longue pour la granularité {granularite}")
+
+    colonnes = [DIMENSIONS_SERIE[d] for d in dict.fromkeys(noms_dimensions)]
+    requete = filtrer(
+        select(
+            AgregatPeriode.debut, AgregatPeriode.type_don, *colonnes,
+            func.sum(AgregatPeriode.nombre).label("nombre"), func.sum(AgregatPeriode.quantite_ml).label("quantite_ml"),
+        ),
+        {
+            AgregatPeriode.type_don: type_don, AgregatPeriode.statut: statut,
+            AgregatPeriode.id_groupe_sanguin: id_groupe_sanguin, AgregatPeriode.ville: ville,
+        },
+    ).where(
+        AgregatPeriode.granularite == granularite,
+        AgregatPeriode.debut >= debut_tranche(date_debut, granularite),
+        AgregatPeriode.debut < date_fin,
+    ).group_by(AgregatPeriode.debut, AgregatPeriode.type_don, *colonnes).order_by(
+        AgregatPeriode.debut, AgregatPeriode.type_don, *colonnes
+    )
+    points = []
+    for ligne in (await db.execute(requete)).mappings():
+        if not ligne["nombre"] and not ligne["quantite_ml"]:
+            continue
+        point = dict(ligne)
+        if point.get("id_groupe_sanguin") == 0:
+            point["id_groupe_sanguin"] = None
+        if point.get("ville") == "":
+            point["ville"] = None
+        points.append(point)
+    return points
+
+
+# --- Schéma de la base (étape unique de déploiement) ---
+# Exécutée une fois avant le démarrage des workers (voir serveur.py), jamais par
+# worker. Crée les tables manquantes, puis ajoute aux tables existantes les colonnes
+# et index déclarés depuis leur création.
+
+# Index remplacés par un index composite dont ils sont un préfixe : supprimés des bases existantes
+INDEX_REMPLACES = {
+    "Utilisateur": [
+        "ix_Utilisateur_id_groupe_sanguin", "ix_Utilisateur_ville_groupe", "ix_Utilisateur_ville", "ix_Utilisateur_role",
+    ],
+    "DemandeDon": ["ix_DemandeDon_id_groupe_sanguin_requis", "ix_DemandeDon_statut_groupe_date_demande_id"],
+}
+
+def migrer_schema(moteur=None) -> List[str]:
+    """Retourne les instructions exécutées sur les tables existantes."""
+    moteur = moteur or obtenir_moteur()
+    Base.metadata.create_all(bind=moteur)
+    instructions = []
+    with moteur.begin() as connexion:
+        inspecteur = inspect(connexion)
+        preparateur = connexion.dialect.identifier_preparer
+        for table in Base.metadata.sorted_tables:
+            existantes = {c["name"] for c in inspecteur.get_columns(table.name)}
+            for colonne in table.columns:
+                if colonne.name in existantes:
+                    continue
+                if not colonne.nullable and colonne.server_default is None:
+                    journal.warning("Colonne %s.%s obligatoire sans valeur par défaut : migration manuelle requise", table.name, colonne.name)
+                    continue
+                instruction = (
+                    f"ALTER TABLE {preparateur.format_table(table)} "
+                    f"ADD COLUMN {CreateColumn(colonne).compile(dialect=connexion.dialect)}"
+                )
+                connexion.execute(text(instruction))
+                instructions.append(instruction)
+            index_existants = {i["name"] for i in inspecteur.get_indexes(table.name)}
+            for nom in INDEX_REMPLACES.get(table.name, []):
+                if nom in index_existants:
+                    instruction = f"DROP INDEX {preparateur.quote(nom)}"
+                    if connexion.dialect.name in ("mysql", "mariadb"):
+                        instruction += f" ON {preparateur.format_table(table)}"
+                    connexion.execute(text(instruction))
+                    instructions.append(instruction)
+            for index in sorted(table.indexes, key=lambda i: i.name):
+                if index.name not in index_existants:
+                    index.create(connexion)
+                    instructions.append(f"CREATE INDEX {index.name}")
+    return instructions
+
+
+# --- Arrêt du worker ---
+# Dernière étape de l'arrêt : uvicorn y arrive une fois les requêtes en cours
+# terminées (ou le délai de grâce écoulé) ; les connexions du pool sont fermées
+# proprement plutôt que coupées à la sortie du processus.
+async def fermer_moteurs():
+    if _pid_moteurs != os.getpid():
+        return
+    if async_engine is not None:
+        await async_engine.dispose()
+    if engine is not None:
+        await run_in_threadpool(engine.dispose)
+
+
+# --- Application ---
+
+def signaler_arret_tache(tache: asyncio.Task):
+    # Les boucles ne rattrapent que les erreurs de base et d'E/S : toute autre
+    # exception les arrête et doit apparaître dans les logs dès l'arrêt
+    if not tache.cancelled() and tache.exception() is not None:
+        journal.error("Tâche de fond %s arrêtée", tache.get_name(), exc_info=tache.exception())
+
+def lancer_tache(nom: str, coroutine):
+    tache = asyncio.create_task(coroutine, name=nom)
+    tache.add_done_callback(signaler_arret_tache)
+    taches_de_fond[nom] = tache
+
+@asynccontextmanager
+async def cycle_de_vie(application: FastAPI):
+    """
+    Démarrage du worker (cache de référence, tâches périodiques) puis, à l'arrêt,
+    annulation des tâches, relais des derniers événements et fermeture des pools.
+    """
+    await charger_cache_reference()
+    if STATS_RECONCILIATION_SECONDES > 0:
+        lancer_tache("reconciliation", boucle_reconciliation_compteurs())
+    if EVENEMENTS_PARTAGES:
+        lancer_tache("relais_evenements", boucle_relais_evenements())
+    if ELIGIBILITE_RECALCUL_SECONDES > 0:
+        lancer_tache("eligibilite", boucle_recalcul_eligibilite())
+    lancer_tache("verification_base", boucle_verification_base())
+    yield
+    for tache in taches_de_fond.values():
+        tache.cancel()
+    taches_de_fond.clear()
+    if EVENEMENTS_PARTAGES:
+        await vider_relais_evenements()
+    await fermer_moteurs()
+
+def create_app() -> FastAPI:
+    """
+    Construit l'application sans toucher à la base. Les routes du module sont
+    partagées telles quelles (pas de reconstruction des dépendances ni des
+    modèles de réponse, contrairement à include_router).
+    """
+    application = FastAPI(routes=router.routes, lifespan=cycle_de_vie)
+    configurer_cors(application)
+    application.add_middleware(MiddlewareMetriques)
+    return application
+
+# `uvicorn main:app` et les scripts existants
+app = create_app()
+
 
 # --- Bloc d'exécution principal du script ---
+# Un seul processus, pour le développement ; en production : python serveur.py
 if __name__ == "__main__":
     print("Tentative de création des tables dans la base de données...")
     try:
-        Base.metadata.create_all(bind=engine)
+        for instruction in migrer_schema():
+            print(f"  {instruction}")
         print("Tables créées avec succès ou déjà existantes.")
     except SQLAlchemyError as e:
         print(f"Erreur lors de la création des tables: {e}")
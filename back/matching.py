@@ -0,0 +1,209 @@
+# MonProjetDonDuSang_Backend/matching.py
+
+"""Index en mémoire des dons en attente et appariement selon la compatibilité ABO/Rh."""
+
+import heapq
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from geographie import IndexSpatial, Position
+
+# --- Compatibilité ABO/Rh (donneur -> receveurs) ---
+COMPATIBILITE_DONNEUR_RECEVEUR = {
+    "O-": ("O-", "O+", "A-", "A+", "B-", "B+", "AB-", "AB+"),
+    "O+": ("O+", "A+", "B+", "AB+"),
+    "A-": ("A-", "A+", "AB-", "AB+"),
+    "A+": ("A+", "AB+"),
+    "B-": ("B-", "B+", "AB-", "AB+"),
+    "B+": ("B+", "AB+"),
+    "AB-": ("AB-", "AB+"),
+    "AB+": ("AB+",),
+}
+
+# Ordre de priorité des urgences (plus petit = plus prioritaire)
+RANG_URGENCE = {
+    "critique": 0,
+    "élevée": 1,
+    "haute": 1,
+    "moyenne": 2,
+    "faible": 3,
+}
+RANG_URGENCE_INCONNUE = len(RANG_URGENCE)
+
+
+def donneurs_compatibles(groupe_receveur: str) -> List[str]:
+    """Retourne les groupes donneurs compatibles avec un receveur, le groupe identique en premier."""
+    groupes = [
+        donneur for donneur, receveurs in COMPATIBILITE_DONNEUR_RECEVEUR.items()
+        if groupe_receveur in receveurs
+    ]
+    # On préfère le groupe identique pour préserver les donneurs universels (O-)
+    groupes.sort(key=lambda g: (g != groupe_receveur, len(COMPATIBILITE_DONNEUR_RECEVEUR[g])))
+    return groupes
+
+
+def rang_urgence(urgence: Optional[str]) -> int:
+    return RANG_URGENCE.get((urgence or "").lower(), RANG_URGENCE_INCONNUE)
+
+
+class MoteurAffectation:
+    """
+    Index en mémoire des propositions et demandes "en attente".
+
+    - propositions : groupe du donneur -> tas (date_proposition, id)
+    - demandes : (groupe requis, urgence) -> tas (date_demande, id)
+    - spatial : grille des propositions géolocalisées, par groupe du donneur
+
+    Les suppressions sont paresseuses : un identifiant retiré est simplement
+    marqué et ignoré lorsqu'il remonte en tête de tas.
+    """
+
+    def __init__(self):
+        self._verrou = threading.RLock()
+        self.reinitialiser()
+
+    def reinitialiser(self, noms_groupes: Optional[Dict[int, str]] = None):
+        with self._verrou:
+            self.noms_groupes: Dict[int, str] = dict(noms_groupes or {})
+            self._propositions: Dict[int, List[Tuple[datetime, int]]] = {}
+            self._demandes: Dict[Tuple[int, str], List[Tuple[datetime, int]]] = {}
+            self._groupe_proposition: Dict[int, int] = {}
+            self._cle_demande: Dict[int, Tuple[int, str]] = {}
+            self._spatial = IndexSpatial()
+            self.charge = noms_groupes is not None
+
+    def definir_groupe(self, id_groupe: int, nom_groupe: str):
+        with self._verrou:
+            self.noms_groupes[id_groupe] = nom_groupe
+
+    # --- Mise à jour incrémentale des index ---
+
+    def ajouter_proposition(self, id_proposition: int, id_groupe_donneur: Optional[int], date_proposition: datetime,
+                            position: Optional[Position] = None):
+        """Indexe une proposition en attente ; ignorée si le groupe du donneur est inconnu."""
+        if id_groupe_donneur is None:
+            return
+        with self._verrou:
+            if id_proposition in self._groupe_proposition:
+                return
+            self._groupe_proposition[id_proposition] = id_groupe_donneur
+            heapq.heappush(self._propositions.setdefault(id_groupe_donneur, []), (date_proposition, id_proposition))
+            if position is not None:
+                self._spatial.ajouter(id_proposition, position, id_groupe_donneur)
+
+    def ajouter_demande(self, id_demande: int, id_groupe_requis: int, urgence: str, date_demande: datetime):
+        with self._verrou:
+            if id_demande in self._cle_demande:
+                return
+            cle = (id_groupe_requis, urgence)
+            self._cle_demande[id_demande] = cle
+            heapq.heappush(self._demandes.setdefault(cle, []), (date_demande, id_demande))
+
+    def retirer_proposition(self, id_proposition: int):
+        with self._verrou:
+            self._groupe_proposition.pop(id_proposition, None)
+            self._spatial.retirer(id_proposition)
+
+    def retirer_demande(self, id_demande: int):
+        with self._verrou:
+            self._cle_demande.pop(id_demande, None)
+
+    def retirer_affectation(self, id_proposition: int, id_demande: int):
+        """À appeler après chaque affectation validée en base."""
+        with self._verrou:
+            self.retirer_proposition(id_proposition)
+            self.retirer_demande(id_demande)
+
+    @property
+    def nb_propositions(self) -> int:
+        return len(self._groupe_proposition)
+
+    def groupes_inconnus(self) -> bool:
+        """Vrai si des lignes indexées portent un groupe absent de noms_groupes (créé sur un autre worker)."""
+        with self._verrou:
+            ids_groupes = set(self._propositions) | {id_groupe for id_groupe, _ in self._demandes}
+            return not ids_groupes <= self.noms_groupes.keys()
+
+    @property
+    def nb_demandes(self) -> int:
+        return len(self._cle_demande)
+
+    @property
+    def nb_propositions_localisees(self) -> int:
+        return len(self._spatial)
+
+    # --- Appariement ---
+
+    def _tete(self, tas: List[Tuple[datetime, int]], vivants: dict, cle) -> Optional[Tuple[datetime, int]]:
+        # Purge les entrées retirées (ou réindexées ailleurs) restées en tête
+        while tas and vivants.get(tas[0][1]) != cle:
+            heapq.heappop(tas)
+        return tas[0] if tas else None
+
+    def _groupes_donneurs(self, id_groupe_requis: int) -> List[int]:
+        nom_requis = self.noms_groupes.get(id_groupe_requis)
+        if nom_requis is None:
+            return []
+        ids_par_nom = {nom: id_groupe for id_groupe, nom in self.noms_groupes.items()}
+        return [ids_par_nom[nom] for nom in donneurs_compatibles(nom_requis) if nom in ids_par_nom]
+
+    def suggerer(self, limite: int = 100) -> List[Tuple[int, int]]:
+        """
+        Retourne jusqu'à `limite` couples (id_proposition, id_demande).
+
+        Les demandes sont servies par urgence puis par ancienneté ; chacune reçoit
+        la plus ancienne proposition du groupe compatible préféré. Les index sont
+        restaurés avant de rendre la main : rien n'est consommé.
+        """
+        couples: List[Tuple[int, int]] = []
+        consommees = []
+        with self._verrou:
+            donneurs_par_groupe = {g: self._groupes_donneurs(g) for g, _ in self._demandes}
+            while len(couples) < limite:
+                meilleure = None
+                for cle, tas in self._demandes.items():
+                    tete = self._tete(tas, self._cle_demande, cle)
+                    if tete is None:
+                        continue
+                    groupe_donneur = next(
+                        (g for g in donneurs_par_groupe[cle[0]]
+                         if self._tete(self._propositions.get(g, []), self._groupe_proposition, g)),
+                        None,
+                    )
+                    if groupe_donneur is None:
+                        continue
+                    priorite = (rang_urgence(cle[1]), tete)
+                    if meilleure is None or priorite < meilleure[0]:
+                        meilleure = (priorite, cle, groupe_donneur)
+                if meilleure is None:
+                    break
+
+                _, cle, groupe_donneur = meilleure
+                entree_demande = heapq.heappop(self._demandes[cle])
+                entree_proposition = heapq.heappop(self._propositions[groupe_donneur])
+                del self._cle_demande[entree_demande[1]]
+                del self._groupe_proposition[entree_proposition[1]]
+                consommees.append((groupe_donneur, entree_proposition, cle, entree_demande))
+                couples.append((entree_proposition[1], entree_demande[1]))
+
+            # On remet les entrées consommées dans les tas (la grille spatiale n'a pas été touchée)
+            for groupe_donneur, (date_p, id_p), (groupe_requis, urgence), (date_d, id_d) in consommees:
+                self.ajouter_proposition(id_p, groupe_donneur, date_p)
+                self.ajouter_demande(id_d, groupe_requis, urgence, date_d)
+        return couples
+
+    # --- Recherche géographique ---
+
+    def propositions_proches(self, id_groupe_requis: int, position: Position, rayon_km: float,
+                             limite: int = 50) -> List[Tuple[int, float]]:
+        """
+        Propositions en attente compatibles avec le groupe requis, dans le rayon,
+        par distance croissante : liste de (id_proposition, distance_km).
+        À distance égale, le groupe identique passe avant les autres groupes compatibles.
+        """
+        with self._verrou:
+            return self._spatial.proches(
+                position, rayon_km, self._groupes_donneurs(id_groupe_requis), limite,
+                vivant=self._groupe_proposition.__contains__,
+            )
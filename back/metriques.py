@@ -0,0 +1,121 @@
+# MonProjetDonDuSang_Backend/metriques.py
+
+"""Métriques par route (latence HTTP, nombre, temps et lignes SQL) au format texte Prometheus."""
+
+import threading
+from typing import Dict, List, Optional, Tuple
+
+BORNES_DUREE_SECONDES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BORNES_REQUETES_SQL = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+
+class MesureRequete:
+    """Activité SQL d'une requête HTTP ; alimentée par les événements du moteur."""
+
+    def __init__(self, capturer_instructions: bool = False, instructions_max: int = 50):
+        self.requetes_sql = 0
+        self.duree_sql = 0.0
+        self.lignes_sql = 0
+        self.capturer_instructions = capturer_instructions
+        self.instructions_max = instructions_max
+        self.instructions: List[Tuple[float, str]] = []
+
+    def ajouter(self, instruction: str, duree: float, lignes: int):
+        self.requetes_sql += 1
+        self.duree_sql += duree
+        if lignes > 0:
+            self.lignes_sql += lignes
+        if self.capturer_instructions and len(self.instructions) < self.instructions_max:
+            self.instructions.append((duree, instruction))
+
+
+class Histogramme:
+    def __init__(self, bornes):
+        self.bornes = bornes
+        self.compteurs = [0] * len(bornes)
+        self.somme = 0.0
+        self.total = 0
+
+    def observer(self, valeur: float):
+        self.somme += valeur
+        self.total += 1
+        for i, borne in enumerate(self.bornes):
+            if valeur <= borne:
+                self.compteurs[i] += 1
+                break
+
+    def lignes(self, nom: str, etiquettes: str) -> List[str]:
+        cumul, sortie = 0, []
+        for borne, nombre in zip(self.bornes, self.compteurs):
+            cumul += nombre
+            sortie.append(f'{nom}_bucket{{{etiquettes},le="{borne}"}} {cumul}')
+        sortie.append(f'{nom}_bucket{{{etiquettes},le="+Inf"}} {self.total}')
+        sortie.append(f"{nom}_sum{{{etiquettes}}} {self.somme}")
+        sortie.append(f"{nom}_count{{{etiquettes}}} {self.total}")
+        return sortie
+
+
+class StatistiquesRoute:
+    def __init__(self):
+        self.duree = Histogramme(BORNES_DUREE_SECONDES)
+        self.requetes_sql = Histogramme(BORNES_REQUETES_SQL)
+        self.duree_sql = 0.0
+        self.lignes_sql = 0
+        self.budget_depasse = 0
+        self.statuts: Dict[int, int] = {}
+
+
+def _echapper(valeur: str) -> str:
+    return valeur.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metriques:
+    def __init__(self):
+        self._verrou = threading.Lock()
+        self._routes: Dict[Tuple[str, str], StatistiquesRoute] = {}
+
+    def enregistrer(self, methode: str, route: str, statut: int, duree: float,
+                    mesure: MesureRequete, budget_depasse: bool = False):
+        with self._verrou:
+            stats = self._routes.get((methode, route))
+            if stats is None:
+                stats = self._routes[(methode, route)] = StatistiquesRoute()
+            stats.duree.observer(duree)
+            stats.requetes_sql.observer(mesure.requetes_sql)
+            stats.duree_sql += mesure.duree_sql
+            stats.lignes_sql += mesure.lignes_sql
+            stats.budget_depasse += budget_depasse
+            stats.statuts[statut] = stats.statuts.get(statut, 0) + 1
+
+    def exposer(self, supplementaires: Optional[Dict[str, Tuple[str, str, List[Tuple[str, float]]]]] = None) -> str:
+        """
+        Texte d'exposition Prometheus. `supplementaires` : familles calculées à la
+        demande, nom -> (type, aide, [(étiquettes, valeur)]), ex. l'état du pool.
+        """
+        with self._verrou:
+            routes = sorted(self._routes.items())
+            familles = {
+                "http_requetes_total": ("counter", "Requêtes HTTP par route et statut.", []),
+                "http_requete_duree_secondes": ("histogram", "Durée des requêtes HTTP.", []),
+                "sql_requetes_par_requete": ("histogram", "Nombre de requêtes SQL par requête HTTP.", []),
+                "sql_duree_secondes_total": ("counter", "Temps passé dans les requêtes SQL.", []),
+                "sql_lignes_total": ("counter", "Lignes renvoyées ou modifiées (selon ce que le pilote rapporte).", []),
+                "sql_budget_depasse_total": ("counter", "Requêtes HTTP ayant dépassé le budget SQL de leur route.", []),
+            }
+            for (methode, route), stats in routes:
+                etiquettes = f'methode="{methode}",route="{_echapper(route)}"'
+                for statut, nombre in sorted(stats.statuts.items()):
+                    familles["http_requetes_total"][2].append(f'http_requetes_total{{{etiquettes},statut="{statut}"}} {nombre}')
+                familles["http_requete_duree_secondes"][2].extend(stats.duree.lignes("http_requete_duree_secondes", etiquettes))
+                familles["sql_requetes_par_requete"][2].extend(stats.requetes_sql.lignes("sql_requetes_par_requete", etiquettes))
+                familles["sql_duree_secondes_total"][2].append(f"sql_duree_secondes_total{{{etiquettes}}} {stats.duree_sql}")
+                familles["sql_lignes_total"][2].append(f"sql_lignes_total{{{etiquettes}}} {stats.lignes_sql}")
+                familles["sql_budget_depasse_total"][2].append(f"sql_budget_depasse_total{{{etiquettes}}} {stats.budget_depasse}")
+
+        sortie = []
+        for nom, (type_metrique, aide, lignes) in familles.items():
+            sortie += [f"# HELP {nom} {aide}", f"# TYPE {nom} {type_metrique}", *lignes]
+        for nom, (type_metrique, aide, valeurs) in (supplementaires or {}).items():
+            sortie += [f"# HELP {nom} {aide}", f"# TYPE {nom} {type_metrique}"]
+            sortie += [f"{nom}{{{etiquettes}}} {valeur}" if etiquettes else f"{nom} {valeur}" for etiquettes, valeur in valeurs]
+        return "\n".join(sortie) + "\n"
@@ -0,0 +1,40 @@
+# MonProjetDonDuSang_Backend/reconstruire_agregats.py
+
+# Reconstruit la table AgregatPeriode (tranches horaires et journalières servies
+# par /stats/timeseries) à partir des demandes et propositions existantes. À lancer
+# une fois après le déploiement de la table, puis au besoin pour corriger une
+# période ; de préférence hors trafic, les tranches recalculées étant remplacées.
+#
+# Usage (depuis back/) :
+#   python reconstruire_agregats.py                       # tout l'historique
+#   python reconstruire_agregats.py --depuis 2024-01-01   # à partir de ce jour
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+RACINE_BACK = os.path.dirname(os.path.abspath(__file__))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Reconstruit les agrégats temporels d'offre et de demande.")
+    parser.add_argument("--depuis", type=datetime.fromisoformat, default=None,
+                        help="Date ISO (AAAA-MM-JJ) : seules les tranches à partir de ce jour sont recalculées")
+    args = parser.parse_args()
+
+    sys.path.insert(0, RACINE_BACK)
+    os.environ.setdefault("SECRET_KEY", "reconstruction-agregats") # Aucun jeton n'est signé ici
+    import main
+
+    main.migrer_schema()
+    debut = time.perf_counter()
+    with main.ouvrir_session() as db:
+        nombre = main.reconstruire_agregats(db, args.depuis)
+    print(f"{nombre} tranche(s) écrite(s) en {time.perf_counter() - debut:.1f} s.")
+    main.obtenir_moteur().dispose()
+
+
+if __name__ == "__main__":
+    main_cli()
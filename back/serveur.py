@@ -0,0 +1,104 @@
+# MonProjetDonDuSang_Backend/serveur.py
+
+# Lanceur de production : migre le schéma une seule fois, puis démarre N workers
+# uvicorn (uvloop et httptools lorsqu'ils sont installés) qui servent main:app.
+# Chaque worker crée ses propres moteurs au premier usage. À la réception de
+# SIGTERM ou SIGINT, les workers cessent d'accepter des connexions, laissent
+# finir les requêtes en cours (au plus --delai-arret secondes) puis ferment leurs
+# pools de connexions.
+#
+# Les index d'appariement de chaque worker se recalent sur la base (tampon de
+# version) ; les événements temps réel sont relayés entre workers par la base dès
+# qu'il y en a plusieurs (EVENEMENTS_PARTAGES, à activer aussi sur les réplicas).
+#
+# Usage (depuis back/) :
+#   python serveur.py                       # WEB_CONCURRENCY workers, sinon un par cœur
+#   python serveur.py --workers 4 --port 8000
+#   python serveur.py --migrer-seulement    # étape de déploiement (job, initContainer)
+#   python serveur.py --sans-migration      # réplicas supplémentaires : schéma déjà migré
+#
+# Avec gunicorn : gunicorn -k uvicorn.workers.UvicornWorker -w 4 main:app
+# (--preload est sûr : les moteurs sont recréés dans chaque worker après le fork ;
+# avec plusieurs workers, définir EVENEMENTS_PARTAGES=true).
+
+import argparse
+import importlib.util
+import os
+import secrets
+import sys
+
+RACINE_BACK = os.path.dirname(os.path.abspath(__file__))
+
+
+def disponible(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def partager_cle_secrete():
+    """
+    Les workers héritent de l'environnement du maître : une clé générée ici est la
+    même pour tous. Elle change à chaque lancement et n'est pas partagée avec
+    d'autres réplicas ; en production, fournir SECRET_KEY.
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv(os.path.join(RACINE_BACK, ".env"))
+    if not os.getenv("SECRET_KEY"):
+        os.environ["SECRET_KEY"] = secrets.token_urlsafe(32)
+        print("Avertissement: SECRET_KEY non définie, clé générée pour ce lancement (jetons invalidés au redémarrage).")
+
+
+def migrer():
+    """Migration dans le processus maître ; ses connexions sont fermées avant le démarrage des workers."""
+    sys.path.insert(0, RACINE_BACK)
+    import main
+
+    instructions = main.migrer_schema()
+    for instruction in instructions:
+        print(f"  {instruction}")
+    print(f"Schéma à jour ({len(instructions)} modification(s)).")
+    main.obtenir_moteur().dispose()
+    return main
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Lance l'API avec plusieurs workers uvicorn.")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY") or os.cpu_count() or 1))
+    parser.add_argument("--delai-arret", type=int, default=int(os.getenv("ARRET_DELAI_SECONDES", "30")),
+                        help="Délai de grâce (s) accordé aux requêtes en cours à l'arrêt")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    migration = parser.add_mutually_exclusive_group()
+    migration.add_argument("--migrer-seulement", action="store_true")
+    migration.add_argument("--sans-migration", action="store_true")
+    args = parser.parse_args()
+
+    partager_cle_secrete()
+    if not args.sans_migration:
+        main = migrer()
+        if args.migrer_seulement:
+            return
+        # Chaque worker ouvre jusqu'à pool_size + max_overflow connexions
+        print(f"{args.workers} worker(s) x {main.DB_POOL_SIZE + main.DB_MAX_OVERFLOW} connexion(s) au plus par pool.")
+
+    if args.workers > 1:
+        os.environ.setdefault("EVENEMENTS_PARTAGES", "true")
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        app_dir=RACINE_BACK,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="uvloop" if disponible("uvloop") else "asyncio",
+        http="httptools" if disponible("httptools") else "h11",
+        lifespan="on",
+        timeout_graceful_shutdown=args.delai_arret,
+        log_level=args.log_level,
+    )
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -25,20 +25,20 @@ function AdminAssignmentPage() {
     setLoading(true);
     setError('');
     try {
-      // Récupérer les propositions de don
-      const propositionsRes = await fetch(`${API_BASE_URL}/propositionsdon/`);
-      if (!propositionsRes.ok) throw new Error('Erreur chargement propositions');
-      const propositionsData = await propositionsRes.json();
-      setPropositions(propositionsData.filter(p => p.statut === 'en attente')); // Filtrer les "en attente"
-
-      // Récupérer les demandes de don
-      const demandesRes = await fetch(`${API_BASE_URL}/demandesdon/`);
-      if (!demandesRes.ok) throw new Error('Erreur chargement demandes');
-      const demandesData = await demandesRes.json();
-      setDemandes(demandesData.filter(d => d.statut === 'en attente')); // Filtrer les "en attente"
+      // Récupérer les propositions et demandes en attente (déjà filtrées et jointes côté serveur).
+      // Le navigateur revalide avec l'ETag : un rafraîchissement sans changement renvoie 304.
+      const dashboardRes = await fetch(`${API_BASE_URL}/admin/dashboard`, {
+        headers: { 'Authorization': `Bearer ${user.token}` },
+      });
+      if (!dashboardRes.ok) throw new Error('Erreur chargement propositions et demandes');
+      const dashboardData = await dashboardRes.json();
+      setPropositions(dashboardData.propositions);
+      setDemandes(dashboardData.demandes);
 
       // Récupérer les affectations existantes
-      const affectationsRes = await fetch(`${API_BASE_URL}/affectationsdon/`);
+      const affectationsRes = await fetch(`${API_BASE_URL}/affectationsdon/`, {
+        headers: { 'Authorization': `Bearer ${user.token}` },
+      });
       if (!affectationsRes.ok) throw new Error('Erreur chargement affectations');
       const affectationsData = await affectationsRes.json();
       setAffectations(affectationsData);
@@ -83,8 +83,7 @@ function AdminAssignmentPage() {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
-          // En production, vous ajouteriez ici le token d'autorisation JWT
-          // 'Authorization': `Bearer ${user.token}`
+          'Authorization': `Bearer ${user.token}`,
         },
         body: JSON.stringify(newAssignment),
       });
@@ -196,7 +195,7 @@ function AdminAssignmentPage() {
                   <option value="">-- Choisir une proposition --</option>
                   {propositions.map((prop) => (
                     <option key={prop.id} value={prop.id}>
-                      Prop. #{prop.id} - Utilisateur: {prop.id_utilisateur} - {prop.localisation_proposition}
+                      Prop. #{prop.id} - {prop.prenom} {prop.nom} ({prop.nom_groupe || '?'}) - {prop.localisation_proposition}
                     </option>
                   ))}
                 </select>
@@ -222,7 +221,7 @@ function AdminAssignmentPage() {
                   <option value="">-- Choisir une demande --</option>
                   {demandes.map((dem) => (
                     <option key={dem.id} value={dem.id}>
-                      Dem. #{dem.id} - Groupe: {dem.id_groupe_sanguin_requis} - {dem.quantite_demandee_ml}ml - {dem.urgence}
+                      Dem. #{dem.id} - Groupe: {dem.nom_groupe || dem.id_groupe_sanguin_requis} - {dem.quantite_demandee_ml}ml - {dem.urgence}
                     </option>
                   ))}
                 </select>
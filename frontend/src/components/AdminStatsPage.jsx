@@ -2,7 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { useAuth } from '../context/AuthContext';
 
 function AdminStatsPage() {
-  const { isAdmin } = useAuth();
+  const { user, isAdmin } = useAuth();
   const [stats, setStats] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
@@ -20,7 +20,9 @@ function AdminStatsPage() {
       setLoading(true);
       setError('');
       try {
-        const response = await fetch(`${API_BASE_URL}/stats/`);
+        const response = await fetch(`${API_BASE_URL}/stats/`, {
+          headers: { 'Authorization': `Bearer ${user.token}` },
+        });
         if (!response.ok) {
           throw new Error('Erreur lors de la récupération des statistiques');
         }
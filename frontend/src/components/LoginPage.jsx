@@ -32,12 +32,13 @@ function LoginPage({ onNavigate }) {
       }
 
       const data = await response.json();
-      const userDataFromToken = JSON.parse(data.access_token);
       
+      // Le jeton est signé côté serveur : il est conservé tel quel pour l'en-tête Authorization
       login({ 
-        email: userDataFromToken.email, 
-        id: userDataFromToken.id, 
-        role: userDataFromToken.role 
+        email: data.email, 
+        id: data.id, 
+        role: data.role,
+        token: data.access_token
       }); 
 
     } catch (err) {
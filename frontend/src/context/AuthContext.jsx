@@ -32,7 +32,7 @@ export const AuthProvider = ({ children }) => {
       try {
         const parsedUser = JSON.parse(storedUser);
         // S'assurer que les propriétés essentielles sont présentes après parsing
-        if (parsedUser && parsedUser.id && parsedUser.email && parsedUser.role) {
+        if (parsedUser && parsedUser.id && parsedUser.email && parsedUser.role && parsedUser.token) {
             setUser(parsedUser);
         } else {
             console.warn("Données utilisateur incomplètes dans localStorage. Nettoyage.");